@@ -16,20 +16,57 @@ https://docs.djangoproject.com/en/5.2/howto/deployment/asgi/
 # application = get_asgi_application()
 import os
 from channels.routing import ProtocolTypeRouter, URLRouter
-from channels.auth import AuthMiddlewareStack
 from django.core.asgi import get_asgi_application
 from core.middleware.jwt_auth_middleware import JWTAuthMiddleware
 import wsapp.routing  # your WebSocket routing
 
 os.environ.setdefault("DJANGO_SETTINGS_MODULE", "backserver.settings")
 
-application = ProtocolTypeRouter({
-    "http": get_asgi_application(),
+django_asgi_app = get_asgi_application()
+
+from core import live  # noqa: E402  (needs the app registry loaded above)
+from wsapp.caller import start_auto_caller  # noqa: E402
+
+
+class Startup:
+    """
+    Starts this process's background work once the server is up: the
+    write-behind of live round state and the auto-caller (draws for rounds
+    handed to the server), on the server's event loop. Servers that send
+    lifespan events (uvicorn) start it on lifespan.startup; daphne has none,
+    so there it starts with the first connection. Importing this module
+    (management commands, tests) starts nothing.
+    """
+
+    def __init__(self, inner):
+        self.inner = inner
+        self.started = False
+
+    def start(self):
+        if not self.started:
+            self.started = True
+            live.start_flusher()
+            start_auto_caller()
+
+    async def __call__(self, scope, receive, send):
+        self.start()
+        if scope["type"] != "lifespan":
+            return await self.inner(scope, receive, send)
+        while True:
+            message = await receive()
+            if message["type"] == "lifespan.startup":
+                await send({"type": "lifespan.startup.complete"})
+            elif message["type"] == "lifespan.shutdown":
+                await send({"type": "lifespan.shutdown.complete"})
+                return
+
+
+application = Startup(ProtocolTypeRouter({
+    "http": django_asgi_app,
+    # JWTAuthMiddleware sets scope["user"]; sockets don't use Django sessions
     "websocket":  JWTAuthMiddleware(
-        AuthMiddlewareStack(
-            URLRouter(
-                wsapp.routing.websocket_urlpatterns
-            )
+        URLRouter(
+            wsapp.routing.websocket_urlpatterns
         )
     ),
-})
+}))
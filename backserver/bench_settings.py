@@ -0,0 +1,32 @@
+"""
+Settings for the local benchmarks (manage.py bench_winners --settings=backserver.bench_settings):
+an in-memory SQLite database and channel layer, so nothing needs the network.
+
+BENCH_REDIS_URL swaps in a Redis channel layer (and with it the Redis live
+store) for the websocket load test (manage.py loadtest_ws): the in-memory
+layer scans every channel on each receive, which dominates beyond a few
+thousand sockets.
+"""
+import os
+
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': ':memory:',
+    }
+}
+
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+    },
+}
+if os.getenv("BENCH_REDIS_URL"):
+    CHANNEL_LAYERS = {
+        "default": {
+            "BACKEND": "channels_redis.core.RedisChannelLayer",
+            "CONFIG": {"hosts": [os.getenv("BENCH_REDIS_URL")]},
+        },
+    }
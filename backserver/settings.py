@@ -116,6 +116,50 @@ CHANNEL_LAYERS = {
     },
 }
 
+# Ticket checking backend used by core.ops.GameWinnerHandler: "engine", "checker" or "numpy"
+WINNER_CHECK_BACKEND = os.getenv("WINNER_CHECK_BACKEND", "engine")
+# Rounds whose compiled tickets each process keeps in memory (least recently used are evicted)
+ROUND_TICKET_CACHE_ROUNDS = int(os.getenv("ROUND_TICKET_CACHE_ROUNDS", "64"))
+# Live round state (core.live): "redis" (the channel layer's Redis) or "memory" (per process,
+# tests and development); empty follows CHANNEL_LAYERS
+ROUND_STATE_STORE = os.getenv("ROUND_STATE_STORE", "")
+# Seconds between write-behind flushes of live draw state to the database (0 = only at round end / pause)
+ROUND_STATE_FLUSH_INTERVAL = float(os.getenv("ROUND_STATE_FLUSH_INTERVAL", "2"))
+# WebSocket principals cached per process (core.principals): max users and seconds each is kept
+WS_PRINCIPAL_CACHE_SIZE = int(os.getenv("WS_PRINCIPAL_CACHE_SIZE", "10000"))
+WS_PRINCIPAL_CACHE_TTL = float(os.getenv("WS_PRINCIPAL_CACHE_TTL", "300"))
+# Background winner checks (wsapp.pipeline): worker queues per process (0 checks
+# inline with the draw) and how many checks each queue holds before draws wait
+WINNER_PIPELINE_WORKERS = int(os.getenv("WINNER_PIPELINE_WORKERS", "4"))
+WINNER_PIPELINE_DEPTH = int(os.getenv("WINNER_PIPELINE_DEPTH", "256"))
+# Coalescing of room broadcasts (wsapp.coalesce): how long a room's first pending
+# event may wait for others (0 = off), and how many events flush a room at once
+WS_COALESCE_WINDOW_MS = float(os.getenv("WS_COALESCE_WINDOW_MS", "0"))
+WS_COALESCE_MAX_EVENTS = int(os.getenv("WS_COALESCE_MAX_EVENTS", "32"))
+# Per-socket outbound queues (wsapp.outbox): frames queued before a lagging client's
+# draws are replaced by one snapshot (0 = send directly), and closing sockets that
+# needed more than WS_SLOW_CLIENT_MAX_RESYNCS resyncs within WS_SLOW_CLIENT_WINDOW seconds (0 = never).
+# Under daphne, frames also wait while it holds more than WS_OUTBOX_MAX_BACKLOG bytes for the socket (0 = don't wait)
+WS_OUTBOX_SIZE = int(os.getenv("WS_OUTBOX_SIZE", "64"))
+WS_OUTBOX_MAX_BACKLOG = int(os.getenv("WS_OUTBOX_MAX_BACKLOG", str(256 * 1024)))
+WS_SLOW_CLIENT_MAX_RESYNCS = int(os.getenv("WS_SLOW_CLIENT_MAX_RESYNCS", "0"))
+WS_SLOW_CLIENT_WINDOW = float(os.getenv("WS_SLOW_CLIENT_WINDOW", "60"))
+# Server-side auto-caller (wsapp.caller): default and minimum seconds between
+# draws, lease lifetime in seconds, and the timer wheel's tick
+AUTO_CALL_INTERVAL = float(os.getenv("AUTO_CALL_INTERVAL", "5"))
+AUTO_CALL_MIN_INTERVAL = float(os.getenv("AUTO_CALL_MIN_INTERVAL", "1"))
+AUTO_CALL_LEASE = float(os.getenv("AUTO_CALL_LEASE", "15"))
+AUTO_CALL_TICK = float(os.getenv("AUTO_CALL_TICK", "0.1"))
+# Reject games whose patterns are neither built in nor given a spec (off: they are
+# accepted and logged, as before custom specs existed)
+STRICT_PATTERN_NAMES = os.getenv("STRICT_PATTERN_NAMES", "0") == "1"
+# Attempts of a versioned Game write (core.versioning) before giving up on conflicts
+GAME_VERSION_ATTEMPTS = int(os.getenv("GAME_VERSION_ATTEMPTS", "8"))
+# Processes used by the prize-round simulator (0 = one per CPU)
+SIMULATION_WORKERS = int(os.getenv("SIMULATION_WORKERS", "0"))
+# Seconds a simulation request may take; larger requests run fewer simulations (0 = no limit)
+SIMULATION_TIME_BUDGET = float(os.getenv("SIMULATION_TIME_BUDGET", "1.5"))
+
 # Database
 # https://docs.djangoproject.com/en/5.2/ref/settings/#databases
 
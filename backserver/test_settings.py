@@ -0,0 +1,27 @@
+"""
+Settings for the test suite (manage.py test --settings=backserver.test_settings):
+SQLite on a file rather than in memory, so tests that start many writers at
+once (concurrent joins, concurrent game writes) can run without a
+DATABASE_URL.
+
+In-memory SQLite turns a second writer away; on a file, with IMMEDIATE
+transactions, writers wait for the lock (up to `timeout` seconds) instead.
+Point DATABASE_URL at PostgreSQL and use the normal settings to run the same
+tests there.
+"""
+from .settings import *  # noqa: F401,F403
+
+DATABASES = {
+    'default': {
+        'ENGINE': 'django.db.backends.sqlite3',
+        'NAME': BASE_DIR / 'test.sqlite3',
+        'OPTIONS': {'transaction_mode': 'IMMEDIATE', 'timeout': 30},
+        'TEST': {'NAME': BASE_DIR / 'test_db.sqlite3'},
+    }
+}
+
+CHANNEL_LAYERS = {
+    "default": {
+        "BACKEND": "channels.layers.InMemoryChannelLayer",
+    },
+}
@@ -1,10 +1,15 @@
 from django.contrib import admin
 
 # Register your models here.
-from .models import Game, PlayerGame, PlayerTicket, RoundWise, Tickets
+from .models import Draw, Game, Pattern, Payout, PlayerGame, PlayerTicket, Round, RoundDeck, RoundWise, Tickets
 
 admin.site.register(Game)
 admin.site.register(PlayerGame)
 admin.site.register(PlayerTicket)
 admin.site.register(RoundWise)
-admin.site.register(Tickets)
\ No newline at end of file
+admin.site.register(Tickets)
+admin.site.register(RoundDeck)
+admin.site.register(Round)
+admin.site.register(Pattern)
+admin.site.register(Draw)
+admin.site.register(Payout)
@@ -4,3 +4,7 @@ from django.apps import AppConfig
 class CoreConfig(AppConfig):
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'core'
+
+    def ready(self):
+        from core import principals  # noqa: F401  (drops cached socket principals when a user is deactivated)
+        from core import rounds  # noqa: F401  (gives new games their Round and Pattern rows)
@@ -0,0 +1,110 @@
+from functools import lru_cache
+
+import numpy as np
+
+from core.ops import Checker
+from core.patterns import BUILTINS, COUNT, LINES, Pattern
+
+
+@lru_cache(maxsize=None)
+def cell_index(cells):
+    """(rows, cols) index arrays for a tuple of (row, col) cells."""
+    rows, cols = zip(*cells)
+    return np.array(rows), np.array(cols)
+
+
+class BatchChecker:
+    """
+    Evaluates every pattern for every ticket of a round at once.
+
+    Tickets are loaded into an (N, 3, 9) integer array and the called numbers
+    into a boolean lookup vector of length 91, so each pattern spec (see
+    core.patterns) is a handful of array operations instead of a Python loop
+    per ticket. Results match Checker.check_patterns exactly; tickets that
+    don't fit the array (not 3x9, non-int cells, numbers outside 0-90) are
+    checked with Checker instead.
+    """
+
+    def __init__(self, keys, tickets):
+        self.checker = Checker()
+        self.keys = []
+        self.fallback = []
+        rows = []
+        for key, ticket in zip(keys, tickets):
+            if self.fits(ticket):
+                self.keys.append(key)
+                rows.append(ticket)
+            else:
+                self.fallback.append((key, ticket))
+        self.tickets = np.array(rows, dtype=np.int16).reshape(len(rows), 3, 9)
+        self.filled = self.tickets != 0
+
+    @staticmethod
+    def fits(ticket):
+        return (
+            isinstance(ticket, (list, tuple)) and len(ticket) == 3
+            and all(
+                isinstance(row, (list, tuple)) and len(row) == 9
+                and all(type(num) is int and 0 <= num <= 90 for num in row)
+                for row in ticket
+            )
+        )
+
+    @staticmethod
+    def called_vector(called_numbers):
+        called = np.zeros(91, dtype=bool)
+        nums = [num for num in called_numbers if type(num) is int and 0 < num <= 90]
+        called[nums] = True
+        return called
+
+    def check(self, called_numbers, pattern_list):
+        """
+        Return {pattern name: boolean array of length N} for the array-backed tickets.
+        `pattern_list` holds compiled Patterns or built-in names (unknown names never match).
+        """
+        filled = self.filled
+        hit = self.called_vector(called_numbers)[self.tickets]  # blanks index 0, which is never called
+        ok = hit | ~filled                                      # cell is blank or called
+
+        results = {}
+        for pattern in pattern_list:
+            if not isinstance(pattern, Pattern):
+                name, pattern = pattern, BUILTINS.get(pattern)
+                if pattern is None:
+                    results[name] = np.zeros(len(filled), dtype=bool)
+                    continue
+
+            res = np.ones(len(filled), dtype=bool)
+            if pattern.filled:
+                res &= filled[(slice(None),) + cell_index(pattern.filled)].all(axis=1)
+            if pattern.blank:
+                res &= ~filled[(slice(None),) + cell_index(pattern.blank)].any(axis=1)
+            if pattern.any_filled:
+                res &= filled[(slice(None),) + cell_index(pattern.any_filled)].any(axis=1)
+            if pattern.min_filled:
+                cells, count = pattern.min_filled
+                res &= filled[(slice(None),) + cell_index(cells)].sum(axis=1) >= count
+
+            if pattern.kind is LINES:
+                complete = np.zeros(len(filled), dtype=np.int8)
+                for line in pattern.lines:
+                    index = (slice(None),) + cell_index(line)
+                    complete += ok[index].all(axis=1) & filled[index].any(axis=1)
+                res &= complete >= pattern.threshold
+            elif pattern.kind is COUNT:
+                res &= hit[(slice(None),) + cell_index(pattern.cells)].sum(axis=1) >= pattern.threshold
+            else:
+                res &= ok[(slice(None),) + cell_index(pattern.cells)].all(axis=1)
+            results[pattern.name] = res
+        return results
+
+    def winners(self, called_numbers, pattern_list):
+        """Return {pattern name: [keys]} of every ticket satisfying each pattern."""
+        winners = {}
+        for pattern, res in self.check(called_numbers, pattern_list).items():
+            winners[pattern] = [self.keys[i] for i in np.flatnonzero(res)]
+        for key, ticket in self.fallback:
+            for pattern, won in self.checker.check_patterns(ticket, called_numbers, pattern_list).items():
+                if won:
+                    winners[pattern].append(key)
+        return winners
@@ -0,0 +1,346 @@
+"""
+Micro-benchmarks for the per-draw hot path: Checker.check_patterns over a
+round's tickets, GameWinnerHandler.check_and_assign_winners end to end,
+the draw as the creator sees it (wsapp.consumers.announce_draw), and
+fanning a draw's frame out to a room's sockets.
+
+Everything is synthetic and reproducible from a seed: the tickets, the draw
+orders and the game they are loaded into. Each scenario is one ticket count
+at one draw depth and is sampled `repeat` times over different draw orders;
+the timed part of every sample is a single draw. Results (latency
+percentiles and tracemalloc allocations) can be saved as a JSON baseline
+and later runs compared against it (see compare).
+"""
+import asyncio
+import json
+import platform
+import random
+import time
+import tracemalloc
+from decimal import Decimal
+
+from asgiref.sync import async_to_sync
+from django.db import transaction
+
+from core import counters, live
+from core.deck import deck_order
+from core.models import Game, Payout, PlayerGame, PlayerTicket, RoundWise, User
+from core.ops import PATTERN_NAMES, Checker, CompiledTicket, GameWinnerHandler
+from core.tickets import random_ticket
+
+ROUND_ID = 1
+PRIZE = "1000"
+
+
+def make_tickets(count, seed=0):
+    """`count` tickets; the same seed always gives the same tickets (and a longer list extends a shorter one)."""
+    rng = random.Random(seed)
+    return [random_ticket(rng) for _ in range(count)]
+
+
+def draw_order(seed, sample):
+    return deck_order(f"bench-{seed}-{sample}")
+
+
+def percentiles(samples):
+    """Latency summary in milliseconds (nearest-rank percentiles)."""
+    ordered = sorted(samples)
+
+    def rank(q):
+        return ordered[min(len(ordered) - 1, max(0, round(q * len(ordered)) - 1))] * 1000
+
+    return {
+        "samples": len(ordered),
+        "mean_ms": round(sum(ordered) / len(ordered) * 1000, 3),
+        "p50_ms": round(rank(0.50), 3),
+        "p90_ms": round(rank(0.90), 3),
+        "p95_ms": round(rank(0.95), 3),
+        "p99_ms": round(rank(0.99), 3),
+        "max_ms": round(ordered[-1] * 1000, 3),
+    }
+
+
+class Probe:
+    """
+    Wraps the part of a sample that counts as the draw: times it and, when
+    `trace` is set, records what it allocates with tracemalloc.
+    """
+
+    def __init__(self, trace=False):
+        self.trace = trace
+        self.elapsed = self.peak = self.net = None
+
+    def __enter__(self):
+        if self.trace:
+            tracemalloc.start()
+        self.start = time.perf_counter()
+        return self
+
+    def __exit__(self, *exc):
+        self.elapsed = time.perf_counter() - self.start
+        if self.trace:
+            self.net, self.peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+        return False
+
+
+def measure(run, repeat):
+    """
+    Call `run(sample, probe)` once to warm up, `repeat` times timed, and once
+    more with allocation tracing. `run` does its own setup and wraps the draw
+    in `with probe:`.
+    """
+    run(repeat + 1, Probe())
+    timings = []
+    for sample in range(repeat):
+        probe = Probe()
+        run(sample, probe)
+        timings.append(probe.elapsed)
+    probe = Probe(trace=True)
+    run(repeat, probe)
+    result = percentiles(timings)
+    result["alloc_peak_kib"] = round(probe.peak / 1024, 1)
+    result["alloc_net_kib"] = round(probe.net / 1024, 1)
+    return result
+
+
+def bench_checker(tickets, depth, repeat, seed=0, patterns=PATTERN_NAMES):
+    """One draw = checking every (pre-compiled) ticket against every pattern, as the "checker" backend does."""
+    checker = Checker()
+    compiled = [CompiledTicket.from_ticket(t) for t in tickets]
+
+    def run(sample, probe):
+        called = draw_order(seed, sample)[:depth]
+        with probe:
+            mask = checker.called_mask(called)
+            for ticket, c in zip(tickets, compiled):
+                checker.check_patterns(ticket, called, patterns, compiled=c, called_mask=mask)
+
+    return measure(run, repeat)
+
+
+def fresh_round(patterns=PATTERN_NAMES):
+    return {
+        "id": str(ROUND_ID),
+        "called_numbers": [],
+        "patterns": [
+            {"id": f"{ROUND_ID}.{i}", "patternName": name, "prizeAmount": PRIZE, "won": False, "wonBy": None}
+            for i, name in enumerate(patterns, start=1)
+        ],
+    }
+
+
+def build_game(tickets, title="bench"):
+    """A single-round game with one player (and one ticket) per ticket. Needs a migrated database."""
+    creator, _ = User.objects.get_or_create(
+        email="bench-creator@example.com",
+        defaults={"full_name": "Bench Creator", "mobile_number": "0", "role": "creator"},
+    )
+    have = User.objects.filter(email__startswith="bench-player-").count()
+    User.objects.bulk_create(
+        [
+            User(email=f"bench-player-{i}@example.com", full_name=f"Player {i}", mobile_number="0", password="!")
+            for i in range(have, len(tickets))
+        ],
+        batch_size=2000,
+    )
+    players = list(
+        User.objects.filter(email__startswith="bench-player-").order_by("id").values_list("id", flat=True)
+    )[:len(tickets)]
+
+    game = Game.objects.create(
+        creator=creator,
+        title=title,
+        number_of_users=len(tickets),
+        total_prize_pool=Decimal(PRIZE) * len(PATTERN_NAMES),
+        date_time="2025-01-01T00:00:00Z",
+        state="ongoing",
+        prize_rounds=[fresh_round()],
+    )
+    PlayerGame.objects.bulk_create([PlayerGame(game=game, player_id=p) for p in players], batch_size=2000)
+    counters.players_joined(game.id, len(players))
+    PlayerTicket.objects.bulk_create(
+        [PlayerTicket(game=game, player_id=p, round_id=ROUND_ID, ticket_data=t) for p, t in zip(players, tickets)],
+        batch_size=2000,
+    )
+    return game
+
+
+def bench_handler(game, depth, repeat, seed=0, backend=None):
+    """
+    One draw = check_and_assign_winners when the `depth`-th number comes out.
+
+    Before each sample the round is brought to the state a live game would
+    be in one draw earlier: patterns already won by then are marked won and
+    the backend's per-round state (ticket cache, engine) and the live round
+    state (core.live) are loaded. The live state is reset for every sample
+    and payouts run in a transaction that is rolled back, so samples don't
+    see each other's winners.
+    """
+    from core.cache import round_tickets
+
+    handler = GameWinnerHandler(backend)
+    open_patterns = []
+
+    def run(sample, probe):
+        order = draw_order(seed, sample)
+        before = order[:depth - 1]
+        round_data = fresh_round()
+        round_tickets.invalidate(game.id, ROUND_ID)
+        won = handler.find_winners(game.id, ROUND_ID, round_data, before, round_data["patterns"])
+        for pattern in round_data["patterns"]:
+            if pattern["id"] in won:
+                pattern["won"] = True
+                pattern["wonBy"] = []
+        still_open = [p for p in round_data["patterns"] if not p["won"]]
+        if still_open:
+            handler.find_winners(game.id, ROUND_ID, round_data, before, still_open)
+        open_patterns.append(len(still_open))
+
+        store = live.get_store()
+        store.delete_game(game.id)
+        store.put_game(game.id, {"state": game.state, "rounds": 1})
+        store.put_round(
+            game.id, ROUND_ID, bytes(order), depth, round_data["patterns"],
+            won=[p["id"] for p in round_data["patterns"] if p["won"]],
+        )
+        with transaction.atomic():
+            Game.objects.filter(pk=game.pk).update(prize_rounds=[round_data])
+            with probe:
+                async_to_sync(handler.check_and_assign_winners)(game.id, ROUND_ID)
+            transaction.set_rollback(True)
+
+    result = measure(run, repeat)
+    round_tickets.invalidate(game.id, ROUND_ID)
+    live.get_store().delete_game(game.id)
+    result["open_patterns"] = round(sum(open_patterns) / len(open_patterns), 2)
+    return result
+
+
+def bench_draw(game, depth, repeat, seed=0, pipelined=True):
+    """
+    One draw = announce_draw for the `depth`-th number, timed from the
+    creator's generate_number until it returns: the broadcast plus, with
+    `pipelined` off, the inline winner check and payout. With it on, the
+    check is queued to wsapp.pipeline and finishes outside the timing.
+
+    Every sample starts the round afresh one draw before `depth` with all
+    patterns open (so a late depth pays several of them at once), and the
+    backend's ticket cache already synced to that point.
+    """
+    from channels.layers import InMemoryChannelLayer
+    from django.conf import settings
+    from django.test import override_settings
+
+    from core.cache import round_tickets
+    from wsapp import pipeline
+    from wsapp.consumers import announce_draw
+
+    layer = InMemoryChannelLayer()
+    handler = GameWinnerHandler()
+    workers = (settings.WINNER_PIPELINE_WORKERS or 4) if pipelined else 0
+
+    def run(sample, probe):
+        order = draw_order(seed, sample)
+        round_data = fresh_round()
+        Game.objects.filter(pk=game.pk).update(prize_rounds=[round_data])
+        RoundWise.objects.filter(game=game).delete()
+        Payout.objects.filter(game=game).delete()
+        round_tickets.invalidate(game.id, ROUND_ID)
+        handler.find_winners(game.id, ROUND_ID, round_data, order[:depth - 1], round_data["patterns"])
+
+        store = live.get_store()
+        store.delete_game(game.id)
+        store.put_game(game.id, {"state": game.state, "rounds": 1})
+        store.put_round(game.id, ROUND_ID, bytes(order), depth - 1, round_data["patterns"])
+
+        async def draw():
+            with probe:
+                await announce_draw(layer, game.id, ROUND_ID)
+            await pipeline.drain()
+
+        with override_settings(WINNER_PIPELINE_WORKERS=workers):
+            async_to_sync(draw)()
+
+    result = measure(run, repeat)
+    round_tickets.invalidate(game.id, ROUND_ID)
+    live.get_store().delete_game(game.id)
+    return result
+
+
+def bench_broadcast(connections, depth, repeat, seed=0, pre_encoded=True, full_list=False):
+    """
+    One draw = delivering its number_generated message to `connections`
+    GameConsumers whose send() is a no-op, i.e. the CPU spent in the
+    handlers. With `pre_encoded` the frame is encoded once by the sender
+    (number_event) and forwarded; without it every consumer encodes the
+    payload itself, as the handler used to. `full_list` consumers get the
+    ?protocol=full frame with all `depth` numbers called so far.
+    """
+    from wsapp.consumers import GameConsumer, number_event
+
+    async def discard(text_data=None, bytes_data=None, close=False):
+        pass
+
+    async def per_socket(consumer, event):
+        # what GameConsumer.number_generated did before frames were pre-encoded
+        if consumer.full_list:
+            await consumer.send(text_data=json.dumps({"number": event["number"], "called_numbers": event["called_numbers"]}))
+        else:
+            await consumer.send(text_data=json.dumps({"type": "number", "seq": event["seq"], "number": event["number"]}))
+
+    consumers = []
+    for _ in range(connections):
+        consumer = GameConsumer()
+        consumer.full_list = full_list
+        consumer.send = discard
+        consumers.append(consumer)
+
+    def run(sample, probe):
+        called = draw_order(seed, sample)[:depth]
+
+        async def deliver():
+            with probe:
+                if pre_encoded:
+                    event = number_event(called[-1], called)
+                    for consumer in consumers:
+                        await consumer.number_generated(event)
+                else:
+                    event = {"number": called[-1], "seq": len(called), "called_numbers": called}
+                    for consumer in consumers:
+                        await per_socket(consumer, event)
+
+        asyncio.run(deliver())
+
+    return measure(run, repeat)
+
+
+def scenario_key(target, backend, tickets, depth):
+    return f"{target}/{backend}/{tickets}/{depth}"
+
+
+def environment():
+    return {"python": platform.python_version(), "machine": platform.machine(), "platform": platform.platform()}
+
+
+def compare(current, baseline, threshold, metrics=("p50_ms", "alloc_peak_kib"), noise_ms=0.5):
+    """
+    Scenarios present in both runs whose metric grew by more than
+    `threshold` (0.2 = 20%). Latency changes under `noise_ms` are ignored:
+    on millisecond-scale scenarios they are timer and scheduler noise.
+    Returns [(key, metric, baseline, current)].
+    """
+    regressions = []
+    for key, result in current.items():
+        base = baseline.get(key)
+        if base is None:
+            continue
+        for metric in metrics:
+            old, new = base.get(metric), result.get(metric)
+            if old is None or new is None or old <= 0:
+                continue
+            if metric.endswith("_ms") and new - old < noise_ms:
+                continue
+            if new > old * (1 + threshold):
+                regressions.append((key, metric, old, new))
+    return regressions
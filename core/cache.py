@@ -0,0 +1,119 @@
+import threading
+from collections import OrderedDict
+
+from django.conf import settings
+
+from core import live
+from core.models import PlayerTicket
+from core.ops import CompiledTicket, RoundEngine
+
+
+class RoundTickets:
+    """
+    One round's tickets, compiled once and grouped by player, plus the
+    per-round checking state built from them (RoundEngine, BatchChecker).
+    """
+
+    def __init__(self, rows):
+        self.by_player = {}  # player_id -> [(ticket_data, CompiledTicket or None)]
+        for player_id, ticket_data in rows:
+            self.by_player.setdefault(player_id, []).append(
+                (ticket_data, CompiledTicket.from_ticket(ticket_data))
+            )
+        self._engine = None
+        self._batch = None
+
+    def __len__(self):
+        return sum(len(entries) for entries in self.by_player.values())
+
+    def items(self):
+        """Yield (player_id, ticket_data, compiled) for every ticket."""
+        for player_id, entries in self.by_player.items():
+            for ticket_data, compiled in entries:
+                yield player_id, ticket_data, compiled
+
+    def engine(self, patterns, fresh=False):
+        """The round's RoundEngine for `patterns`; rebuilt if the pattern list changed (or `fresh`)."""
+        if fresh or self._engine is None or set(self._engine.patterns.values()) != set(patterns):
+            engine = RoundEngine(patterns)
+            for player_id, ticket_data, compiled in self.items():
+                engine.add_ticket(player_id, compiled or ticket_data)
+            self._engine = engine
+        return self._engine
+
+    def batch(self):
+        if self._batch is None:
+            from core.batch import BatchChecker
+            rows = list(self.items())
+            self._batch = BatchChecker([r[0] for r in rows], [r[1] for r in rows])
+        return self._batch
+
+
+class RoundTicketCache:
+    """
+    Per-process LRU of RoundTickets keyed by (game_id, round_id).
+
+    A round is loaded from the database on first use and then served from
+    memory for every draw. The least recently used round is evicted once
+    more than `max_rounds` are held.
+
+    When a player joins or the round ends, invalidate_round_tickets gives
+    the round a new tickets version in the live store (core.live). Every get
+    compares the entry's version with the store's, one read, and reloads on a
+    mismatch, so every process drops stale tickets, whether or not it holds a
+    socket of that round. The version is read before the tickets are, so a
+    load racing an invalidation is stored under the old version and reloaded
+    on the next get instead of being served.
+    """
+
+    def __init__(self, max_rounds):
+        self.max_rounds = max_rounds
+        self._rounds = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, game_id, round_id):
+        key = (int(game_id), int(round_id))
+        version = live.tickets_version(*key)
+        with self._lock:
+            cached = self._rounds.get(key)
+            if cached is not None and cached[0] == version:
+                self._rounds.move_to_end(key)
+                return cached[1]
+
+        rows = PlayerTicket.objects.filter(
+            game_id=game_id, round_id=round_id
+        ).order_by('id').values_list('player_id', 'ticket_data')
+        entry = RoundTickets(rows)
+
+        with self._lock:
+            self._rounds[key] = (version, entry)
+            self._rounds.move_to_end(key)
+            while len(self._rounds) > self.max_rounds:
+                self._rounds.popitem(last=False)
+        return entry
+
+    def invalidate(self, game_id, round_id=None):
+        """Drop one round, or every round of the game when `round_id` is None."""
+        game_id = int(game_id)
+        with self._lock:
+            if round_id is not None:
+                self._rounds.pop((game_id, int(round_id)), None)
+                return
+            for key in [k for k in self._rounds if k[0] == game_id]:
+                del self._rounds[key]
+
+    def __contains__(self, key):
+        return key in self._rounds
+
+    def __len__(self):
+        return len(self._rounds)
+
+
+round_tickets = RoundTicketCache(getattr(settings, "ROUND_TICKET_CACHE_ROUNDS", 64))
+
+
+def invalidate_round_tickets(game_id, round_ids):
+    """Drop the rounds' cached tickets here, and in every other process by bumping their versions."""
+    for round_id in round_ids:
+        round_tickets.invalidate(game_id, round_id)
+        live.tickets_changed(game_id, round_id)
@@ -0,0 +1,78 @@
+"""
+Summary counters on Game.
+
+The game lists used to count each game's players with a query of their own
+and load prize_rounds to count its rounds. Game now carries the numbers:
+
+    - players_count: PlayerGame rows, bumped on join;
+    - rounds_count: Round rows, set whenever they are (re)built;
+    - winners_count: pattern wins, one per player per pattern won;
+    - prizes_distributed: what has been paid out.
+
+Each is changed by a single UPDATE in the transaction that changes what it
+counts, with F() expressions, so concurrent writers can't lose increments,
+and without touching Game.version: counters are not edits. Anything that
+writes the counted rows another way (bulk loads, the admin) leaves them
+off; reconcile() recounts them from the rows.
+"""
+from django.db.models import Count, F, IntegerField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from core.models import Game, Payout, PlayerGame, Round
+
+FIELDS = ["players_count", "rounds_count", "winners_count", "prizes_distributed"]
+
+
+def players_joined(game_id, count=1):
+    Game.objects.filter(pk=game_id).update(players_count=F("players_count") + count)
+
+
+def rounds_built(game_id, count):
+    Game.objects.filter(pk=game_id).update(rounds_count=count)
+
+
+def winners_paid(game_id, wins, amount):
+    """`wins` more pattern wins, paying out `amount` between them."""
+    Game.objects.filter(pk=game_id).update(
+        winners_count=F("winners_count") + wins,
+        prizes_distributed=F("prizes_distributed") + amount,
+    )
+
+
+def _count(model, aggregate, output_field=None):
+    rows = model.objects.filter(game=OuterRef("pk")).order_by().values("game").annotate(n=aggregate).values("n")[:1]
+    return Coalesce(Subquery(rows), Value(0), output_field=output_field or IntegerField())
+
+
+def _actual():
+    """What each counter should read, as expressions over the counted rows."""
+    return {
+        "players_count": _count(PlayerGame, Count("id")),
+        "rounds_count": _count(Round, Count("id")),
+        "winners_count": _count(Payout, Count("id")),
+        "prizes_distributed": _count(Payout, Sum("amount"), Game._meta.get_field("prizes_distributed")),
+    }
+
+
+def reconcile(games=None, fix=True):
+    """
+    Recount the counters of `games` (a Game queryset, all by default) and
+    return {game id: {counter: (stored, actual)}} for those that drifted.
+    Unless `fix` is False they are rewritten, each game by one UPDATE that
+    recounts, so increments landing meanwhile aren't lost.
+    """
+    games = Game.objects.all() if games is None else games
+    drifted = {}
+    counted = games.annotate(**{f"actual_{field}": expression for field, expression in _actual().items()})
+    for game in counted.only("id", *FIELDS).iterator(chunk_size=500):
+        diff = {
+            field: (getattr(game, field), getattr(game, f"actual_{field}"))
+            for field in FIELDS
+            if getattr(game, field) != getattr(game, f"actual_{field}")
+        }
+        if not diff:
+            continue
+        drifted[game.id] = diff
+        if fix:
+            Game.objects.filter(pk=game.id).update(**{field: _actual()[field] for field in diff})
+    return drifted
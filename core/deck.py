@@ -0,0 +1,105 @@
+"""
+Seeded draw decks.
+
+When a round starts its 90 numbers are shuffled once from a CSPRNG seed and
+stored as a RoundDeck. Draws take the number under the deck's cursor in the
+live store (core.live), which writes the cursor back to the RoundDeck.
+
+The shuffle is a Fisher-Yates driven by SHA-256(seed || counter), so the
+whole draw order can be replayed from the seed alone (e.g. for disputes)
+independently of the Python version.
+"""
+import hashlib
+import secrets
+
+from django.db import IntegrityError, transaction
+
+from core.models import RoundDeck
+
+NUMBERS = range(1, 91)
+
+
+def new_seed():
+    return secrets.token_hex(16)
+
+
+def _stream(seed):
+    """Endless 32-bit values from SHA-256(seed || counter)."""
+    counter = 0
+    while True:
+        block = hashlib.sha256(seed.encode() + counter.to_bytes(8, "big")).digest()
+        for i in range(0, 32, 4):
+            yield int.from_bytes(block[i:i + 4], "big")
+        counter += 1
+
+
+def deck_order(seed):
+    """The draw order of 1-90 for `seed`."""
+    numbers = list(NUMBERS)
+    stream = _stream(seed)
+    for i in range(len(numbers) - 1, 0, -1):
+        n = i + 1
+        limit = 2 ** 32 - 2 ** 32 % n  # reject the biased tail
+        value = next(stream)
+        while value >= limit:
+            value = next(stream)
+        j = value % n
+        numbers[i], numbers[j] = numbers[j], numbers[i]
+    return numbers
+
+
+def build_order(seed, already_called=()):
+    """
+    Numbers already called (rounds started before decks existed) keep their
+    place at the front; the rest follow in the seed's order.
+    """
+    called = [n for n in dict.fromkeys(already_called) if n in NUMBERS]
+    seen = set(called)
+    return called + [n for n in deck_order(seed) if n not in seen]
+
+
+def start_deck(game_id, round_id, already_called=()):
+    """Create the round's deck if it doesn't exist yet and return it."""
+    called = [n for n in dict.fromkeys(already_called) if n in NUMBERS]
+    seed = new_seed()
+    try:
+        with transaction.atomic():
+            deck, _ = RoundDeck.objects.get_or_create(
+                game_id=game_id,
+                round_id=round_id,
+                defaults={
+                    "seed": seed,
+                    "order": bytes(build_order(seed, called)),
+                    "cursor": len(called),
+                },
+            )
+    except IntegrityError:
+        # another worker started the round at the same moment
+        deck = RoundDeck.objects.get(game_id=game_id, round_id=round_id)
+    return deck
+
+
+def called_numbers(game_id, round_id, round_data=None):
+    """Numbers drawn so far; rounds without a deck fall back to their prize_rounds entry."""
+    deck = RoundDeck.objects.filter(game_id=game_id, round_id=round_id).values_list('order', 'cursor').first()
+    if deck is None:
+        return list((round_data or {}).get("called_numbers", []))
+    order, cursor = deck
+    return list(bytes(order)[:cursor])
+
+
+def deck_cursors(game_id):
+    """{round_id: numbers drawn} for every started round of a game."""
+    return dict(RoundDeck.objects.filter(game_id=game_id).values_list('round_id', 'cursor'))
+
+
+def verify_deck(deck):
+    """
+    Whether the stored order is what the seed replays to. Numbers called
+    before the deck existed may sit at the front; everything after them must
+    follow the seed's order exactly.
+    """
+    order = list(bytes(deck.order))
+    if sorted(order) != list(NUMBERS):
+        return False
+    return any(build_order(deck.seed, order[:k]) == order for k in range(len(order) + 1))
@@ -0,0 +1,670 @@
+"""
+Live round state.
+
+While a round is played, its state is held in a shared store instead of the
+database:
+    - the deck order and draw cursor (see core.deck);
+    - the round's patterns and which of them are already won;
+    - the game's state and round count.
+Draws and winner checks read and update only the store, so a draw makes no
+database round-trips. The database is still written when winners are paid.
+
+The store is the channel layer's Redis. MemoryStore is an in-process stand-in
+for tests and single-process development. A round is loaded into the store
+from the database on first use.
+
+Draw cursors are written back to RoundDeck, and the numbers drawn appended as
+Draw rows (core.rounds), in batches by a background thread
+(start_flusher, every ROUND_STATE_FLUSH_INTERVAL seconds). They are also
+flushed right away when a round's deck runs out, when its last pattern is
+won, and when the game is paused or completed.
+
+The store also holds the rounds that are called automatically and the
+leases that make sure one process drives each of them (see wsapp.caller),
+the users deactivated while their tokens are still valid (see
+core.principals), each game's winners snapshot (core.winners) and the
+version of each round's tickets (core.cache).
+"""
+import atexit
+import json
+import logging
+import secrets
+import threading
+import time
+from functools import reduce
+from operator import or_
+
+from django.conf import settings
+from django.db import close_old_connections, transaction
+from django.db.models import Case, Count, F, Q, Value, When
+from django.db.models.functions import Greatest
+
+from core import deck, rounds
+from core.models import Game, Round, RoundDeck
+
+logger = logging.getLogger(__name__)
+
+ROUND_TTL = 24 * 60 * 60  # live keys outlive any game
+GAME_TTL = 60 * 60
+
+
+class RoundState:
+    """A snapshot of one live round."""
+    __slots__ = ("order", "cursor", "patterns", "won")
+
+    def __init__(self, order, cursor, patterns, won):
+        self.order = bytes(order)
+        self.cursor = int(cursor)
+        self.patterns = patterns
+        self.won = set(won)
+
+    @property
+    def called(self):
+        return list(self.order[:self.cursor])
+
+    def open_patterns(self):
+        return [p for p in self.patterns if p["id"] not in self.won]
+
+
+class MemoryStore:
+    """In-process stand-in for RedisStore (tests, single-process development)."""
+
+    def __init__(self):
+        self._games = {}
+        self._rounds = {}   # (game_id, round_id) -> [order, cursor, patterns, won]
+        self._dirty = set()
+        self._leases = {}   # (game_id, round_id) -> (owner, expires)
+        self._autocall = {}  # (game_id, round_id) -> interval
+        self._revoked = set()  # user ids
+        self._winners = {}  # game_id -> (version, frame)
+        self._tickets = {}  # (game_id, round_id) -> tickets version
+        self._lock = threading.Lock()
+
+    def get_game(self, game_id):
+        info = self._games.get(game_id)
+        return dict(info) if info else None
+
+    def put_game(self, game_id, info):
+        self._games[game_id] = dict(info)
+
+    def drop_game(self, game_id):
+        self._games.pop(game_id, None)
+
+    def get_round(self, game_id, round_id):
+        with self._lock:
+            entry = self._rounds.get((game_id, round_id))
+            return RoundState(*entry) if entry else None
+
+    def put_round(self, game_id, round_id, order, cursor, patterns, won=()):
+        with self._lock:
+            self._rounds.setdefault((game_id, round_id), [bytes(order), cursor, patterns, set(won)])
+
+    def draw(self, game_id, round_id):
+        """(drew, cursor, order) after drawing the next number, or None if the round isn't loaded."""
+        with self._lock:
+            entry = self._rounds.get((game_id, round_id))
+            if entry is None:
+                return None
+            order, cursor = entry[0], entry[1]
+            if cursor >= len(order):
+                return False, cursor, order
+            entry[1] = cursor + 1
+            self._dirty.add((game_id, round_id))
+            return True, cursor + 1, order
+
+    def claim(self, game_id, round_id, pattern_ids):
+        """Mark patterns won; returns the ids that weren't won before."""
+        with self._lock:
+            won = self._rounds[(game_id, round_id)][3]
+            claimed = [pid for pid in pattern_ids if pid not in won]
+            won.update(claimed)
+            return claimed
+
+    def release(self, game_id, round_id, pattern_ids):
+        with self._lock:
+            self._rounds[(game_id, round_id)][3].difference_update(pattern_ids)
+
+    def cursors(self, keys):
+        with self._lock:
+            return {key: self._rounds[key][1] for key in keys if key in self._rounds}
+
+    def game_rounds(self, game_id):
+        return [key for key in list(self._rounds) if key[0] == game_id]
+
+    def pop_dirty(self, count=1000):
+        with self._lock:
+            keys = [self._dirty.pop() for _ in range(min(count, len(self._dirty)))]
+            return keys
+
+    def mark_dirty(self, keys):
+        with self._lock:
+            self._dirty.update(keys)
+
+    def delete_game(self, game_id):
+        with self._lock:
+            self._games.pop(game_id, None)
+            self._winners.pop(game_id, None)
+            for key in [k for k in self._rounds if k[0] == game_id]:
+                del self._rounds[key]
+                self._dirty.discard(key)
+
+    def take_leases(self, keys, owner, ttl):
+        """Take or renew the lease on each round for ttl seconds; returns the keys owner now holds."""
+        now = time.monotonic()
+        held = []
+        with self._lock:
+            for key in keys:
+                holder = self._leases.get(key)
+                if holder and holder[0] != owner and holder[1] > now:
+                    continue
+                self._leases[key] = (owner, now + ttl)
+                held.append(key)
+        return held
+
+    def release_lease(self, key, owner):
+        with self._lock:
+            if self._leases.get(key, (None,))[0] == owner:
+                del self._leases[key]
+
+    def autocall_rounds(self):
+        with self._lock:
+            return dict(self._autocall)
+
+    def set_autocall(self, key, interval):
+        with self._lock:
+            if interval is None:
+                self._autocall.pop(key, None)
+            else:
+                self._autocall[key] = interval
+
+    def set_revoked(self, user_id, revoked, ttl):
+        with self._lock:
+            if revoked:
+                self._revoked.add(user_id)
+            else:
+                self._revoked.discard(user_id)
+
+    def is_revoked(self, user_id):
+        return user_id in self._revoked
+
+    def get_winners(self, game_id):
+        return self._winners.get(game_id)
+
+    def put_winners(self, game_id, version, frame):
+        self._winners[game_id] = (version, frame)
+
+    def tickets_version(self, key):
+        return self._tickets.get(key)
+
+    def set_tickets_version(self, key, version):
+        self._tickets[key] = version
+
+
+class RedisStore:
+    """
+    Live state in Redis. Every update is a single command or Lua script, so
+    concurrent workers on any process see atomic draws and claims.
+    """
+    DIRTY = "live:dirty"
+    AUTOCALL = "live:autocall"
+
+    DRAW = """
+        local order = redis.call('HGET', KEYS[1], 'order')
+        if not order then return nil end
+        local cursor = tonumber(redis.call('HGET', KEYS[1], 'cursor'))
+        if cursor >= #order then return {0, cursor, order} end
+        cursor = redis.call('HINCRBY', KEYS[1], 'cursor', 1)
+        redis.call('EXPIRE', KEYS[1], ARGV[2])
+        redis.call('EXPIRE', KEYS[2], ARGV[2])
+        redis.call('SADD', KEYS[3], ARGV[1])
+        return {1, cursor, order}
+    """
+    PUT_ROUND = """
+        if redis.call('EXISTS', KEYS[1]) == 1 then return 0 end
+        redis.call('HSET', KEYS[1], 'order', ARGV[1], 'cursor', ARGV[2], 'patterns', ARGV[3])
+        redis.call('DEL', KEYS[2])
+        for i = 6, #ARGV do redis.call('SADD', KEYS[2], ARGV[i]) end
+        redis.call('SADD', KEYS[3], ARGV[4])
+        for i = 1, 3 do redis.call('EXPIRE', KEYS[i], ARGV[5]) end
+        return 1
+    """
+    CLAIM = """
+        local claimed = {}
+        for _, id in ipairs(ARGV) do
+            if redis.call('SADD', KEYS[1], id) == 1 then table.insert(claimed, id) end
+        end
+        return claimed
+    """
+    LEASE = """
+        local holder = redis.call('GET', KEYS[1])
+        if holder and holder ~= ARGV[1] then return 0 end
+        redis.call('SET', KEYS[1], ARGV[1], 'PX', ARGV[2])
+        return 1
+    """
+    RELEASE = """
+        if redis.call('GET', KEYS[1]) == ARGV[1] then redis.call('DEL', KEYS[1]) end
+    """
+
+    def __init__(self, client):
+        self.client = client
+        self._draw = client.register_script(self.DRAW)
+        self._put_round = client.register_script(self.PUT_ROUND)
+        self._claim = client.register_script(self.CLAIM)
+        self._lease = client.register_script(self.LEASE)
+        self._release = client.register_script(self.RELEASE)
+
+    @staticmethod
+    def _round_key(game_id, round_id):
+        return f"live:round:{game_id}:{round_id}"
+
+    def _keys(self, game_id, round_id):
+        key = self._round_key(game_id, round_id)
+        return key, f"{key}:won", f"live:game:{game_id}:rounds"
+
+    def get_game(self, game_id):
+        info = self.client.hgetall(f"live:game:{game_id}")
+        if not info:
+            return None
+        return {"state": info[b"state"].decode(), "rounds": int(info[b"rounds"])}
+
+    def put_game(self, game_id, info):
+        key = f"live:game:{game_id}"
+        self.client.pipeline().hset(key, mapping=info).expire(key, GAME_TTL).execute()
+
+    def drop_game(self, game_id):
+        self.client.delete(f"live:game:{game_id}")
+
+    def get_round(self, game_id, round_id):
+        key, won_key, _ = self._keys(game_id, round_id)
+        (order, cursor, patterns), won = self.client.pipeline().hmget(
+            key, "order", "cursor", "patterns"
+        ).smembers(won_key).execute()
+        if order is None:
+            return None
+        return RoundState(order, cursor, json.loads(patterns), {pid.decode() for pid in won})
+
+    def put_round(self, game_id, round_id, order, cursor, patterns, won=()):
+        self._put_round(
+            keys=self._keys(game_id, round_id),
+            args=[bytes(order), cursor, json.dumps(patterns), round_id, ROUND_TTL, *won],
+        )
+
+    def draw(self, game_id, round_id):
+        key, won_key, _ = self._keys(game_id, round_id)
+        result = self._draw(keys=[key, won_key, self.DIRTY], args=[f"{game_id}:{round_id}", ROUND_TTL])
+        if result is None:
+            return None
+        drew, cursor, order = result
+        return bool(drew), int(cursor), bytes(order)
+
+    def claim(self, game_id, round_id, pattern_ids):
+        if not pattern_ids:
+            return []
+        _, won_key, _ = self._keys(game_id, round_id)
+        return [pid.decode() for pid in self._claim(keys=[won_key], args=list(pattern_ids))]
+
+    def release(self, game_id, round_id, pattern_ids):
+        if pattern_ids:
+            self.client.srem(self._keys(game_id, round_id)[1], *pattern_ids)
+
+    def cursors(self, keys):
+        pipe = self.client.pipeline()
+        for game_id, round_id in keys:
+            pipe.hget(self._round_key(game_id, round_id), "cursor")
+        return {key: int(c) for key, c in zip(keys, pipe.execute()) if c is not None}
+
+    def game_rounds(self, game_id):
+        return [(game_id, int(r)) for r in self.client.smembers(f"live:game:{game_id}:rounds")]
+
+    def pop_dirty(self, count=1000):
+        keys = self.client.spop(self.DIRTY, count) or []
+        return [tuple(int(part) for part in key.split(b":")) for key in keys]
+
+    def mark_dirty(self, keys):
+        if keys:
+            self.client.sadd(self.DIRTY, *[f"{g}:{r}" for g, r in keys])
+
+    def delete_game(self, game_id):
+        rounds = self.game_rounds(game_id)
+        keys = [f"live:game:{game_id}", f"live:game:{game_id}:rounds", f"live:winners:{game_id}"]
+        for _, round_id in rounds:
+            keys.extend(self._keys(game_id, round_id)[:2])
+        self.client.delete(*keys)
+        if rounds:
+            self.client.srem(self.DIRTY, *[f"{g}:{r}" for g, r in rounds])
+
+    def take_leases(self, keys, owner, ttl):
+        pipe = self.client.pipeline()
+        for game_id, round_id in keys:
+            self._lease(keys=[f"live:lease:{game_id}:{round_id}"], args=[owner, int(ttl * 1000)], client=pipe)
+        return [key for key, held in zip(keys, pipe.execute()) if held]
+
+    def release_lease(self, key, owner):
+        self._release(keys=["live:lease:%d:%d" % key], args=[owner])
+
+    def autocall_rounds(self):
+        return {
+            tuple(int(part) for part in key.split(b":")): float(interval)
+            for key, interval in self.client.hgetall(self.AUTOCALL).items()
+        }
+
+    def set_autocall(self, key, interval):
+        if interval is None:
+            self.client.hdel(self.AUTOCALL, "%d:%d" % key)
+        else:
+            self.client.hset(self.AUTOCALL, "%d:%d" % key, interval)
+
+    def set_revoked(self, user_id, revoked, ttl):
+        if revoked:
+            self.client.set(f"live:revoked:{user_id}", 1, ex=int(ttl))
+        else:
+            self.client.delete(f"live:revoked:{user_id}")
+
+    def is_revoked(self, user_id):
+        return bool(self.client.exists(f"live:revoked:{user_id}"))
+
+    def get_winners(self, game_id):
+        version, frame = self.client.hmget(f"live:winners:{game_id}", "version", "frame")
+        return None if frame is None else (version.decode(), frame)
+
+    def put_winners(self, game_id, version, frame):
+        key = f"live:winners:{game_id}"
+        self.client.pipeline().hset(key, mapping={"version": version, "frame": frame}).expire(key, ROUND_TTL).execute()
+
+    def tickets_version(self, key):
+        version = self.client.get("live:tickets:%d:%d" % key)
+        return None if version is None else version.decode()
+
+    def set_tickets_version(self, key, version):
+        self.client.set("live:tickets:%d:%d" % key, version, ex=ROUND_TTL)
+
+
+def _build_store():
+    layer = settings.CHANNEL_LAYERS["default"]
+    kind = getattr(settings, "ROUND_STATE_STORE", "") or ("redis" if "Redis" in layer["BACKEND"] else "memory")
+    if kind == "memory":
+        return MemoryStore()
+
+    import redis
+    host = layer["CONFIG"]["hosts"][0]
+    if isinstance(host, dict):
+        host = host["address"]
+    if isinstance(host, str):
+        return RedisStore(redis.Redis.from_url(host))
+    return RedisStore(redis.Redis(*host))
+
+
+_store = None
+_store_lock = threading.Lock()
+
+
+def get_store():
+    global _store
+    if _store is None:
+        with _store_lock:
+            if _store is None:
+                _store = _build_store()
+    return _store
+
+
+# -----------------------
+# Loading from the database
+# -----------------------
+
+def game_info(game_id):
+    """{"state", "rounds"} of a game, or None if it doesn't exist."""
+    store, game_id = get_store(), int(game_id)
+    info = store.get_game(game_id)
+    if info is None:
+        row = Game.objects.filter(id=game_id).annotate(round_count=Count("rounds")).values_list("state", "round_count").first()
+        if row is None:
+            return None
+        info = {"state": row[0], "rounds": row[1]}
+        store.put_game(game_id, info)
+    return info
+
+
+def _round_data(game_id, round_id):
+    return rounds.round_data(game_id, round_id)
+
+
+def round_state(game_id, round_id):
+    """The live state of a round, loading it (and starting its deck) on first use. None for an invalid round."""
+    store, game_id, round_id = get_store(), int(game_id), int(round_id)
+    state = store.get_round(game_id, round_id)
+    if state is not None:
+        return state
+
+    round_data = _round_data(game_id, round_id)
+    if round_data is None:
+        return None
+    round_deck = deck.start_deck(game_id, round_id, round_data.get("called_numbers", []))
+    patterns = round_data.get("patterns", [])
+    store.put_round(
+        game_id, round_id, bytes(round_deck.order), round_deck.cursor, patterns,
+        won=[p["id"] for p in patterns if p.get("won")],
+    )
+    return store.get_round(game_id, round_id)
+
+
+# -----------------------
+# Draws and claims
+# -----------------------
+
+def draw(game_id, round_id):
+    """
+    Draw the next number of the round. Returns (number, called_numbers);
+    number is None once all 90 are out (or the round doesn't exist).
+    """
+    store, game_id, round_id = get_store(), int(game_id), int(round_id)
+    result = store.draw(game_id, round_id)
+    if result is None:
+        if round_state(game_id, round_id) is None:
+            return None, []
+        result = store.draw(game_id, round_id)
+
+    drew, cursor, order = result
+    if not drew:
+        return None, list(order[:cursor])
+    if cursor == len(order):
+        flush([(game_id, round_id)])  # deck ran out: the round is over
+    return order[cursor - 1], list(order[:cursor])
+
+
+def called_numbers(game_id, round_id, round_data=None):
+    """Numbers drawn so far, from the store when the round is live, else from the database."""
+    game_id, round_id = int(game_id), int(round_id)
+    state = get_store().get_round(game_id, round_id)
+    if state is not None:
+        return state.called
+    if round_data is None:
+        round_data = _round_data(game_id, round_id)
+        if round_data is None:
+            return []
+    return deck.called_numbers(game_id, round_id, round_data)
+
+
+def live_called_numbers(game_id):
+    """{round_id: numbers drawn} for the game's rounds held in the store, which run ahead of their Draw rows."""
+    store, game_id = get_store(), int(game_id)
+    called = {}
+    for key in store.game_rounds(game_id):
+        state = store.get_round(*key)
+        if state is not None:
+            called[key[1]] = state.called
+    return called
+
+
+def deck_cursors(game_id):
+    """{round_id: numbers drawn} for every started round, live rounds taken from the store."""
+    store, game_id = get_store(), int(game_id)
+    cursors = deck.deck_cursors(game_id)
+    for (_, round_id), cursor in store.cursors(store.game_rounds(game_id)).items():
+        cursors[round_id] = cursor
+    return cursors
+
+
+def claim_patterns(game_id, round_id, pattern_ids):
+    """Atomically mark patterns won; returns the ids this call won (others were already taken)."""
+    return get_store().claim(int(game_id), int(round_id), list(pattern_ids))
+
+
+def release_patterns(game_id, round_id, pattern_ids):
+    """Undo claim_patterns when paying the winners failed."""
+    get_store().release(int(game_id), int(round_id), list(pattern_ids))
+
+
+# -----------------------
+# Auto-calling
+# -----------------------
+
+def autocall_rounds():
+    """{(game_id, round_id): seconds between draws} for every round being called automatically."""
+    return get_store().autocall_rounds()
+
+
+def set_autocall(game_id, round_id, interval):
+    """Call a round automatically every `interval` seconds; None stops it."""
+    get_store().set_autocall((int(game_id), int(round_id)), interval)
+
+
+def take_leases(keys, owner, ttl):
+    """Take or renew owner's lease on each (game_id, round_id); returns the keys it holds."""
+    return get_store().take_leases(list(keys), owner, ttl)
+
+
+def release_lease(key, owner):
+    get_store().release_lease(key, owner)
+
+
+# -----------------------
+# Deactivated users
+# -----------------------
+
+def set_user_revoked(user_id, revoked, ttl):
+    """Mark a user as deactivated (for `ttl` seconds, the lifetime of their tokens), or clear it."""
+    get_store().set_revoked(int(user_id), revoked, ttl)
+
+
+def is_user_revoked(user_id):
+    return get_store().is_revoked(int(user_id))
+
+
+# -----------------------
+# Round ticket versions
+# -----------------------
+
+def tickets_version(game_id, round_id):
+    """The version of the round's tickets (None until they first change); see core.cache."""
+    return get_store().tickets_version((int(game_id), int(round_id)))
+
+
+def tickets_changed(game_id, round_id):
+    """Give the round's tickets a new version, so every process reloads its cached copy."""
+    get_store().set_tickets_version((int(game_id), int(round_id)), secrets.token_hex(8))
+
+
+# -----------------------
+# Write-behind
+# -----------------------
+
+def flush(keys=None, batch_size=500):
+    """
+    Write draw cursors back to RoundDeck, and the numbers drawn since as
+    Draw rows: the given (game_id, round_id) keys, or every round drawn
+    from since the last flush. Returns the number of rounds written.
+    """
+    store = get_store()
+    keys = store.pop_dirty() if keys is None else list(keys)
+    items = []
+    try:
+        items = list(store.cursors(keys).items())
+        for start in range(0, len(items), batch_size):
+            batch = items[start:start + batch_size]
+            where = reduce(or_, (Q(game_id=g, round_id=r) for (g, r), _ in batch))
+            with transaction.atomic():
+                decks = {
+                    (g, r): (bytes(order), cursor)
+                    for g, r, order, cursor in RoundDeck.objects.filter(where).values_list("game_id", "round_id", "order", "cursor")
+                }
+                round_ids = dict(
+                    ((g, n), pk) for pk, g, n in Round.objects.filter(
+                        reduce(or_, (Q(game_id=g, number=r) for (g, r), _ in batch))
+                    ).values_list("id", "game_id", "number")
+                )
+                # cursors only move forward, so a late or repeated flush is harmless
+                RoundDeck.objects.filter(where).update(cursor=Greatest(
+                    F("cursor"),
+                    Case(
+                        *(When(game_id=g, round_id=r, then=Value(c)) for (g, r), c in batch),
+                        default=F("cursor"),
+                        output_field=RoundDeck._meta.get_field("cursor"),
+                    ),
+                ))
+                # and each number drawn since becomes a Draw row (core.rounds)
+                rounds.record_draws({
+                    round_ids[key]: (decks[key][0], decks[key][1] + 1, cursor)
+                    for key, cursor in batch
+                    if key in decks and key in round_ids and cursor > decks[key][1]
+                })
+    except Exception:
+        # whatever failed, the keys stay dirty; batches already written are no-ops next time
+        store.mark_dirty(keys)
+        raise
+    return len(items)
+
+
+def flush_game(game_id):
+    store = get_store()
+    return flush(store.game_rounds(int(game_id)))
+
+
+def evict_game(game_id):
+    """Flush a game's live rounds and drop them from the store (the next use reloads from the database)."""
+    flush_game(game_id)
+    get_store().delete_game(int(game_id))
+
+
+def set_game_state(game_id, state):
+    """Call after a game's state change is committed."""
+    if state == "completed":
+        evict_game(game_id)
+        return
+    get_store().drop_game(int(game_id))
+    if state == "paused":
+        flush_game(game_id)
+
+
+class Flusher(threading.Thread):
+    def __init__(self, interval):
+        super().__init__(name="live-round-flusher", daemon=True)
+        self.interval = interval
+        self.stopped = threading.Event()
+
+    def run(self):
+        while not self.stopped.wait(self.interval):
+            try:
+                flush()
+            except Exception:
+                logger.exception("Flushing live round state failed; will retry")
+            finally:
+                close_old_connections()
+
+    def stop(self):
+        self.stopped.set()
+        self.join(timeout=self.interval + 5)
+        flush()
+
+
+_flusher = None
+
+
+def start_flusher():
+    """Start this process's write-behind thread (once; no-op when the interval is 0)."""
+    global _flusher
+    interval = getattr(settings, "ROUND_STATE_FLUSH_INTERVAL", 2)
+    if _flusher is not None or interval <= 0:
+        return
+    _flusher = Flusher(interval)
+    _flusher.start()
+    atexit.register(_flusher.stop)
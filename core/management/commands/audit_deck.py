@@ -0,0 +1,27 @@
+from django.core.management.base import BaseCommand, CommandError
+
+from core.deck import verify_deck
+from core.models import RoundDeck
+
+
+class Command(BaseCommand):
+    help = "Replay a round's draw order from its stored seed and check it against what was drawn."
+
+    def add_arguments(self, parser):
+        parser.add_argument("game_id", type=int)
+        parser.add_argument("round_id", type=int)
+
+    def handle(self, *args, **options):
+        try:
+            deck = RoundDeck.objects.get(game_id=options["game_id"], round_id=options["round_id"])
+        except RoundDeck.DoesNotExist:
+            raise CommandError("This round has no deck (no number was drawn yet).")
+
+        order = list(bytes(deck.order))
+        self.stdout.write(f"seed:   {deck.seed}")
+        self.stdout.write(f"drawn:  {deck.cursor}/90")
+        self.stdout.write(f"called: {order[:deck.cursor]}")
+        if verify_deck(deck):
+            self.stdout.write(self.style.SUCCESS("Draw order matches the seed."))
+        else:
+            raise CommandError("Draw order does NOT match the seed.")
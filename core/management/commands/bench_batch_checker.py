@@ -0,0 +1,49 @@
+import random
+import time
+
+from django.core.management.base import BaseCommand
+
+from core.batch import BatchChecker
+from core.ops import PATTERN_NAMES, Checker
+from core.tickets import random_ticket
+
+
+class Command(BaseCommand):
+    help = "Measure BatchChecker (numpy) vs Checker throughput in tickets/sec across all patterns."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[1000, 10000, 100000])
+        parser.add_argument("--called", type=int, default=30, help="Numbers already called at check time")
+        parser.add_argument("--repeat", type=int, default=5)
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--skip-checker", action="store_true", help="Only time the numpy backend")
+
+    def handle(self, *args, **options):
+        rng = random.Random(options["seed"])
+        called = rng.sample(range(1, 91), options["called"])
+        patterns = list(PATTERN_NAMES)
+        repeat = options["repeat"]
+
+        self.stdout.write(f"{'tickets':>10} {'numpy t/s':>14} {'checker t/s':>14} {'speedup':>8}")
+        for size in options["sizes"]:
+            tickets = [random_ticket(rng) for _ in range(size)]
+            batch = BatchChecker(range(size), tickets)
+
+            start = time.perf_counter()
+            for _ in range(repeat):
+                batch.winners(called, patterns)
+            numpy_rate = size * repeat / (time.perf_counter() - start)
+
+            checker_rate = None
+            if not options["skip_checker"]:
+                checker = Checker()
+                mask = checker.called_mask(called)
+                start = time.perf_counter()
+                for ticket in tickets:
+                    checker.check_patterns(ticket, called, patterns, called_mask=mask)
+                checker_rate = size / (time.perf_counter() - start)
+
+            self.stdout.write(
+                f"{size:>10} {numpy_rate:>14,.0f} "
+                + (f"{checker_rate:>14,.0f} {numpy_rate / checker_rate:>7.1f}x" if checker_rate else f"{'-':>14} {'-':>8}")
+            )
@@ -0,0 +1,108 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from core import bench
+from core.ops import PATTERN_NAMES, GameWinnerHandler
+
+
+class Command(BaseCommand):
+    help = (
+        "Per-draw latency and allocations of Checker.check_patterns and "
+        "GameWinnerHandler.check_and_assign_winners on synthetic rounds, and "
+        "the creator-perceived draw latency with winner checks inline or pipelined, "
+        "and the CPU of fanning one draw out to --connections sockets. "
+        "Run with --settings=backserver.bench_settings (in-memory SQLite)."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--sizes", type=int, nargs="+", default=[100, 1000, 10000, 50000])
+        parser.add_argument("--connections", type=int, nargs="+", default=[1000, 5000, 20000],
+                            help="Sockets per room for the broadcast benchmark")
+        parser.add_argument("--depths", type=int, nargs="+", default=[5, 30, 80])
+        parser.add_argument("--targets", nargs="+", choices=["checker", "handler", "draw", "broadcast"],
+                            default=["checker", "handler"])
+        parser.add_argument("--backends", nargs="+", choices=GameWinnerHandler.BACKENDS,
+                            default=[settings.WINNER_CHECK_BACKEND], help="Handler backends to run")
+        parser.add_argument("--repeat", type=int, default=10, help="Timed draws per scenario")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--save", metavar="PATH", help="Write the results as a JSON baseline")
+        parser.add_argument("--baseline", metavar="PATH", help="Compare against a saved baseline")
+        parser.add_argument("--threshold", type=float, default=0.2,
+                            help="Allowed growth over the baseline before failing (0.2 = 20%%)")
+        parser.add_argument("--noise-ms", type=float, default=0.5,
+                            help="Ignore latency changes smaller than this many milliseconds")
+
+    def handle(self, *args, **options):
+        if any(d < 1 or d > 90 for d in options["depths"]):
+            raise CommandError("Depths must be between 1 and 90.")
+        baseline = None
+        if options["baseline"]:
+            with open(options["baseline"]) as f:
+                baseline = json.load(f)["scenarios"]
+
+        handler = "handler" in options["targets"] or "draw" in options["targets"]
+        if handler and connection.vendor != "sqlite":
+            raise CommandError("The handler and draw benchmarks run on SQLite only: use --settings=backserver.bench_settings")
+
+        sizes = sorted(options["sizes"])
+        per_size = {"checker", "handler", "draw"} & set(options["targets"])
+        tickets = bench.make_tickets(sizes[-1], options["seed"]) if per_size else []
+        results = {}
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False) if handler else None
+        try:
+            self.stdout.write(
+                f"{'scenario':<38} {'p50 ms':>9} {'p90 ms':>9} {'p99 ms':>9} {'max ms':>9} {'peak KiB':>10} {'net KiB':>9} {'open':>5}"
+            )
+            for size in sizes if per_size else []:
+                game = bench.build_game(tickets[:size], title=f"bench-{size}") if handler else None
+                for depth in options["depths"]:
+                    if "checker" in options["targets"]:
+                        result = bench.bench_checker(tickets[:size], depth, options["repeat"], options["seed"])
+                        self.report(results, bench.scenario_key("checker", "checker", size, depth), result)
+                    if "handler" in options["targets"]:
+                        for backend in options["backends"]:
+                            result = bench.bench_handler(game, depth, options["repeat"], options["seed"], backend)
+                            self.report(results, bench.scenario_key("handler", backend, size, depth), result)
+                    if "draw" in options["targets"]:
+                        for mode in ("inline", "pipeline"):
+                            result = bench.bench_draw(game, depth, options["repeat"], options["seed"], mode == "pipeline")
+                            self.report(results, bench.scenario_key("draw", mode, size, depth), result)
+        finally:
+            if handler:
+                connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        if "broadcast" in options["targets"]:
+            for connections in options["connections"]:
+                for depth in options["depths"]:
+                    for protocol in ("delta", "full"):
+                        for mode in ("per-socket", "pre-encoded"):
+                            result = bench.bench_broadcast(
+                                connections, depth, options["repeat"], options["seed"],
+                                pre_encoded=mode == "pre-encoded", full_list=protocol == "full",
+                            )
+                            key = bench.scenario_key("broadcast", f"{mode}-{protocol}", connections, depth)
+                            self.report(results, key, result)
+
+        if options["save"]:
+            with open(options["save"], "w") as f:
+                json.dump({"environment": bench.environment(), "seed": options["seed"], "scenarios": results}, f, indent=2)
+            self.stdout.write(f"Baseline written to {options['save']}")
+
+        if baseline is not None:
+            regressions = bench.compare(results, baseline, options["threshold"], noise_ms=options["noise_ms"])
+            for key, metric, old, new in regressions:
+                self.stdout.write(self.style.ERROR(f"{key}: {metric} {old} -> {new} (+{(new / old - 1):.0%})"))
+            if regressions:
+                raise CommandError(f"{len(regressions)} regression(s) over {options['threshold']:.0%}")
+            self.stdout.write(self.style.SUCCESS("No regressions against the baseline."))
+
+    def report(self, results, key, result):
+        results[key] = result
+        self.stdout.write(
+            f"{key:<38} {result['p50_ms']:>9.2f} {result['p90_ms']:>9.2f} {result['p99_ms']:>9.2f} "
+            f"{result['max_ms']:>9.2f} {result['alloc_peak_kib']:>10.1f} {result['alloc_net_kib']:>9.1f} "
+            f"{result.get('open_patterns', len(PATTERN_NAMES)):>5}"
+        )
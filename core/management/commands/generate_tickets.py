@@ -0,0 +1,65 @@
+import os
+import random
+import time
+from concurrent.futures import ProcessPoolExecutor
+from itertools import repeat
+
+from django.core.management.base import BaseCommand, CommandError
+
+from core.models import Tickets
+from core.tickets import STRIP_SIZE, generate_chunk
+
+
+class Command(BaseCommand):
+    help = (
+        "Fill the Tickets pool with valid housie tickets (or whole 6-ticket strips), "
+        "generated across a process pool and inserted in batches. Duplicates are skipped."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("count", type=int, help="Tickets to generate")
+        parser.add_argument("--strips", action="store_true",
+                            help="Generate whole strips: every 6 tickets hold each number 1-90 once")
+        parser.add_argument("--workers", type=int, default=os.cpu_count() or 1)
+        parser.add_argument("--chunk", type=int, default=10_000, help="Tickets per worker task")
+        parser.add_argument("--batch-size", type=int, default=5_000, help="Rows per INSERT")
+        parser.add_argument("--seed", type=int, help="Make the run reproducible")
+
+    def handle(self, *args, **options):
+        count, chunk = options["count"], options["chunk"]
+        if count < 1 or chunk < 1:
+            raise CommandError("count and --chunk must be positive.")
+        strips = options["strips"]
+        per_item = STRIP_SIZE if strips else 1
+        chunk = max(1, chunk // per_item)  # strips (or tickets) per task
+        items = -(-count // per_item)
+        sizes = [min(chunk, items - start) for start in range(0, items, chunk)]
+        seed = options["seed"] if options["seed"] is not None else random.SystemRandom().randrange(2 ** 32)
+        seeds = [seed * 1_000_003 + i for i in range(len(sizes))]
+
+        before = Tickets.objects.count()
+        started = time.perf_counter()
+        generated = 0
+        pending = []
+        with ProcessPoolExecutor(max_workers=max(1, options["workers"])) as executor:
+            for rows in executor.map(generate_chunk, seeds, sizes, repeat(strips)):
+                for digest, ticket in rows:
+                    pending.append(Tickets(ticket_data=ticket, content_hash=digest))
+                generated += len(rows)
+                while len(pending) >= options["batch_size"]:
+                    self.insert(pending[:options["batch_size"]])
+                    del pending[:options["batch_size"]]
+                self.stdout.write(f"{generated:,} / {items * per_item:,} generated", ending="\r")
+            self.insert(pending)
+
+        added = Tickets.objects.count() - before
+        elapsed = time.perf_counter() - started
+        self.stdout.write("")
+        self.stdout.write(self.style.SUCCESS(
+            f"Added {added:,} tickets in {elapsed:.1f}s ({added / elapsed:,.0f}/s); "
+            f"{generated - added:,} duplicates skipped. Seed {seed}."
+        ))
+
+    def insert(self, batch):
+        # content_hash is unique: tickets already in the pool are dropped by the database
+        Tickets.objects.bulk_create(batch, ignore_conflicts=True)
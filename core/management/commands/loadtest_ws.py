@@ -0,0 +1,73 @@
+import asyncio
+import json
+
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+
+from wsapp import loadtest
+
+
+class Command(BaseCommand):
+    help = (
+        "Connect a creator and --players simulated players to one round over the "
+        "websocket app, draw --draws numbers and report connect time, "
+        "draw-to-receive latency, messages/sec and memory per connection. "
+        "Run with --settings=backserver.bench_settings (in-memory SQLite and channel layer), "
+        "or with a Redis channel layer to include it."
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument("--players", type=int, default=1000)
+        parser.add_argument("--draws", type=int, default=90)
+        parser.add_argument("--interval", type=float, default=0.1, help="Seconds between draws")
+        parser.add_argument("--protocol", choices=["delta", "full"], default="delta",
+                            help="What the players ask for (?protocol=full for the legacy frames)")
+        parser.add_argument("--connect-concurrency", type=int, default=500,
+                            help="Players connecting at the same time")
+        parser.add_argument("--seed", type=int, default=0)
+        parser.add_argument("--json", metavar="PATH", help="Also write the results as JSON")
+
+    def handle(self, *args, **options):
+        if not 1 <= options["draws"] <= 90:
+            raise CommandError("--draws must be between 1 and 90.")
+        if connection.vendor != "sqlite":
+            raise CommandError("The load test builds its game in a throwaway SQLite database: use --settings=backserver.bench_settings")
+
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True, serialize=False)
+        try:
+            self.stdout.write(f"Creating {options['players']} players...")
+            game, creator_token, tokens = loadtest.build_game(options["players"], options["seed"])
+            run = loadtest.LoadRun(
+                game, creator_token, tokens, draws=options["draws"], interval=options["interval"],
+                full_list=options["protocol"] == "full", connect_concurrency=options["connect_concurrency"],
+            )
+            result = asyncio.run(run.run())
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+
+        self.stdout.write(f"{'':<16} {'p50 ms':>9} {'p95 ms':>9} {'p99 ms':>9} {'max ms':>9}")
+        for name in ("connect", "latency"):
+            stats = result[name]
+            if stats:
+                self.stdout.write(
+                    f"{name:<16} {stats['p50_ms']:>9.2f} {stats['p95_ms']:>9.2f} {stats['p99_ms']:>9.2f} {stats['max_ms']:>9.2f}"
+                )
+        self.stdout.write(f"connected {result['clients']} players in {result['connect_wall_s']} s")
+        self.stdout.write(f"received {result['received']} of {result['expected']} draws, {result['messages_per_s']} messages/s")
+        self.stdout.write(f"{result['rss_per_connection_kib']} KiB RSS per connection, {result['rss_mib']} MiB in all")
+        outboxes = result["outbox"]
+        self.stdout.write(
+            f"{outboxes['lagging']} lagging sockets, {outboxes['resyncs']} resyncs, "
+            f"{outboxes['dropped_frames']} dropped frames, {outboxes['slow_closes']} closed as slow"
+        )
+        cache = result["principals"]
+        self.stdout.write(f"principal cache: {cache['hits']} hits, {cache['misses']} misses, {cache['size']} cached")
+        if result["errors"]:
+            self.stdout.write(self.style.ERROR(f"creator errors: {sorted(set(result['errors']))}"))
+        if result["received"] < result["expected"]:
+            self.stdout.write(self.style.WARNING("Some draws never reached their players."))
+
+        if options["json"]:
+            with open(options["json"], "w") as f:
+                json.dump(result, f, indent=2)
+            self.stdout.write(f"Results written to {options['json']}")
@@ -0,0 +1,23 @@
+from django.core.management.base import BaseCommand
+
+from core import counters
+from core.models import Game
+
+
+class Command(BaseCommand):
+    help = "Recount the summary counters on Game (players, rounds, winners, prizes paid) and fix any that drifted."
+
+    def add_arguments(self, parser):
+        parser.add_argument("game_ids", nargs="*", type=int, help="Only these games (default: all)")
+        parser.add_argument("--check", action="store_true", help="Report drift without fixing it; exit 1 if there is any")
+
+    def handle(self, *args, **options):
+        games = Game.objects.filter(id__in=options["game_ids"]) if options["game_ids"] else None
+        drifted = counters.reconcile(games, fix=not options["check"])
+        for game_id, diff in sorted(drifted.items()):
+            changes = ", ".join(f"{field} {stored} -> {actual}" for field, (stored, actual) in diff.items())
+            self.stdout.write(f"game {game_id}: {changes}")
+        verb = "drifted" if options["check"] else "fixed"
+        self.stdout.write(self.style.SUCCESS(f"{len(drifted)} game(s) {verb}."))
+        if options["check"] and drifted:
+            raise SystemExit(1)
@@ -0,0 +1,51 @@
+import json
+
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from core.patterns import PATTERN_NAMES, PatternSpecError
+from core.simulate import simulate_round
+
+
+class Command(BaseCommand):
+    help = "Simulate prize rounds: when each pattern is won and how many tickets share it."
+
+    def add_arguments(self, parser):
+        parser.add_argument("--players", type=int, default=100)
+        parser.add_argument("--patterns", nargs="+", default=list(PATTERN_NAMES),
+                            help="Built-in pattern names, or a JSON list of prize_rounds-style entries")
+        parser.add_argument("--simulations", type=int, default=100_000)
+        parser.add_argument("--workers", type=int, default=settings.SIMULATION_WORKERS or None)
+        parser.add_argument("--seed", type=int)
+        parser.add_argument("--json", action="store_true", help="Print the full result as JSON")
+
+    def handle(self, *args, **options):
+        patterns = options["patterns"]
+        if len(patterns) == 1 and patterns[0].lstrip().startswith("["):
+            patterns = json.loads(patterns[0])
+        try:
+            result = simulate_round(
+                options["players"], patterns,
+                simulations=options["simulations"], workers=options["workers"], seed=options["seed"],
+            )
+        except (ValueError, PatternSpecError) as e:
+            raise CommandError(str(e))
+
+        if options["json"]:
+            self.stdout.write(json.dumps(result, indent=2))
+            return
+
+        self.stdout.write(
+            f"{result['players']} players, {result['simulations']:,} simulations, "
+            f"{result['workers']} workers, seed {result['seed']}: {result['elapsed']}s"
+        )
+        self.stdout.write(f"{'pattern':<20} {'won':>6} {'p10':>4} {'p50':>4} {'p90':>4} {'co-win':>7} {'shared':>7}")
+        for name, stats in result["patterns"].items():
+            step, co = stats["step"], stats["co_winners"]
+            if co["mean"] is None:
+                self.stdout.write(f"{name:<20} {0:>6.0%}")
+                continue
+            self.stdout.write(
+                f"{name:<20} {stats['won_ratio']:>6.0%} {step['p10']:>4} {step['p50']:>4} {step['p90']:>4} "
+                f"{co['mean']:>7.2f} {co['p_shared']:>7.0%}"
+            )
@@ -1,24 +1,33 @@
 from urllib.parse import parse_qs
+from asgiref.sync import sync_to_async
 from channels.db import database_sync_to_async
 from django.contrib.auth.models import AnonymousUser
 from rest_framework_simplejwt.tokens import UntypedToken
 from rest_framework_simplejwt.exceptions import InvalidToken, TokenError
-from rest_framework_simplejwt.authentication import JWTAuthentication
-from django.contrib.auth import get_user_model
+from rest_framework_simplejwt.settings import api_settings
 
-User = get_user_model()
+from core import live
+from core.principals import load_principal, principals
 
 
-@database_sync_to_async
-def get_user(validated_token):
+async def get_user(validated_token):
     """
-    Return user from a validated JWT token.
+    Return the Principal for a validated JWT token, from the per-process
+    cache when possible (see core.principals). Cached principals are
+    checked against the revocations in the live store.
     """
     try:
-        user_id = validated_token.get("user_id")
-        return User.objects.get(id=user_id)
-    except User.DoesNotExist:
+        user_id = int(validated_token.get(api_settings.USER_ID_CLAIM))
+    except (TypeError, ValueError):
         return AnonymousUser()
+    principal = principals.get(user_id)
+    if principal is None:
+        principal = await database_sync_to_async(load_principal)(validated_token)
+    elif await sync_to_async(live.is_user_revoked, thread_sensitive=False)(user_id):
+        # deactivated since it was cached, possibly by another process
+        principals.invalidate(user_id)
+        principal = None
+    return principal or AnonymousUser()
 
 
 class JWTAuthMiddleware:
@@ -39,9 +48,7 @@ class JWTAuthMiddleware:
         if token:
             try:
                 validated_token = UntypedToken(token)
-                jwt_auth = JWTAuthentication()
-                user = await get_user(validated_token)
-                scope["user"] = user
+                scope["user"] = await get_user(validated_token)
             except (InvalidToken, TokenError):
                 scope["user"] = AnonymousUser()
         else:
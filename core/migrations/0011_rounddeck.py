@@ -0,0 +1,29 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:14
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0010_alter_game_state'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='RoundDeck',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('round_id', models.PositiveIntegerField()),
+                ('seed', models.CharField(max_length=64)),
+                ('order', models.BinaryField(max_length=90)),
+                ('cursor', models.PositiveSmallIntegerField(default=0)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='decks', to='core.game')),
+            ],
+            options={
+                'unique_together': {('game', 'round_id')},
+            },
+        ),
+    ]
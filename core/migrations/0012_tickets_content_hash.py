@@ -0,0 +1,48 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:27
+
+import hashlib
+
+from django.db import migrations, models
+
+
+def ticket_hash(ticket):
+    """core.tickets.ticket_hash as of this migration, copied so later changes to it don't alter the backfill."""
+    return hashlib.blake2b(bytes(n for row in ticket for n in row), digest_size=16).hexdigest()
+
+
+def backfill_hashes(apps, schema_editor):
+    """Hash the existing pool; later duplicates (and malformed tickets) stay unhashed."""
+    Tickets = apps.get_model('core', 'Tickets')
+    seen = set()
+    batch = []
+    for ticket in Tickets.objects.only('id', 'ticket_data').iterator(chunk_size=2000):
+        try:
+            digest = ticket_hash(ticket.ticket_data)
+        except (TypeError, ValueError):
+            continue
+        if digest in seen:
+            continue
+        seen.add(digest)
+        ticket.content_hash = digest
+        batch.append(ticket)
+        if len(batch) >= 2000:
+            Tickets.objects.bulk_update(batch, ['content_hash'])
+            batch = []
+    if batch:
+        Tickets.objects.bulk_update(batch, ['content_hash'])
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0011_rounddeck'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='tickets',
+            name='content_hash',
+            field=models.CharField(blank=True, editable=False, max_length=32, null=True, unique=True),
+        ),
+        migrations.RunPython(backfill_hashes, migrations.RunPython.noop),
+    ]
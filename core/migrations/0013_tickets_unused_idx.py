@@ -0,0 +1,17 @@
+# Generated by Django 5.2.18 on 2026-10-18 11:30
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0012_tickets_content_hash'),
+    ]
+
+    operations = [
+        migrations.AddIndex(
+            model_name='tickets',
+            index=models.Index(condition=models.Q(('used', False)), fields=['id'], name='tickets_unused_idx'),
+        ),
+    ]
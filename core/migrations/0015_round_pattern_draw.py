@@ -0,0 +1,124 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:34
+
+from decimal import Decimal, InvalidOperation
+
+import django.db.models.deletion
+import django.utils.timezone
+from django.db import migrations, models
+
+
+def _amount(value):
+    try:
+        return Decimal(str(value)).quantize(Decimal('0.01'))
+    except (InvalidOperation, ValueError):
+        return Decimal('0.00')
+
+
+def backfill_rounds(apps, schema_editor):
+    """Rows for every game's prize_rounds; draws from its decks, or the called_numbers written before them."""
+    Game = apps.get_model('core', 'Game')
+    Round = apps.get_model('core', 'Round')
+    Pattern = apps.get_model('core', 'Pattern')
+    Draw = apps.get_model('core', 'Draw')
+    RoundDeck = apps.get_model('core', 'RoundDeck')
+    for game in Game.objects.only('id', 'prize_rounds').iterator(chunk_size=500):
+        decks = {
+            round_id: bytes(order)[:cursor]
+            for round_id, order, cursor in RoundDeck.objects.filter(game=game).values_list('round_id', 'order', 'cursor')
+        }
+        patterns, draws = [], []
+        for number, entry in enumerate(game.prize_rounds or [], start=1):
+            round_row = Round.objects.create(game=game, number=number)
+            seen = set()
+            for position, pattern in enumerate(entry.get('patterns', []), start=1):
+                pattern_id, suffix = str(pattern.get('id', f'{number}.{position}')), 0
+                while pattern_id in seen:  # a repeated id falls back to the pattern's position
+                    suffix += 1
+                    pattern_id = f'{number}.{position}' if suffix == 1 else f'{number}.{position}-{suffix}'
+                seen.add(pattern_id)
+                patterns.append(Pattern(
+                    round=round_row,
+                    pattern_id=pattern_id,
+                    position=position,
+                    pattern_name=pattern.get('patternName', ''),
+                    prize_amount=_amount(pattern.get('prizeAmount', 0)),
+                    definition=pattern,
+                    won=bool(pattern.get('won')),
+                    won_by=pattern.get('wonBy'),
+                ))
+            called = decks[number] if number in decks else entry.get('called_numbers', [])
+            draws.extend(
+                Draw(round=round_row, seq=seq, number=value)
+                for seq, value in enumerate(dict.fromkeys(called), start=1)
+            )
+        Pattern.objects.bulk_create(patterns)
+        Draw.objects.bulk_create(draws)
+
+
+def restore_won_state(apps, schema_editor):
+    """Put the won state back into prize_rounds, where it lived before."""
+    Game = apps.get_model('core', 'Game')
+    Pattern = apps.get_model('core', 'Pattern')
+    for game in Game.objects.only('id', 'prize_rounds').iterator(chunk_size=500):
+        entries = game.prize_rounds or []
+        for pattern in Pattern.objects.filter(round__game=game, won=True).select_related('round'):
+            patterns = entries[pattern.round.number - 1].get('patterns', [])
+            if pattern.position <= len(patterns):
+                patterns[pattern.position - 1].update(won=True, wonBy=pattern.won_by)
+        Game.objects.filter(pk=game.pk).update(prize_rounds=entries)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0014_game_version'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Round',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('number', models.PositiveIntegerField()),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='rounds', to='core.game')),
+            ],
+            options={
+                'ordering': ['game', 'number'],
+                'unique_together': {('game', 'number')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Pattern',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('pattern_id', models.CharField(max_length=100)),
+                ('position', models.PositiveIntegerField()),
+                ('pattern_name', models.CharField(max_length=100)),
+                ('prize_amount', models.DecimalField(decimal_places=2, default=0.0, max_digits=10)),
+                ('definition', models.JSONField(default=dict)),
+                ('won', models.BooleanField(default=False)),
+                ('won_by', models.JSONField(blank=True, null=True)),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='patterns', to='core.round')),
+            ],
+            options={
+                'ordering': ['round', 'position'],
+                'indexes': [models.Index(fields=['round', 'won'], name='pattern_round_won_idx')],
+                'unique_together': {('round', 'pattern_id')},
+            },
+        ),
+        migrations.CreateModel(
+            name='Draw',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('seq', models.PositiveSmallIntegerField()),
+                ('number', models.PositiveSmallIntegerField()),
+                ('drawn_at', models.DateTimeField(default=django.utils.timezone.now)),
+                ('round', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='draws', to='core.round')),
+            ],
+            options={
+                'ordering': ['round', 'seq'],
+                'unique_together': {('round', 'number'), ('round', 'seq')},
+            },
+        ),
+        migrations.RunPython(backfill_rounds, restore_won_state),
+    ]
@@ -0,0 +1,55 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:40
+
+from django.db import migrations, models
+from django.db.models import Count, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+
+def backfill_counters(apps, schema_editor):
+    """Count what every existing game already has."""
+    Game = apps.get_model('core', 'Game')
+
+    def count(model_name, aggregate, output_field):
+        rows = (
+            apps.get_model('core', model_name).objects.filter(game=OuterRef('pk'))
+            .order_by().values('game').annotate(n=aggregate).values('n')[:1]
+        )
+        return Coalesce(Subquery(rows), Value(0), output_field=output_field)
+
+    Game.objects.update(
+        players_count=count('PlayerGame', Count('id'), models.IntegerField()),
+        rounds_count=count('Round', Count('id'), models.IntegerField()),
+        winners_count=count('RoundWise', Count('won_by'), models.IntegerField()),
+        prizes_distributed=count('PlayerGame', Sum('won_amount'), models.DecimalField(max_digits=12, decimal_places=2)),
+    )
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0015_round_pattern_draw'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='game',
+            name='players_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='prizes_distributed',
+            field=models.DecimalField(decimal_places=2, default=0, max_digits=12),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='rounds_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.AddField(
+            model_name='game',
+            name='winners_count',
+            field=models.PositiveIntegerField(default=0),
+        ),
+        migrations.RunPython(backfill_counters, migrations.RunPython.noop),
+    ]
@@ -0,0 +1,56 @@
+# Generated by Django 5.2.18 on 2026-10-18 12:46
+
+import django.db.models.deletion
+from django.conf import settings
+from decimal import ROUND_HALF_UP, Decimal
+
+from django.db import migrations, models
+
+
+def backfill_payouts(apps, schema_editor):
+    """Ledger rows for the wins paid so far, shared the way settlement shares a prize; their draw is unknown."""
+    RoundWise = apps.get_model('core', 'RoundWise')
+    Payout = apps.get_model('core', 'Payout')
+    batch = []
+    for entry in RoundWise.objects.prefetch_related('won_by').iterator(chunk_size=500):
+        winners = [user.id for user in entry.won_by.all()]
+        if not winners:
+            continue
+        share = (entry.prize_amount / len(winners)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
+        batch.extend(
+            Payout(game_id=entry.game_id, round_id=entry.round_id, pattern_id=entry.pattern_id, player_id=user_id, amount=share)
+            for user_id in winners
+        )
+        if len(batch) >= 2000:
+            Payout.objects.bulk_create(batch, ignore_conflicts=True)
+            batch = []
+    Payout.objects.bulk_create(batch, ignore_conflicts=True)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('core', '0016_game_counters'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='Payout',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('round_id', models.PositiveIntegerField()),
+                ('pattern_id', models.CharField(max_length=100)),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=10)),
+                ('seq', models.PositiveSmallIntegerField(null=True)),
+                ('created_at', models.DateTimeField(auto_now_add=True)),
+                ('game', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payouts', to='core.game')),
+                ('player', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='payouts', to=settings.AUTH_USER_MODEL)),
+            ],
+            options={
+                'ordering': ['game', 'round_id', 'seq'],
+                'indexes': [models.Index(fields=['game', 'player'], name='payout_game_player_idx')],
+                'unique_together': {('game', 'round_id', 'pattern_id', 'player')},
+            },
+        ),
+        migrations.RunPython(backfill_payouts, migrations.RunPython.noop),
+    ]
@@ -87,6 +87,13 @@ class Game(models.Model):
     state = models.CharField(max_length=50, choices=STATUS_CHOICES, default='upcoming')
     # Store all rounds and patterns
     prize_rounds = models.JSONField(default=list)
+    # Bumped by every write through core.versioning, which only writes a row still at the version it read
+    version = models.PositiveIntegerField(default=0)
+    # Summary counters, kept up to date by core.counters (manage.py reconcile_counters repairs drift)
+    players_count = models.PositiveIntegerField(default=0)
+    rounds_count = models.PositiveIntegerField(default=0)
+    winners_count = models.PositiveIntegerField(default=0)
+    prizes_distributed = models.DecimalField(max_digits=12, decimal_places=2, default=0)
 
     created_at = models.DateTimeField(auto_now_add=True)
 
@@ -188,7 +195,136 @@ class Tickets(models.Model):
     """
     ticket_data = models.JSONField(default=list)  # Example: [[0, 12, 0, 23, ...], [...], [...]]
     used = models.BooleanField(default=False)     # True if assigned to some user
+    # core.tickets.ticket_hash of ticket_data; keeps generated tickets unique
+    content_hash = models.CharField(max_length=32, unique=True, null=True, blank=True, editable=False)
+
+    class Meta:
+        indexes = [
+            # joins claim from the unused end of the pool (core.pool.claim_tickets)
+            models.Index(fields=['id'], condition=models.Q(used=False), name='tickets_unused_idx'),
+        ]
    
 
     def __str__(self):
-        return f"Ticket {'assigned' if self.used else 'unassigned'} - ID {self.id}"
\ No newline at end of file
+        return f"Ticket {'assigned' if self.used else 'unassigned'} - ID {self.id}"
+
+class RoundDeck(models.Model):
+    """
+    Pre-shuffled draw order of one round.
+    `order` holds the 90 numbers as one byte each, `cursor` how many are drawn.
+    The order is replayable from `seed` (see core.deck.deck_order).
+    """
+    game = models.ForeignKey(
+        Game,
+        on_delete=models.CASCADE,
+        related_name='decks'
+    )
+    round_id = models.PositiveIntegerField()
+    seed = models.CharField(max_length=64)
+    order = models.BinaryField(max_length=90)
+    cursor = models.PositiveSmallIntegerField(default=0)
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('game', 'round_id')
+
+    def __str__(self):
+        return f"Deck for Game {self.game_id}, Round {self.round_id} ({self.cursor}/90 drawn)"
+
+
+class Round(models.Model):
+    """
+    One entry of Game.prize_rounds as a row (see core.rounds). `number` is
+    its 1-based position, the round_id used everywhere else.
+    """
+    game = models.ForeignKey(
+        Game,
+        on_delete=models.CASCADE,
+        related_name='rounds'
+    )
+    number = models.PositiveIntegerField()
+
+    class Meta:
+        unique_together = ('game', 'number')
+        ordering = ['game', 'number']
+
+    def __str__(self):
+        return f"Game {self.game_id}, Round {self.number}"
+
+
+class Pattern(models.Model):
+    """
+    A round's pattern. `definition` is the entry as the creator wrote it
+    (name, prizeAmount, prizeDescription, spec...) and is what responses are
+    built from; the other columns are for queries and the won state.
+    """
+    round = models.ForeignKey(
+        Round,
+        on_delete=models.CASCADE,
+        related_name='patterns'
+    )
+    pattern_id = models.CharField(max_length=100)  # "<round>.<pattern>"
+    position = models.PositiveIntegerField()
+    pattern_name = models.CharField(max_length=100)
+    prize_amount = models.DecimalField(max_digits=10, decimal_places=2, default=0.00)
+    definition = models.JSONField(default=dict)
+    won = models.BooleanField(default=False)
+    won_by = models.JSONField(null=True, blank=True)  # user ids
+
+    class Meta:
+        unique_together = ('round', 'pattern_id')
+        ordering = ['round', 'position']
+        indexes = [
+            models.Index(fields=['round', 'won'], name='pattern_round_won_idx'),
+        ]
+
+    def __str__(self):
+        return f"{self.pattern_name} ({self.pattern_id})"
+
+
+class Draw(models.Model):
+    """A number called in a round; rows are only ever added."""
+    round = models.ForeignKey(
+        Round,
+        on_delete=models.CASCADE,
+        related_name='draws'
+    )
+    seq = models.PositiveSmallIntegerField()  # 1 for the first number of the round
+    number = models.PositiveSmallIntegerField()
+    drawn_at = models.DateTimeField(default=timezone.now)
+
+    class Meta:
+        unique_together = [('round', 'seq'), ('round', 'number')]
+        ordering = ['round', 'seq']
+
+    def __str__(self):
+        return f"Round {self.round_id} #{self.seq}: {self.number}"
+
+
+class Payout(models.Model):
+    """One player's share of a won pattern; rows are only ever added (see core.payouts)."""
+    game = models.ForeignKey(
+        Game,
+        on_delete=models.CASCADE,
+        related_name='payouts'
+    )
+    round_id = models.PositiveIntegerField()
+    pattern_id = models.CharField(max_length=100)
+    player = models.ForeignKey(
+        settings.AUTH_USER_MODEL,
+        on_delete=models.CASCADE,
+        related_name='payouts'
+    )
+    amount = models.DecimalField(max_digits=10, decimal_places=2)
+    seq = models.PositiveSmallIntegerField(null=True)  # the draw that won it; null for wins paid before the ledger
+    created_at = models.DateTimeField(auto_now_add=True)
+
+    class Meta:
+        unique_together = ('game', 'round_id', 'pattern_id', 'player')
+        ordering = ['game', 'round_id', 'seq']
+        indexes = [
+            models.Index(fields=['game', 'player'], name='payout_game_player_idx'),
+        ]
+
+    def __str__(self):
+        return f"Game {self.game_id} round {self.round_id} {self.pattern_id}: {self.amount} to {self.player_id}"
@@ -1,3 +1,60 @@
+from core.patterns import (
+    BLANK, BUILTINS, LINES, PATTERN_NAMES, Pattern, get_pattern, mask_numbers, number_mask,
+)
+
+
+class CompiledTicket:
+    """
+    A 3x9 ticket compiled once into 91-bit masks (bit n = number n).
+    Each pattern's rule (see Pattern.rule) is built on first use and kept, so
+    every later check is a single AND/compare or a popcount against the mask
+    of called numbers.
+    """
+    __slots__ = ("ticket", "numbers", "rules")
+
+    def __init__(self, ticket, numbers):
+        self.ticket = ticket
+        self.numbers = numbers  # every number on the ticket
+        self.rules = {}         # Pattern -> rule
+
+    @classmethod
+    def from_ticket(cls, ticket):
+        """
+        Compile a ticket, or return None when masks can't represent it exactly
+        (not 3x9, non-int cells, numbers out of 1-90 or repeated). Those tickets
+        stay on the plain Checker functions.
+        """
+        if not isinstance(ticket, (list, tuple)) or len(ticket) != 3:
+            return None
+        numbers = 0
+        for row in ticket:
+            if not isinstance(row, (list, tuple)) or len(row) != 9:
+                return None
+            for num in row:
+                if type(num) is not int or not 0 <= num <= 90:
+                    return None
+                if num:
+                    if numbers >> num & 1:
+                        return None
+                    numbers |= 1 << num
+        return cls(ticket, numbers)
+
+    def rule(self, pattern):
+        try:
+            return self.rules[pattern]
+        except KeyError:
+            rule = self.rules[pattern] = pattern.rule(self.ticket)
+            return rule
+
+    def check(self, pattern, called_mask):
+        """`pattern` is a Pattern or a built-in pattern name (unknown names never match)."""
+        if not isinstance(pattern, Pattern):
+            pattern = BUILTINS.get(pattern)
+            if pattern is None:
+                return False
+        return Pattern.test(self.rule(pattern), called_mask)
+
+
 class Checker:
     def get_non_empty_numbers(self, ticket):
         return [num for row in ticket for num in row if num not in (0, '', None)]
@@ -88,7 +145,28 @@ class Checker:
             return False
         shape_nums = corners + [middle]
         return all(num in called for num in shape_nums)
-    def check_patterns(self, ticket, called_numbers, pattern_list):
+    def compile_ticket(self, ticket):
+        return CompiledTicket.from_ticket(ticket)
+
+    def called_mask(self, called_numbers):
+        return number_mask(called_numbers)
+
+    def check_patterns(self, ticket, called_numbers, pattern_list, compiled=None, called_mask=None):
+        """
+        Check `pattern_list` (built-in names or compiled Patterns) on one ticket.
+        Results are keyed by pattern name. Callers checking the same ticket or
+        called numbers repeatedly can pass the precompiled ticket / called mask.
+        """
+        if compiled is None:
+            compiled = self.compile_ticket(ticket)
+        if compiled is not None:
+            if called_mask is None:
+                called_mask = self.called_mask(called_numbers)
+            return {
+                getattr(pattern, "name", pattern): compiled.check(pattern, called_mask)
+                for pattern in pattern_list
+            }
+
         results = {}
         pattern_map = {
             "full-housie": self.check_full_housie,
@@ -104,12 +182,131 @@ class Checker:
         }
 
         for pattern in pattern_list:
-            results[pattern] = pattern_map.get(pattern, lambda t, c: False)(ticket, called_numbers)
+            if isinstance(pattern, Pattern) and BUILTINS.get(pattern.name) is not pattern:
+                results[pattern.name] = pattern.check_ticket(ticket, called_numbers)
+                continue
+            name = getattr(pattern, "name", pattern)
+            results[name] = pattern_map.get(name, lambda t, c: False)(ticket, called_numbers)
 
         return results
 
 
-   
+class RoundEngine:
+    """
+    Incremental winner detection for one round.
+
+    Keeps an inverted index from number (1-90) to the counters of the tickets
+    holding it, and a "cells remaining" counter per ticket/pattern (one per
+    line for line patterns). A draw only touches the tickets that contain the
+    drawn number (about 1/6 of them) and reports the patterns whose counter
+    just reached zero.
+    """
+
+    def __init__(self, patterns):
+        """`patterns` are compiled Patterns or built-in names."""
+        self.patterns = {
+            p.name: p for p in (p if isinstance(p, Pattern) else get_pattern(p) for p in patterns) if p
+        }
+        self.checker = Checker()
+        self.called = []
+        self.called_mask = 0
+        self.index = [[] for _ in range(91)]  # number -> counter ids
+        self.remaining = []                   # counter id -> cells left
+        self.owners = []                      # counter id -> (ticket index, Pattern, is line counter)
+        self.keys = []                        # ticket index -> caller's key (player id)
+        self.lines = {}                       # (ticket index, pattern name) -> complete lines
+        self.fallback = []                    # (key, ticket) pairs the masks can't represent
+        self.done = {name: [] for name in self.patterns}
+
+    def add_ticket(self, key, ticket):
+        """
+        Index a ticket (raw or CompiledTicket) against the numbers drawn so far.
+        Returns the patterns it already completes.
+        """
+        newly = {}
+        compiled = ticket if isinstance(ticket, CompiledTicket) else CompiledTicket.from_ticket(ticket)
+        if compiled is None:
+            self.fallback.append((key, ticket))
+            return newly
+
+        t = len(self.keys)
+        self.keys.append(key)
+        for pattern in self.patterns.values():
+            rule = compiled.rule(pattern)
+            if rule is None:
+                continue
+            kind, mask, n = rule
+            if kind is LINES:
+                self.lines[t, pattern.name] = 0
+                if len(mask) < n:
+                    continue
+                for line in mask:
+                    self._add_counter(t, pattern, line, newly, line=True)
+            elif n is None:
+                self._add_counter(t, pattern, mask, newly)
+            elif mask.bit_count() >= n:
+                self._add_counter(t, pattern, mask, newly, need=n)
+        return newly
+
+    def _add_counter(self, t, pattern, mask, newly, need=None, line=False):
+        left = mask & ~self.called_mask
+        if need is None:
+            remaining = left.bit_count()
+        else:
+            remaining = max(need - (mask & self.called_mask).bit_count(), 0)
+
+        cid = len(self.remaining)
+        self.owners.append((t, pattern, line))
+        self.remaining.append(remaining)
+        if remaining == 0:
+            self._complete(cid, newly)
+            return
+        for number in mask_numbers(left):
+            self.index[number].append(cid)
+
+    def _complete(self, cid, newly):
+        t, pattern, line = self.owners[cid]
+        name = pattern.name
+        if line:
+            self.lines[t, name] += 1
+            if self.lines[t, name] != pattern.threshold:
+                return
+        key = self.keys[t]
+        self.done[name].append(key)
+        newly.setdefault(name, []).append(key)
+
+    def draw(self, number):
+        """Apply one drawn number. Returns {pattern name: [keys]} completed by this draw."""
+        newly = {}
+        if type(number) is not int or not 0 < number <= 90 or self.called_mask >> number & 1:
+            return newly
+        self.called.append(number)
+        self.called_mask |= 1 << number
+
+        remaining = self.remaining
+        for cid in self.index[number]:
+            remaining[cid] -= 1
+            if remaining[cid] == 0:
+                self._complete(cid, newly)
+        return newly
+
+    def sync(self, called_numbers):
+        """Draw every number of `called_numbers` the engine hasn't seen yet."""
+        newly = {}
+        for number in called_numbers:
+            for name, keys in self.draw(number).items():
+                newly.setdefault(name, []).extend(keys)
+        return newly
+
+    def winners(self, name):
+        """Keys of every ticket that currently satisfies pattern `name`, in completion order."""
+        keys = list(self.done.get(name, ()))
+        pattern = self.patterns.get(name)
+        if pattern is not None:
+            for key, ticket in self.fallback:
+                if self.checker.check_patterns(ticket, self.called, [pattern])[name]:
+                    keys.append(key)
+        return keys
 
 
 # Example usage
@@ -128,105 +325,216 @@ class Checker:
 # print(result)
 
 
+import logging
 from decimal import Decimal, ROUND_HALF_UP
+from django.conf import settings
 from django.db import transaction
 from asgiref.sync import sync_to_async
-from core.models import Game, PlayerGame, PlayerTicket, RoundWise
+from core.models import PlayerGame, PlayerTicket, RoundWise
+from core.patterns import resolve
+from core import counters, live, rounds
+from core import payouts as payouts_ledger
+from core import winners as winners_snapshot
+
+logger = logging.getLogger(__name__)
+
 
-from django.contrib.auth import get_user_model
-User = get_user_model()
 class GameWinnerHandler:
-    def __init__(self):
+    """
+    Finds and pays the winners of a round's open patterns after a draw.
+
+    `backend` picks how tickets are checked (defaults to settings.WINNER_CHECK_BACKEND):
+        "engine"  - incremental RoundEngine kept per cached round (default)
+        "checker" - full scan with Checker over every ticket
+        "numpy"   - BatchChecker, every ticket x pattern as array operations
+    """
+    BACKENDS = ("engine", "checker", "numpy")
+
+    def __init__(self, backend=None):
         self.checker = Checker()
+        self.backend = backend or getattr(settings, "WINNER_CHECK_BACKEND", "engine")
+        if self.backend not in self.BACKENDS:
+            raise ValueError(f"Unknown winner check backend '{self.backend}'")
+
+    def find_winners(self, game_id, round_id, round_data, called_numbers, available_patterns):
+        """Return {pattern_id: (pattern, [player ids])} for the open patterns that have winners."""
+        patterns = [p for p in (resolve(p) for p in available_patterns) if p is not None]
+        names = [p.name for p in patterns]
+
+        # Tickets come from the per-process round cache; no ticket queries per draw
+        from core.cache import round_tickets
+        tickets = round_tickets.get(game_id, round_id)
+
+        if self.backend == "engine":
+            engine = tickets.engine(patterns)
+            if len(engine.called) > len(called_numbers):
+                engine = tickets.engine(patterns, fresh=True)  # checking an earlier draw than the last one
+            engine.sync(called_numbers)
+            matches = {name: engine.winners(name) for name in names}
+        elif self.backend == "numpy":
+            matches = tickets.batch().winners(called_numbers, patterns)
+        else:
+            called_mask = self.checker.called_mask(called_numbers)
+            matches = {name: [] for name in names}
+            for player_id, ticket_data, compiled in tickets.items():
+                result = self.checker.check_patterns(
+                    ticket_data, called_numbers, patterns, compiled=compiled, called_mask=called_mask
+                )
+                for name, won in result.items():
+                    if won:
+                        matches[name].append(player_id)
+
+        hits = {}
+        for pattern in available_patterns:
+            keys = matches.get(pattern["patternName"])
+            if keys:
+                hits[pattern["id"]] = (pattern, keys)
+        return hits
 
     @sync_to_async
-    @transaction.atomic
-    def check_and_assign_winners(self, game_id, round_id):
-        try:
-            game = Game.objects.get(id=game_id)
-        except Game.DoesNotExist:
+    def check_and_assign_winners(self, game_id, round_id, seq=None):
+        return self.assign_winners(game_id, round_id, seq)
+
+    def assign_winners(self, game_id, round_id, seq=None):
+        """
+        Pay the winners of the round's open patterns. With `seq`, tickets are
+        checked against the first `seq` numbers called only (the state right
+        after that draw), however many have been called since.
+        """
+        # Called numbers and open patterns come from the live round state (core.live);
+        # the database is only touched when there are winners to pay
+        if live.game_info(game_id) is None:
             return {"error": "Game not found"}
 
-        # Extract round data
-        prize_rounds = game.prize_rounds
-        round_index = int(round_id) - 1
-        if round_index >= len(prize_rounds):
+        state = live.round_state(game_id, round_id)
+        if state is None:
             return {"error": "Invalid round"}
 
-        round_data = prize_rounds[round_index]
-        called_numbers = round_data.get("called_numbers", [])
-        available_patterns = [
-            p for p in round_data["patterns"] if not p.get("won", False)
-        ]
+        available_patterns = state.open_patterns()
 
         # No patterns left
         if not available_patterns:
             return {"message": "No available patterns left"}
 
-        # Players and their tickets
-        players = PlayerGame.objects.filter(game_id=game_id)
-        player_tickets = PlayerTicket.objects.filter(game_id=game_id, round_id=round_id)
+        round_data = {"id": str(round_id), "patterns": state.patterns}
+        called_numbers = state.called if seq is None else state.called[:seq]
+        hits = self.find_winners(game_id, round_id, round_data, called_numbers, available_patterns)
+        if not hits:
+            return {"message": "Winners updated", "winners": {}}
+
+        # Only the winners' PlayerGame rows are needed, with their users for the announcement
+        winner_ids = {key for _, keys in hits.values() for key in keys}
+        players = {
+            pg.player_id: pg
+            for pg in PlayerGame.objects.filter(game_id=game_id, player_id__in=winner_ids).select_related("player")
+        }
 
         winners = {}
-
-        # Check each player's tickets
-        for player in players:
-            player_tix = [
-                pt.ticket_data for pt in player_tickets if pt.player_id == player.player_id
-            ]
-
-            for pattern in available_patterns:
-                pattern_name = pattern["patternName"]
-                prize_amount = Decimal(pattern["prizeAmount"])
-
-                for tix in player_tix:
-                    result = self.checker.check_patterns(tix, called_numbers, [pattern_name])
-                    if result.get(pattern_name):
-                        winners.setdefault(pattern["id"], []).append({
-                            "player": player.full_name,
-                            "pattern": pattern,
-                            "amount": prize_amount
-                        })
-
-        # Assign winners and update RoundWise
+        for pattern_id, (pattern, keys) in hits.items():
+            prize_amount = Decimal(pattern["prizeAmount"])
+            for key in keys:
+                player = players.get(key)
+                if player is None:
+                    continue
+                winners.setdefault(pattern_id, []).append({
+                    "player": player,
+                    "pattern": pattern,
+                    "amount": prize_amount
+                })
+
+        # Claim the patterns first so a concurrent check can't pay them twice
+        claimed = live.claim_patterns(game_id, round_id, winners)
+        winners = {pattern_id: winners[pattern_id] for pattern_id in claimed}
+        try:
+            with transaction.atomic():
+                self._settle(game_id, round_id, winners, len(called_numbers))
+        except Exception:
+            live.release_patterns(game_id, round_id, claimed)
+            raise
+        # user ids only: formatting the PlayerGame rows would query each one's game
+        logger.debug(
+            "Winners assigned: %s", {pid: [e["player"].player_id for e in winlist] for pid, winlist in winners.items()}
+        )
+
+        if winners:
+            transaction.on_commit(lambda: winners_snapshot.rebuild(game_id))
+
+        # Round over: persist its draw state and free its cached tickets
+        if set(claimed) | state.won >= {p["id"] for p in state.patterns}:
+            from core.cache import invalidate_round_tickets
+
+            def round_over():
+                live.flush([(int(game_id), int(round_id))])
+                invalidate_round_tickets(game_id, [round_id])
+            transaction.on_commit(round_over)
+
+        return {"message": "Winners updated", "winners": winners}
+
+    def _settle(self, game_id, round_id, winners, seq):
+        """
+        Pay the winners of the `seq`-th draw and record them in RoundWise and
+        the round's Pattern rows. Payouts are worked out first, then written
+        with a fixed number of queries however many players share a pattern:
+        one ledger insert and one UPDATE of the winners' totals (core.payouts),
+        one RoundWise upsert, one insert of won_by rows, two for the won flags
+        (core.rounds.mark_won) and one for the game's counters.
+        """
+        if not winners:
+            return
+        payouts = {}  # PlayerGame -> amount won in this draw, over all its patterns
+        shares = []  # (pattern_id, user id, amount) for the ledger
+        round_entries = []
+        won_by = {}  # pattern_id -> user ids
         for pattern_id, winlist in winners.items():
             if not winlist:
                 continue
 
             prize_amount = winlist[0]["amount"]
             per_player = (prize_amount / len(winlist)).quantize(Decimal('0.01'), rounding=ROUND_HALF_UP)
-            player_objs = []
-
             for entry in winlist:
-                player = entry["player"]
-                player.won_amount = player.won_amount + per_player
-                player.save()
-                player_objs.append(User.objects.get(id=player.player_id))
-
-            # Update Game JSON
-            for pat in round_data["patterns"]:
-                if pat["id"] == pattern_id:
-                    pat["won"] = True
-                    pat["wonBy"] = [p.id for p in player_objs]
-
-            # Prevent duplicate round records
-            round_entry, created = RoundWise.objects.get_or_create(
-                game=game,
+                payouts[entry["player"]] = payouts.get(entry["player"], 0) + per_player
+                shares.append((pattern_id, entry["player"].player_id, per_player))
+            won_by[pattern_id] = [entry["player"].player_id for entry in winlist]
+
+            round_entries.append(RoundWise(
+                game_id=game_id,
                 round_id=round_id,
                 pattern_id=pattern_id,
-                defaults={
-                    "patternName": winlist[0]["pattern"]["patternName"],
-                    "prize_amount": prize_amount,
-                },
+                patternName=winlist[0]["pattern"]["patternName"],
+                prize_amount=prize_amount,
+            ))
+        if not round_entries:
+            return
+
+        rounds.mark_won(game_id, round_id, won_by)
+        counters.winners_paid(game_id, sum(len(ids) for ids in won_by.values()), sum(payouts.values()))
+
+        # Append the shares to the ledger, then refresh the winners' totals from it
+        payouts_ledger.record(game_id, round_id, seq, shares)
+        payouts_ledger.refresh_totals(game_id, [player.player_id for player in payouts])
+        for player, amount in payouts.items():
+            player.won_amount += amount
+
+        # One row per pattern, kept if it already exists (patterns are claimed once, see core.live)
+        RoundWise.objects.bulk_create(
+            round_entries,
+            update_conflicts=True,
+            unique_fields=["game", "round_id", "pattern_id"],
+            update_fields=["patternName"],
+        )
+        if any(entry.pk is None for entry in round_entries):  # databases that don't return upserted ids
+            ids = dict(
+                RoundWise.objects.filter(game_id=game_id, round_id=round_id, pattern_id__in=won_by).values_list("pattern_id", "id")
             )
-
-            # Add winners (append if already exists)
-            round_entry.won_by.add(*player_objs)
-            round_entry.save()
-
-        # Save updated JSON
-        game.prize_rounds[round_index] = round_data
-        game.save()
-        print("Winners assigned:", winners)
-
-        return {"message": "Winners updated", "winners": winners}
\ No newline at end of file
+            for entry in round_entries:
+                entry.pk = ids[entry.pattern_id]
+
+        Through = RoundWise.won_by.through
+        Through.objects.bulk_create(
+            [
+                Through(roundwise_id=entry.pk, user_id=user_id)
+                for entry in round_entries
+                for user_id in won_by[entry.pattern_id]
+            ],
+            ignore_conflicts=True,
+        )
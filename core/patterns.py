@@ -0,0 +1,257 @@
+"""
+Declarative housie patterns.
+
+A pattern is a small JSON spec over the cells of a 3x9 ticket. Specs are
+validated and compiled once (GameSerializer.validate_prize_rounds compiles
+every pattern of a game up front), cached, and then turned into per-ticket
+bitmask rules that the checkers evaluate with a single AND/compare or popcount.
+
+Spec keys:
+    cells       cell set whose numbers must be called (all of them, or `min`)
+    min         how many numbers of `cells` must be called (default: all)
+    lines       list of cell sets; `lines_min` of them must be fully called
+                (a line without numbers never counts)
+    lines_min   default 1
+    filled      cells that must hold a number for the pattern to be possible
+    blank       cells that must be empty for the pattern to be possible
+    any_filled  at least one of these cells must hold a number
+    min_filled  {"cells": <cell set>, "count": n}: at least n of them hold numbers
+
+A cell set is "all", "corners", "row:<0-2>", "col:<0-8>", a [row, col] pair,
+or a list mixing any of those, e.g. ["row:0", "col:4"].
+"""
+import functools
+import json
+
+
+ROWS = 3
+COLS = 9
+BLANK = (0, '', None)
+
+SPEC_KEYS = {"cells", "min", "lines", "lines_min", "filled", "blank", "any_filled", "min_filled"}
+
+ALL = "all"      # every number of the mask must be called
+COUNT = "count"  # at least n numbers of the mask must be called
+LINES = "lines"  # at least n of the line masks must be fully called
+
+BUILTIN_SPECS = {
+    "full-housie": {"cells": "all"},
+    "any-one-line": {"lines": ["row:0", "row:1", "row:2"], "lines_min": 1},
+    "two-lines": {"lines": ["row:0", "row:1", "row:2"], "lines_min": 2},
+    "early-five": {"cells": "all", "min": 5},
+    "four-corners": {"cells": "corners", "filled": "corners"},
+    "t-shape": {
+        "cells": ["row:0", "col:4"], "filled": [[0, 4]],
+        "min_filled": {"cells": "col:4", "count": 2},
+    },
+    "cross-plus": {
+        "cells": ["row:1", "col:4"], "blank": [[1, 4]],
+        "min_filled": {"cells": "col:4", "count": 2},
+    },
+    "l-shape": {
+        "cells": ["col:0", "row:2"], "filled": [[2, 0]],
+        "min_filled": {"cells": "col:0", "count": 2},
+    },
+    "border-shape": {
+        "cells": ["row:0", "row:2", "col:0", "col:8"], "any_filled": [[1, 0], [1, 8]],
+    },
+    "four-corner-middle": {"cells": ["corners", [1, 4]], "filled": ["corners", [1, 4]]},
+}
+PATTERN_NAMES = tuple(BUILTIN_SPECS)
+
+
+class PatternSpecError(ValueError):
+    pass
+
+
+def number_mask(numbers):
+    """Bitmask with bit n set for every number n (1-90) in `numbers`."""
+    mask = 0
+    for num in numbers:
+        if type(num) is int and 0 < num <= 90:
+            mask |= 1 << num
+    return mask
+
+
+def mask_numbers(mask):
+    """Yield the numbers whose bits are set in `mask`, lowest first."""
+    while mask:
+        low = mask & -mask
+        yield low.bit_length() - 1
+        mask ^= low
+
+
+def parse_cells(value, field):
+    """Turn a cell set into an ordered tuple of unique (row, col) pairs."""
+    if isinstance(value, str):
+        if value == "all":
+            return tuple((r, c) for r in range(ROWS) for c in range(COLS))
+        if value == "corners":
+            return ((0, 0), (0, COLS - 1), (ROWS - 1, 0), (ROWS - 1, COLS - 1))
+        kind, _, index = value.partition(":")
+        if kind in ("row", "col") and index.isdigit():
+            index = int(index)
+            if kind == "row" and index < ROWS:
+                return tuple((index, c) for c in range(COLS))
+            if kind == "col" and index < COLS:
+                return tuple((r, index) for r in range(ROWS))
+        raise PatternSpecError(f"'{field}': unknown cell set '{value}'")
+
+    if not isinstance(value, list) or not value:
+        raise PatternSpecError(f"'{field}' must be a cell set or a non-empty list of them")
+
+    if len(value) == 2 and all(type(v) is int for v in value):
+        r, c = value
+        if not (0 <= r < ROWS and 0 <= c < COLS):
+            raise PatternSpecError(f"'{field}': cell {value} is outside the 3x9 ticket")
+        return ((r, c),)
+
+    cells = []
+    for item in value:
+        for cell in parse_cells(item, field):
+            if cell not in cells:
+                cells.append(cell)
+    return tuple(cells)
+
+
+class Pattern:
+    """A validated, compiled pattern spec."""
+
+    def __init__(self, name, spec):
+        if not isinstance(spec, dict):
+            raise PatternSpecError("spec must be an object")
+        unknown = set(spec) - SPEC_KEYS
+        if unknown:
+            raise PatternSpecError(f"unknown spec keys: {', '.join(sorted(unknown))}")
+        if ("cells" in spec) == ("lines" in spec):
+            raise PatternSpecError("spec needs exactly one of 'cells' or 'lines'")
+
+        self.name = name
+        self.spec = spec
+        self.cells = parse_cells(spec["cells"], "cells") if "cells" in spec else None
+        self.lines = None
+        self.threshold = None
+
+        if self.cells is not None:
+            if "lines_min" in spec:
+                raise PatternSpecError("'lines_min' only applies to 'lines'")
+            if "min" in spec:
+                self.threshold = spec["min"]
+                if type(self.threshold) is not int or not 0 < self.threshold <= len(self.cells):
+                    raise PatternSpecError(f"'min' must be an integer from 1 to {len(self.cells)}")
+        else:
+            if "min" in spec:
+                raise PatternSpecError("'min' only applies to 'cells'")
+            if not isinstance(spec["lines"], list) or not spec["lines"]:
+                raise PatternSpecError("'lines' must be a non-empty list of cell sets")
+            self.lines = tuple(parse_cells(line, "lines") for line in spec["lines"])
+            self.threshold = spec.get("lines_min", 1)
+            if type(self.threshold) is not int or not 0 < self.threshold <= len(self.lines):
+                raise PatternSpecError(f"'lines_min' must be an integer from 1 to {len(self.lines)}")
+
+        self.filled = parse_cells(spec["filled"], "filled") if "filled" in spec else ()
+        self.blank = parse_cells(spec["blank"], "blank") if "blank" in spec else ()
+        self.any_filled = parse_cells(spec["any_filled"], "any_filled") if "any_filled" in spec else ()
+        self.min_filled = None
+        if "min_filled" in spec:
+            value = spec["min_filled"]
+            if not isinstance(value, dict) or set(value) != {"cells", "count"}:
+                raise PatternSpecError("'min_filled' must be {\"cells\": ..., \"count\": n}")
+            cells = parse_cells(value["cells"], "min_filled")
+            if type(value["count"]) is not int or not 0 < value["count"] <= len(cells):
+                raise PatternSpecError(f"'min_filled' count must be an integer from 1 to {len(cells)}")
+            self.min_filled = (cells, value["count"])
+
+        self.kind = LINES if self.lines is not None else COUNT if self.threshold else ALL
+
+    def __repr__(self):
+        return f"<Pattern {self.name}>"
+
+    def possible(self, ticket, filled):
+        """Whether the ticket's layout can form the pattern at all; `filled(cell)` tests one cell."""
+        if not all(filled(cell) for cell in self.filled):
+            return False
+        if any(filled(cell) for cell in self.blank):
+            return False
+        if self.any_filled and not any(filled(cell) for cell in self.any_filled):
+            return False
+        if self.min_filled:
+            cells, count = self.min_filled
+            if sum(1 for cell in cells if filled(cell)) < count:
+                return False
+        return True
+
+    def rule(self, ticket):
+        """
+        Per-ticket rule for a compiled ticket (3x9 ints, 0 = blank):
+        (ALL, mask, None), (COUNT, mask, n), (LINES, (masks...), n), or None if impossible.
+        """
+        if not self.possible(ticket, lambda cell: ticket[cell[0]][cell[1]] != 0):
+            return None
+        if self.lines is not None:
+            masks = tuple(m for m in (number_mask(ticket[r][c] for r, c in line) for line in self.lines) if m)
+            return (LINES, masks, self.threshold)
+        mask = number_mask(ticket[r][c] for r, c in self.cells)
+        return (self.kind, mask, self.threshold)
+
+    @staticmethod
+    def test(rule, called_mask):
+        if rule is None:
+            return False
+        kind, mask, n = rule
+        if kind is ALL:
+            return not mask & ~called_mask
+        if kind is COUNT:
+            return (mask & called_mask).bit_count() >= n
+        return sum(1 for m in mask if not m & ~called_mask) >= n
+
+    def check_ticket(self, ticket, called_numbers):
+        """Evaluate directly on a raw ticket (any cell values); used for tickets masks can't represent."""
+        try:
+            if not self.possible(ticket, lambda cell: ticket[cell[0]][cell[1]] not in BLANK):
+                return False
+            if self.lines is not None:
+                lines = [[ticket[r][c] for r, c in line if ticket[r][c] not in BLANK] for line in self.lines]
+                complete = sum(1 for nums in lines if nums and all(n in called_numbers for n in nums))
+                return complete >= self.threshold
+            nums = [ticket[r][c] for r, c in self.cells if ticket[r][c] not in BLANK]
+            if self.kind is COUNT:
+                return sum(1 for n in nums if n in called_numbers) >= self.threshold
+            return all(n in called_numbers for n in nums)
+        except (IndexError, TypeError):
+            return False
+
+
+@functools.lru_cache(maxsize=1024)
+def _compile(name, canonical):
+    return Pattern(name, json.loads(canonical))
+
+
+def compile_pattern(name, spec):
+    """
+    Validate and compile a spec once; later calls with the same name and spec
+    hit the cache, which keeps the 1024 most recently used custom patterns.
+    """
+    try:
+        key = json.dumps(spec, sort_keys=True)
+    except (TypeError, ValueError):
+        raise PatternSpecError("spec must be JSON serialisable")
+    return _compile(name, key)
+
+
+def get_pattern(name, spec=None):
+    """
+    Resolve a round's pattern: a built-in by name, or a creator's custom spec.
+    Returns None for an unknown name without a spec.
+    """
+    if spec is None:
+        return BUILTINS.get(name)
+    return compile_pattern(name, spec)
+
+
+def resolve(pattern):
+    """Resolve a prize_rounds pattern entry ({"patternName": ..., "spec": ...})."""
+    return get_pattern(pattern["patternName"], pattern.get("spec"))
+
+
+BUILTINS = {name: compile_pattern(name, spec) for name, spec in BUILTIN_SPECS.items()}
@@ -0,0 +1,43 @@
+"""
+Payout ledger.
+
+Settlement used to add each win to PlayerGame.won_amount in place, so a
+player winning several patterns had their row updated once per pattern and
+nothing recorded how a split prize was shared. Now every share is a Payout
+row (game, round, pattern, player, amount and the draw seq that won it):
+
+    - record() appends a draw's payouts with one bulk INSERT. A share
+      already in the ledger (same game, round, pattern and player) is kept
+      as it is, so recording a draw twice pays nothing twice.
+    - PlayerGame.won_amount stays as the materialized total of a player's
+      payouts in a game, which the dashboard, history and winner
+      announcements read. refresh_totals() recomputes it from the ledger
+      for a batch of players with one UPDATE.
+"""
+from django.db.models import DecimalField, OuterRef, Subquery, Sum, Value
+from django.db.models.functions import Coalesce
+
+from core.models import Payout, PlayerGame
+
+
+def record(game_id, round_id, seq, shares):
+    """Append the payouts of a draw; `shares` are (pattern_id, user id, amount)."""
+    Payout.objects.bulk_create(
+        [
+            Payout(game_id=game_id, round_id=round_id, pattern_id=pattern_id, player_id=user_id, amount=amount, seq=seq)
+            for pattern_id, user_id, amount in shares
+        ],
+        ignore_conflicts=True,
+    )
+
+
+def refresh_totals(game_id, user_ids=None):
+    """Set won_amount of the game's players (or only `user_ids`) to the sum of their payouts."""
+    total = (
+        Payout.objects.filter(game_id=game_id, player_id=OuterRef("player_id"))
+        .order_by().values("player_id").annotate(total=Sum("amount")).values("total")[:1]
+    )
+    players = PlayerGame.objects.filter(game_id=game_id)
+    if user_ids is not None:
+        players = players.filter(player_id__in=user_ids)
+    players.update(won_amount=Coalesce(Subquery(total), Value(0), output_field=DecimalField(max_digits=10, decimal_places=2)))
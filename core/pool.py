@@ -0,0 +1,67 @@
+"""
+Claiming tickets from the shared Tickets pool.
+
+A join needs one ticket per round. All of them are claimed with a single
+UPDATE ... RETURNING statement. On PostgreSQL the rows are picked with
+FOR UPDATE SKIP LOCKED, so concurrent joins take different tickets instead
+of queueing on the same "first" unused row. SQLite locks the whole database
+for the statement, which serialises claims. Other databases use the ORM:
+select_for_update(skip_locked=True) followed by an update.
+
+The claim belongs to the caller's transaction: rolling it back puts the
+tickets back in the pool.
+"""
+import json
+
+from django.db import connection
+
+from core.models import Tickets
+
+RETURNING_SQL = """
+    UPDATE {table} SET {used} = %s
+    WHERE {id} IN (
+        SELECT {id} FROM {table} WHERE {used} = %s ORDER BY {id} LIMIT %s{lock}
+    )
+    RETURNING {id}, {data}{cast}
+"""
+
+
+def _claim_returning(count, lock, cast):
+    quote = connection.ops.quote_name
+    sql = RETURNING_SQL.format(
+        table=quote(Tickets._meta.db_table),
+        used=quote("used"),
+        id=quote("id"),
+        data=quote("ticket_data"),
+        lock=lock,
+        cast=cast,
+    )
+    with connection.cursor() as cursor:
+        cursor.execute(sql, [True, False, count])
+        rows = cursor.fetchall()
+    return [json.loads(data) for _, data in sorted(rows)]
+
+
+def _claim_orm(count):
+    skip_locked = connection.features.has_select_for_update_skip_locked
+    rows = list(
+        Tickets.objects.select_for_update(skip_locked=skip_locked)
+        .filter(used=False).order_by("id").values_list("id", "ticket_data")[:count]
+    )
+    Tickets.objects.filter(id__in=[pk for pk, _ in rows]).update(used=True)
+    return [data for _, data in rows]
+
+
+def claim_tickets(count):
+    """
+    Mark up to `count` unused tickets as used and return their ticket_data
+    in pool order. Returns fewer when the pool runs low. Call inside a
+    transaction.
+    """
+    if count <= 0:
+        return []
+    if connection.vendor == "postgresql":
+        return _claim_returning(count, " FOR UPDATE SKIP LOCKED", "::text")
+    if connection.vendor == "sqlite":
+        return _claim_returning(count, "", "")
+    return _claim_orm(count)
@@ -0,0 +1,171 @@
+"""
+Who is on the other end of a WebSocket.
+
+A socket only needs a user's id, role and name, so JWTAuthMiddleware puts a
+Principal in the scope instead of a User row. Principals are kept in a
+per-process TTL + LRU cache keyed by user id. On a miss the principal is
+built from the token's claims (tokens issued by GameRefreshToken carry
+role and full_name), so a handshake needs no database query; older tokens
+without the claims fall back to one query.
+
+Saving a user whose is_active changed drops their cached principal in this
+process and marks them revoked (or no longer revoked) in the live store
+(core.live) for as long as their tokens can live. The revocation is checked
+on cache hits too, so no process lets a deactivated user in, whatever it
+has cached. Other saves (last_login on every login, profile edits) leave
+both alone, and so do updates that skip save() (QuerySet.update).
+
+Limits: the role and full_name claims are trusted for as long as the token
+is valid (ACCESS_TOKEN_LIFETIME), so a role change only reaches sockets
+through a new token; and a principal built from an older token's database
+row keeps its role until it leaves the cache (WS_PRINCIPAL_CACHE_TTL).
+"""
+import logging
+import threading
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+from django.contrib.auth import get_user_model
+from django.db.models.signals import post_init, post_save
+from django.dispatch import receiver
+from rest_framework_simplejwt.settings import api_settings
+from rest_framework_simplejwt.tokens import RefreshToken
+
+from core import live
+
+User = get_user_model()
+logger = logging.getLogger(__name__)
+
+
+class GameRefreshToken(RefreshToken):
+    """Token pair whose claims include the user's role and full_name (copied to the access token)."""
+
+    @classmethod
+    def for_user(cls, user):
+        token = super().for_user(user)
+        token["role"] = user.role
+        token["full_name"] = user.full_name
+        return token
+
+
+class Principal:
+    """Just enough of a User for a socket: id, role and full_name."""
+    __slots__ = ("id", "role", "full_name")
+    is_active = True
+    is_authenticated = True
+    is_anonymous = False
+
+    def __init__(self, id, role, full_name):
+        self.id = id
+        self.role = role
+        self.full_name = full_name
+
+    @property
+    def pk(self):
+        return self.id
+
+    def __str__(self):
+        return self.full_name
+
+
+class PrincipalCache:
+    """
+    Per-process LRU of Principals keyed by user id; entries expire `ttl`
+    seconds after they were added. Its stats() are logged at most once every
+    `log_interval` seconds, as lookups come in.
+    """
+
+    def __init__(self, max_size, ttl, log_interval=60):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.log_interval = log_interval
+        self.hits = self.misses = 0
+        self._entries = OrderedDict()  # user_id -> (principal, expires)
+        self._lock = threading.Lock()
+        self._last_logged = time.monotonic()
+
+    def get(self, user_id):
+        now = time.monotonic()
+        if now - self._last_logged >= self.log_interval:
+            self._last_logged = now
+            logger.info("Socket principals cache: %s", self.stats())
+        with self._lock:
+            entry = self._entries.get(user_id)
+            if entry is not None and entry[1] > now:
+                self._entries.move_to_end(user_id)
+                self.hits += 1
+                return entry[0]
+            if entry is not None:
+                del self._entries[user_id]
+            self.misses += 1
+            return None
+
+    def put(self, principal):
+        with self._lock:
+            self._entries[principal.id] = (principal, time.monotonic() + self.ttl)
+            self._entries.move_to_end(principal.id)
+            while len(self._entries) > self.max_size:
+                self._entries.popitem(last=False)
+
+    def invalidate(self, user_id):
+        with self._lock:
+            self._entries.pop(user_id, None)
+
+    def clear(self):
+        with self._lock:
+            self._entries.clear()
+            self.hits = self.misses = 0
+
+    def stats(self):
+        with self._lock:
+            return {"hits": self.hits, "misses": self.misses, "size": len(self._entries)}
+
+    def __len__(self):
+        return len(self._entries)
+
+
+principals = PrincipalCache(
+    getattr(settings, "WS_PRINCIPAL_CACHE_SIZE", 10000), getattr(settings, "WS_PRINCIPAL_CACHE_TTL", 300)
+)
+
+
+def load_principal(validated_token):
+    """
+    Build the principal for a token whose user isn't cached: from its claims,
+    or from the database for tokens without them. None if the user is
+    deactivated or gone.
+    """
+    user_id = validated_token.get(api_settings.USER_ID_CLAIM)
+    if user_id is None:
+        return None
+    if "role" in validated_token and "full_name" in validated_token:
+        if live.is_user_revoked(user_id):
+            return None
+        principal = Principal(int(user_id), validated_token["role"], validated_token["full_name"])
+    else:
+        row = User.objects.filter(id=user_id, is_active=True).values_list("role", "full_name").first()
+        if row is None:
+            return None
+        principal = Principal(int(user_id), *row)
+    principals.put(principal)
+    return principal
+
+
+@receiver(post_init, sender=User)
+def user_loaded(sender, instance, **kwargs):
+    # is_active as loaded, to tell on save whether it changed (None if deferred)
+    instance._loaded_is_active = instance.__dict__.get("is_active")
+
+
+@receiver(post_save, sender=User)
+def user_saved(sender, instance, created, update_fields=None, **kwargs):
+    was_active, instance._loaded_is_active = instance._loaded_is_active, instance.is_active
+    if created or (update_fields is not None and "is_active" not in update_fields):
+        return
+    if was_active == instance.is_active:
+        return
+    principals.invalidate(instance.id)
+    live.set_user_revoked(
+        instance.id, not instance.is_active, api_settings.ACCESS_TOKEN_LIFETIME.total_seconds()
+    )
@@ -0,0 +1,179 @@
+"""
+Rounds, patterns and draws as rows.
+
+Game.prize_rounds remains the document the creator writes, and what
+GameDetailView hands back for editing. Everything else reads the tables:
+    - Round: one row per prize_rounds entry;
+    - Pattern: one row per pattern of a round, holding the entry as written
+      (`definition`, which responses are built from) and its won state;
+    - Draw: one row per called number. The write-behind flush (core.live)
+      appends them, so drawn_at is when a number reached the database.
+
+sync_rounds() builds a game's Round and Pattern rows from prize_rounds. It
+runs when a game is created (a post_save receiver registered in
+CoreConfig.ready) and when one is edited, which GameUpdateView only allows
+before any number is drawn. It still updates rows in place rather than
+recreating them, so nothing it is given can drop a round's draws.
+"""
+import copy
+from decimal import Decimal, InvalidOperation
+
+from django.db.models import Count
+from django.db.models.signals import post_save
+from django.dispatch import receiver
+
+from core import counters
+from core.models import Draw, Game, Pattern, Round
+
+
+def _amount(value):
+    try:
+        return Decimal(str(value)).quantize(Decimal("0.01"))
+    except (InvalidOperation, ValueError):
+        return Decimal("0.00")
+
+
+def pattern_ids(number, patterns):
+    """
+    Row ids of a round's patterns: each entry's "id", or "<round>.<position>"
+    (then "<round>.<position>-2", ...) when it has none or repeats one
+    already taken in the round.
+    """
+    ids = []
+    for position, pattern in enumerate(patterns, start=1):
+        pattern_id, suffix = str(pattern.get("id", f"{number}.{position}")), 0
+        while pattern_id in ids:
+            suffix += 1
+            pattern_id = f"{number}.{position}" if suffix == 1 else f"{number}.{position}-{suffix}"
+        ids.append(pattern_id)
+    return ids
+
+
+def sync_rounds(game):
+    """
+    Bring the game's Round and Pattern rows in line with prize_rounds. Rows
+    are changed in place: rounds and patterns that stay keep their ids, draws
+    and won state; only rounds past the new count and patterns no longer
+    listed are deleted.
+    """
+    entries = game.prize_rounds or []
+    Round.objects.filter(game=game, number__gt=len(entries)).delete()
+    existing = set(Round.objects.filter(game=game).values_list("number", flat=True))
+    Round.objects.bulk_create(
+        [Round(game=game, number=n) for n in range(1, len(entries) + 1) if n not in existing]
+    )
+    counters.rounds_built(game.pk, len(entries))
+    rounds = list(Round.objects.filter(game=game).order_by("number"))
+
+    stale = {(p.round_id, p.pattern_id): p for p in Pattern.objects.filter(round__game=game)}
+    created, changed = [], []
+    for round_row, entry in zip(rounds, entries):
+        patterns = entry.get("patterns", [])
+        for position, (pattern_id, pattern) in enumerate(zip(pattern_ids(round_row.number, patterns), patterns), start=1):
+            row = stale.pop((round_row.id, pattern_id), None)
+            if row is None:
+                row = Pattern(
+                    round=round_row, pattern_id=pattern_id,
+                    won=bool(pattern.get("won")), won_by=pattern.get("wonBy"),
+                )
+                created.append(row)
+            else:
+                changed.append(row)
+            row.position = position
+            row.pattern_name = pattern.get("patternName", "")
+            row.prize_amount = _amount(pattern.get("prizeAmount", 0))
+            row.definition = pattern
+    Pattern.objects.filter(pk__in=[row.pk for row in stale.values()]).delete()
+    Pattern.objects.bulk_update(changed, ["position", "pattern_name", "prize_amount", "definition"])
+    Pattern.objects.bulk_create(created)
+
+
+@receiver(post_save, sender=Game)
+def create_rounds(sender, instance, created, raw=False, **kwargs):
+    if created and not raw:
+        sync_rounds(instance)
+
+
+def pattern_entry(pattern):
+    """The pattern as a prize_rounds entry: its definition with the won state it has now."""
+    entry = dict(pattern.definition)
+    if pattern.won or "won" in entry:
+        entry["won"] = pattern.won
+        entry["wonBy"] = pattern.won_by
+    return entry
+
+
+def game_rounds(game_id, with_draw_counts=False):
+    """The game's Round rows in order, with their patterns prefetched (and `draw_count` if asked)."""
+    rounds = Round.objects.filter(game_id=game_id).order_by("number").prefetch_related("patterns")
+    if with_draw_counts:
+        rounds = rounds.annotate(draw_count=Count("draws"))
+    return list(rounds)
+
+
+def get_round(game_id, number):
+    """The Round row, patterns prefetched, or None."""
+    try:
+        return Round.objects.prefetch_related("patterns").get(game_id=game_id, number=int(number))
+    except (Round.DoesNotExist, TypeError, ValueError):
+        return None
+
+
+def round_data(game_id, number):
+    """A round as its prize_rounds entry would read with the current state: id, called_numbers, patterns."""
+    round_row = get_round(game_id, number)
+    if round_row is None:
+        return None
+    return {
+        "id": str(round_row.number),
+        "called_numbers": list(round_row.draws.order_by("seq").values_list("number", flat=True)),
+        "patterns": [pattern_entry(p) for p in round_row.patterns.all()],
+    }
+
+
+def prize_rounds(game):
+    """
+    game.prize_rounds as it reads now: each pattern's won state taken from its
+    Pattern row, and each round's called_numbers from its Draw rows, or from
+    the live store (core.live) for numbers drawn since the last flush.
+    """
+    from core import live
+
+    entries = copy.deepcopy(game.prize_rounds or [])
+    for pattern in Pattern.objects.filter(round__game=game).select_related("round"):
+        patterns = entries[pattern.round.number - 1].get("patterns", [])
+        if pattern.position <= len(patterns):
+            patterns[pattern.position - 1] = pattern_entry(pattern)
+
+    called = {}
+    for number, drawn in Draw.objects.filter(round__game=game).order_by("round__number", "seq").values_list("round__number", "number"):
+        called.setdefault(number, []).append(drawn)
+    called.update(live.live_called_numbers(game.pk))
+    for number, entry in enumerate(entries, start=1):
+        if number in called:
+            entry["called_numbers"] = called[number]
+    return entries
+
+
+def mark_won(game_id, number, won_by):
+    """Mark a round's patterns won; `won_by` maps pattern ids to the user ids that won them."""
+    patterns = list(Pattern.objects.filter(round__game_id=game_id, round__number=number, pattern_id__in=won_by))
+    for pattern in patterns:
+        pattern.won = True
+        pattern.won_by = won_by[pattern.pattern_id]
+    Pattern.objects.bulk_update(patterns, ["won", "won_by"])
+
+
+def record_draws(rounds):
+    """
+    Append the Draw rows of each round's numbers: `rounds` maps Round ids to
+    (order, first seq to record, last seq). Seqs already recorded are skipped.
+    """
+    Draw.objects.bulk_create(
+        [
+            Draw(round_id=round_id, seq=seq, number=order[seq - 1])
+            for round_id, (order, first, last) in rounds.items()
+            for seq in range(first, last + 1)
+        ],
+        ignore_conflicts=True,
+    )
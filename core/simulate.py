@@ -0,0 +1,294 @@
+"""
+Monte Carlo simulation of a prize round.
+
+For a player count and a list of patterns, simulates many full draws over a
+pool of realistic tickets and reports, per pattern, the distribution of the
+draw step at which it is first won and how many tickets win it together
+(the prize is split between them).
+
+Each simulation is a random draw order. With `pos[n]` the step at which
+number n is drawn, a ticket completes a pattern at:
+    all of the cells      -> max of pos over the cells
+    at least n of them    -> n-th smallest pos over the filled cells
+    k of the lines        -> k-th smallest "line complete" step
+and the pattern is won at the smallest step over all tickets. These are
+computed for a whole batch of simulations x tickets with array operations,
+using the same Pattern specs as the live checkers (core.patterns), and
+batches are spread over a process pool, one per process and reused.
+
+With a time `budget`, each worker stops at the deadline, between batches,
+so a large request runs as many simulations as fit; the summary says how
+many were asked for and how many were run.
+
+Kept free of Django imports so worker processes can start without settings.
+"""
+import os
+import random
+import threading
+import time
+from concurrent.futures import ProcessPoolExecutor
+
+import numpy as np
+
+from core.patterns import COUNT, LINES, compile_pattern, get_pattern
+from core.tickets import random_ticket
+
+NEVER = 255          # step for "can't be won by this ticket"
+CELL_BUDGET = 4_000_000  # simulations x tickets x 27 cells held in memory per batch
+
+_executor = None
+_executor_workers = 0
+_executor_lock = threading.Lock()
+
+
+def _pool(workers):
+    """The process's simulation pool, started on first use (and again if `workers` changes)."""
+    global _executor, _executor_workers
+    with _executor_lock:
+        if _executor is None or _executor_workers != workers:
+            if _executor is not None:
+                _executor.shutdown(wait=False)
+            _executor = ProcessPoolExecutor(max_workers=workers)
+            _executor_workers = workers
+        return _executor
+
+
+def _flat(cells):
+    return np.array([r * 9 + c for r, c in cells], dtype=np.intp)
+
+
+def possible_tickets(pattern, filled):
+    """Which tickets (filled: (N, 27) bool) can form the pattern at all."""
+    ok = np.ones(len(filled), dtype=bool)
+    if pattern.filled:
+        ok &= filled[:, _flat(pattern.filled)].all(axis=1)
+    if pattern.blank:
+        ok &= ~filled[:, _flat(pattern.blank)].any(axis=1)
+    if pattern.any_filled:
+        ok &= filled[:, _flat(pattern.any_filled)].any(axis=1)
+    if pattern.min_filled:
+        cells, count = pattern.min_filled
+        ok &= filled[:, _flat(cells)].sum(axis=1) >= count
+    return ok
+
+
+def split_cells(cells):
+    """Split a cell set into full rows, full columns and the remaining single cells."""
+    cells = set(cells)
+    rows = [r for r in range(3) if all((r, c) in cells for c in range(9))]
+    cols = [c for c in range(9) if all((r, c) in cells for r in range(3))]
+    rest = sorted(cell for cell in cells if cell[0] not in rows and cell[1] not in cols)
+    return rows, cols, rest
+
+
+class Batch:
+    """
+    Draw steps of every ticket cell for a batch of simulations, plus the row and
+    column maxima most patterns are built from (computed once, shared by all patterns).
+    """
+
+    def __init__(self, pos, tickets, compact):
+        self.steps = pos[:, tickets]                 # (B, N, 27), 0 for blanks
+        grid = self.steps.reshape(len(pos), len(tickets), 3, 9)
+        self.row_max = grid.max(axis=3)              # (B, N, 3)
+        self.col_max = grid.max(axis=2)              # (B, N, 9)
+        self.pos = pos
+        self.compact = compact                       # (N, k) numbers per ticket, padded with 91
+        self._compact_steps = None
+
+    def compact_steps(self):
+        """(B, N, k) draw steps of each ticket's numbers only; padding is NEVER."""
+        if self._compact_steps is None:
+            self._compact_steps = self.pos[:, self.compact]
+        return self._compact_steps
+
+    def all_of(self, cells):
+        rows, cols, rest = split_cells(cells)
+        parts = [self.row_max[:, :, r] for r in rows] + [self.col_max[:, :, c] for c in cols]
+        if rest:
+            parts.append(self.steps[:, :, _flat(rest)].max(axis=2))
+        result = parts[0].copy()
+        for part in parts[1:]:
+            np.maximum(result, part, out=result)
+        return result
+
+
+def kth_smallest(arrays, k):
+    """
+    Elementwise k-th smallest (1-based) of equally shaped arrays. Keeps the k
+    smallest values seen so far in sorted order; much faster than np.partition
+    along a short trailing axis.
+    """
+    smallest = [np.full_like(arrays[0], NEVER) for _ in range(k)]
+    for value in arrays:
+        value = value.copy()
+        for j in range(k):
+            low = np.minimum(smallest[j], value)
+            np.maximum(smallest[j], value, out=value)
+            smallest[j] = low
+    return smallest[k - 1]
+
+
+def completion_steps(pattern, batch, filled, possible):
+    """
+    Step at which each ticket completes the pattern, for every simulation of the batch.
+    Returns (B, N) uint8, NEVER where the ticket can't complete it.
+    """
+    n = pattern.threshold
+    if pattern.kind is LINES:
+        lines = []
+        for line in pattern.lines:
+            done = batch.all_of(line)
+            done[:, ~filled[:, _flat(line)].any(axis=1)] = NEVER  # a line without numbers never counts
+            lines.append(done)
+        result = kth_smallest(lines, n)
+    elif pattern.kind is COUNT:
+        if len(pattern.cells) == 27:
+            cell_steps = batch.compact_steps()
+        else:
+            index = _flat(pattern.cells)
+            cell_steps = np.where(filled[:, index], batch.steps[:, :, index], NEVER).astype(np.uint8)
+        result = kth_smallest([cell_steps[:, :, i] for i in range(cell_steps.shape[2])], n)
+    else:
+        result = batch.all_of(pattern.cells)
+    result[:, ~possible] = NEVER
+    return result
+
+
+def ticket_arrays(tickets):
+    """(N, 27) numbers, (N, 27) filled mask and (N, k) numbers-only rows padded with 91."""
+    numbers = np.array(tickets, dtype=np.intp).reshape(len(tickets), 27)
+    filled = numbers != 0
+    width = max(1, int(filled.sum(axis=1).max()))
+    compact = np.full((len(tickets), width), 91, dtype=np.intp)
+    for i, row in enumerate(numbers):
+        nums = row[row != 0]
+        compact[i, :len(nums)] = nums
+    return numbers, filled, compact
+
+
+def draw_positions(orders):
+    """
+    pos[s, n] = step (1-90) at which number n is drawn in simulation s, from
+    (B, 90) draw orders; pos[s, 0] = 0 for blank cells, pos[s, 91] = NEVER for padding.
+    """
+    pos = np.zeros((len(orders), 92), dtype=np.uint8)
+    pos[:, 91] = NEVER
+    steps = np.broadcast_to(np.arange(1, 91, dtype=np.uint8), (len(orders), 90))
+    np.put_along_axis(pos, np.asarray(orders, dtype=np.intp), steps, axis=1)
+    return pos
+
+
+def _run_batches(players, specs, simulations, seed, deadline=None, first=True):
+    """
+    Worker: simulate `simulations` draws over one ticket pool, stopping between
+    batches once time.time() passes `deadline` (only the `first` task always
+    runs a batch). Returns summed histograms and the number of draws simulated.
+    """
+    if deadline is not None and not first and time.time() >= deadline:
+        return None
+    rng = np.random.default_rng(seed)
+    pool = [random_ticket(random.Random(seed * 1_000_003 + i)) for i in range(players)]
+    tickets, filled, compact = ticket_arrays(pool)
+
+    patterns = [compile_pattern(name, spec) for name, spec in specs]
+    possible = [possible_tickets(p, filled) for p in patterns]
+    step_hist = np.zeros((len(patterns), 256), dtype=np.int64)
+    winner_hist = np.zeros((len(patterns), players + 1), dtype=np.int64)
+
+    size = max(1, CELL_BUDGET // (players * 27))
+    done = 0
+    while done < simulations:
+        if deadline is not None and done and time.time() >= deadline:
+            break
+        b = min(size, simulations - done)
+        pos = draw_positions(np.argsort(rng.random((b, 90)), axis=1) + 1)
+        batch = Batch(pos, tickets, compact)
+
+        for i, pattern in enumerate(patterns):
+            per_ticket = completion_steps(pattern, batch, filled, possible[i])
+            best = per_ticket.min(axis=1)
+            winners = (per_ticket == best[:, None]).sum(axis=1)
+            step_hist[i] += np.bincount(best, minlength=256)
+            won = best != NEVER
+            winner_hist[i] += np.bincount(winners[won], minlength=players + 1)
+        done += b
+    return step_hist, winner_hist, done
+
+
+def _percentile(hist, q):
+    total = hist.sum()
+    if not total:
+        return None
+    return int(np.searchsorted(np.cumsum(hist), q * total))
+
+
+def simulate_round(players, patterns, simulations=100_000, workers=None, seed=None, budget=None):
+    """
+    Simulate `simulations` draws of a round with `players` tickets, or as
+    many as fit in `budget` seconds.
+
+    `patterns` holds built-in names or {"patternName": ..., "spec": ...} entries
+    (the same shape as prize_rounds). Returns a JSON-serialisable summary per pattern.
+    """
+    resolved = []
+    for pattern in patterns:
+        if isinstance(pattern, str):
+            pattern = {"patternName": pattern}
+        compiled = get_pattern(pattern["patternName"], pattern.get("spec"))
+        if compiled is None:
+            raise ValueError(f"Unknown pattern '{pattern['patternName']}'")
+        resolved.append((compiled.name, compiled.spec))
+
+    workers = workers or os.cpu_count() or 1
+    seed = random.SystemRandom().randrange(2 ** 32) if seed is None else seed
+    # a few ticket pools per worker so results don't hinge on one pool
+    tasks = min(simulations, workers * 4)
+    shares = [simulations // tasks + (1 if i < simulations % tasks else 0) for i in range(tasks)]
+    deadline = None if budget is None else time.time() + budget
+
+    started = time.perf_counter()
+    if workers == 1:
+        results = [_run_batches(players, resolved, n, seed + i, deadline, i == 0) for i, n in enumerate(shares)]
+    else:
+        futures = [
+            _pool(workers).submit(_run_batches, players, resolved, n, seed + i, deadline, i == 0)
+            for i, n in enumerate(shares)
+        ]
+        results = [f.result() for f in futures]
+    results = [r for r in results if r is not None]
+    requested, simulations = simulations, sum(r[2] for r in results)
+    step_hist = sum(r[0] for r in results)
+    winner_hist = sum(r[1] for r in results)
+
+    summary = {}
+    for i, (name, _) in enumerate(resolved):
+        steps = step_hist[i][:91]
+        winners = winner_hist[i]
+        won = int(winners.sum())
+        counts = np.arange(len(winners))
+        summary[name] = {
+            "won_ratio": won / simulations,
+            "step": {
+                "mean": float((steps * np.arange(91)).sum() / won) if won else None,
+                "p10": _percentile(steps, 0.10),
+                "p50": _percentile(steps, 0.50),
+                "p90": _percentile(steps, 0.90),
+                "histogram": steps[1:].tolist(),  # index 0 = step 1
+            },
+            "co_winners": {
+                "mean": float((winners * counts).sum() / won) if won else None,
+                "p_shared": float(winners[2:].sum() / won) if won else None,
+                "histogram": {int(k): int(v) for k, v in zip(counts, winners) if v},
+            },
+        }
+
+    return {
+        "players": players,
+        "simulations": simulations,
+        "requested_simulations": requested,
+        "workers": workers,
+        "seed": seed,
+        "elapsed": round(time.perf_counter() - started, 3),
+        "patterns": summary,
+    }
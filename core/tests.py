@@ -1,3 +1,831 @@
-from django.test import TestCase
+import copy
+import io
+import json
+import random
+import time
+from decimal import Decimal
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from django.core.management import call_command
+from django.db import connection
+from django.test import SimpleTestCase, TestCase, TransactionTestCase
+from django.test.utils import CaptureQueriesContext
+from django.utils import timezone
+from rest_framework.test import APIClient
+from rest_framework_simplejwt.tokens import AccessToken, UntypedToken
+
+from core import bench, counters, live, payouts, rounds, versioning, winners
+from core.batch import BatchChecker
+from core import cache as cache_module
+from core.cache import RoundTicketCache, round_tickets
+from core.deck import called_numbers, deck_order, verify_deck
+from core.models import Draw, Game, Pattern, Payout, PlayerGame, PlayerTicket, Round, RoundDeck, RoundWise, Tickets, User
+from core.ops import PATTERN_NAMES, Checker, CompiledTicket, GameWinnerHandler, RoundEngine
+from core.middleware.jwt_auth_middleware import get_user
+from core.patterns import PatternSpecError, _compile, get_pattern
+from core.principals import GameRefreshToken, PrincipalCache, principals
+from core.tickets import is_valid_strip, is_valid_ticket, random_strip, random_ticket, ticket_hash
+from core.simulate import Batch, completion_steps, draw_positions, possible_tickets, simulate_round, ticket_arrays
+
+
+def make_ticket(rng):
+    """A housie-style 3x9 ticket: 5 numbers per row, column c holds 10c..10c+9."""
+    ticket = [[0] * 9 for _ in range(3)]
+    for row in ticket:
+        for col in rng.sample(range(9), 5):
+            row[col] = col * 10 + rng.randint(1, 9)
+    # keep numbers unique down each column
+    for col in range(9):
+        nums = [ticket[r][col] for r in range(3) if ticket[r][col]]
+        if len(set(nums)) != len(nums):
+            fresh = iter(rng.sample(range(col * 10 + 1, col * 10 + 10), len(nums)))
+            for r in range(3):
+                if ticket[r][col]:
+                    ticket[r][col] = next(fresh)
+    return ticket
+
+
+class CompiledCheckerParityTests(SimpleTestCase):
+    def setUp(self):
+        self.checker = Checker()
+        self.legacy = {
+            "full-housie": self.checker.check_full_housie,
+            "any-one-line": self.checker.check_any_one_line,
+            "two-lines": self.checker.check_two_lines,
+            "early-five": self.checker.check_early_five,
+            "four-corners": self.checker.check_four_corners,
+            "t-shape": self.checker.check_t_shape,
+            "cross-plus": self.checker.check_cross_plus,
+            "l-shape": self.checker.check_l_shape,
+            "border-shape": self.checker.check_border_shape,
+            "four-corner-middle": self.checker.check_four_corner_middle,
+        }
+
+    def assert_parity(self, ticket, called):
+        compiled = CompiledTicket.from_ticket(ticket)
+        self.assertIsNotNone(compiled)
+        mask = self.checker.called_mask(called)
+        for name in PATTERN_NAMES:
+            self.assertEqual(
+                compiled.check(name, mask),
+                self.legacy[name](ticket, called),
+                f"{name} differs for {ticket} / {sorted(called)}",
+            )
+
+    def test_random_tickets_match_legacy_functions(self):
+        rng = random.Random(1234)
+        for _ in range(2000):
+            ticket = make_ticket(rng)
+            ticket_numbers = [n for row in ticket for n in row if n]
+            # bias the draws towards the ticket so that patterns actually complete
+            called = rng.sample(ticket_numbers, rng.randint(0, len(ticket_numbers)))
+            called += rng.sample(range(1, 91), rng.randint(0, 40))
+            self.assert_parity(ticket, called)
+
+    def test_sparse_and_dense_rows_match_legacy_functions(self):
+        rng = random.Random(99)
+        for _ in range(1000):
+            ticket = [[0] * 9 for _ in range(3)]
+            for num in rng.sample(range(1, 91), rng.randint(0, 27)):
+                ticket[rng.randrange(3)][rng.randrange(9)] = num
+            if len({n for row in ticket for n in row if n}) != len([n for row in ticket for n in row if n]):
+                continue
+            called = rng.sample(range(1, 91), rng.randint(0, 90))
+            self.assert_parity(ticket, called)
+
+    def test_uncompilable_tickets_fall_back(self):
+        ticket = [
+            [5, 9, 72, 22, 32, 40, 56, 70, 88],
+            [2, 12, 19, 28, 38, 48, 59, 72, 1],
+            [3, 10, 18, 25, 37, 45, 60, 80, 90],
+        ]
+        called = [5, 9, 72, 22, 32, 40, 56, 70, 88, 3, 10, 18, 25, 37, 45, 60, 80, 90, 1, 2]
+        self.assertIsNone(CompiledTicket.from_ticket(ticket))  # 72 appears twice
+        results = self.checker.check_patterns(ticket, called, list(PATTERN_NAMES) + ["unknown"])
+        self.assertEqual(results["border-shape"], True)
+        self.assertEqual(results["early-five"], True)
+        self.assertEqual(results["unknown"], False)
+
+    def test_check_patterns_uses_compiled_path(self):
+        ticket = make_ticket(random.Random(7))
+        called = [n for n in ticket[0] if n]
+        results = self.checker.check_patterns(ticket, called, ["any-one-line", "two-lines", "nope"])
+        self.assertEqual(results, {"any-one-line": True, "two-lines": False, "nope": False})
+
+
+class RoundEngineTests(SimpleTestCase):
+    def test_draws_report_the_same_winners_as_checker(self):
+        rng = random.Random(42)
+        checker = Checker()
+        tickets = {player_id: make_ticket(rng) for player_id in range(200)}
+        engine = RoundEngine(PATTERN_NAMES)
+        for player_id, ticket in tickets.items():
+            engine.add_ticket(player_id, ticket)
+
+        called = []
+        seen = {name: set() for name in PATTERN_NAMES}
+        for number in rng.sample(range(1, 91), 90):
+            called.append(number)
+            for name, keys in engine.draw(number).items():
+                self.assertFalse(seen[name] & set(keys))
+                seen[name].update(keys)
+            for name in PATTERN_NAMES:
+                expected = {
+                    pid for pid, ticket in tickets.items()
+                    if checker.check_patterns(ticket, called, [name])[name]
+                }
+                self.assertEqual(set(engine.winners(name)), expected, name)
+                self.assertEqual(seen[name], expected, name)
+
+    def test_late_tickets_and_fallback_tickets(self):
+        engine = RoundEngine(["any-one-line", "early-five"])
+        engine.sync([1, 2, 3, 4, 5, 6])
+        ticket = [[1, 0, 2, 0, 3, 0, 4, 0, 5], [0] * 9, [0] * 9]
+        self.assertEqual(engine.add_ticket("late", ticket), {"any-one-line": ["late"], "early-five": ["late"]})
+
+        duplicate = [[7, 0, 7, 0, 8, 0, 9, 0, 10], [0] * 9, [0] * 9]
+        engine.add_ticket("dup", duplicate)
+        self.assertEqual(engine.fallback, [("dup", duplicate)])
+        engine.sync([7, 8, 9, 10])
+        self.assertEqual(engine.winners("any-one-line"), ["late", "dup"])
+
+
+class BatchCheckerTests(SimpleTestCase):
+    def test_batch_results_match_checker(self):
+        rng = random.Random(5)
+        checker = Checker()
+        tickets = [make_ticket(rng) for _ in range(300)]
+        tickets.append([[5, 9, 72, 22, 32, 40, 56, 70, 88], [2, 12, 19, 28, 38, 48, 59, 72, 1], [0] * 9])
+        tickets.append([[1, 2], [3]])  # not 3x9, checked by Checker
+        batch = BatchChecker(range(len(tickets)), tickets)
+        self.assertEqual([key for key, _ in batch.fallback], [len(tickets) - 1])
+
+        for depth in (0, 5, 30, 60, 90):
+            called = rng.sample(range(1, 91), depth)
+            results = batch.check(called, PATTERN_NAMES)
+            for i, ticket in enumerate(tickets[:-1]):
+                expected = checker.check_patterns(ticket, called, PATTERN_NAMES)
+                self.assertEqual({name: bool(res[i]) for name, res in results.items()}, expected)
+
+
+class PatternSpecTests(SimpleTestCase):
+    DIAGONAL = {"cells": [[0, 0], [1, 4], [2, 8]], "filled": [[0, 0], [1, 4], [2, 8]]}
+
+    def test_compiled_specs_are_bounded(self):
+        for i in range(1100):
+            get_pattern(f"p{i}", {"cells": "all", "min": 1 + i % 15})
+        self.assertLessEqual(_compile.cache_info().currsize, _compile.cache_info().maxsize)
+
+    def test_custom_spec_agrees_across_checkers(self):
+        rng = random.Random(11)
+        checker = Checker()
+        pattern = get_pattern("diagonal", self.DIAGONAL)
+        self.assertIs(pattern, get_pattern("diagonal", dict(self.DIAGONAL)))  # compiled once
+        self.assertIs(get_pattern("full-housie"), get_pattern("full-housie"))
+
+        tickets = [make_ticket(rng) for _ in range(300)]
+        engine = RoundEngine([pattern])
+        for i, ticket in enumerate(tickets):
+            engine.add_ticket(i, ticket)
+        batch = BatchChecker(range(len(tickets)), tickets)
+
+        called = []
+        for number in rng.sample(range(1, 91), 90):
+            called.append(number)
+            engine.draw(number)
+            expected = [
+                i for i, t in enumerate(tickets)
+                if all(t[r][c] for r, c in [(0, 0), (1, 4), (2, 8)])
+                and all(t[r][c] in called for r, c in [(0, 0), (1, 4), (2, 8)])
+            ]
+            self.assertEqual(sorted(engine.winners("diagonal")), expected)
+            self.assertEqual(batch.winners(called, [pattern])["diagonal"], expected)
+            self.assertEqual(
+                [i for i, t in enumerate(tickets) if checker.check_patterns(t, called, [pattern])["diagonal"]],
+                expected,
+            )
+
+    def test_invalid_specs_are_rejected(self):
+        for spec in (
+            [],
+            {"cells": "row:3"},
+            {"cells": "all", "lines": ["row:0"]},
+            {"cells": [[0, 9]]},
+            {"cells": "corners", "min": 5},
+            {"lines": ["row:0", "row:1"], "lines_min": 3},
+            {"cells": "all", "min_filled": {"cells": "col:0"}},
+            {"cells": "all", "colour": "red"},
+        ):
+            with self.assertRaises(PatternSpecError, msg=spec):
+                get_pattern("custom", spec)
+
+
+class SimulationTests(SimpleTestCase):
+    def test_completion_steps_match_checker(self):
+        rng = random.Random(17)
+        checker = Checker()
+        tickets = [make_ticket(rng) for _ in range(40)]
+        tickets.append([[5, 9, 72, 22, 32, 40, 56, 70, 88], [2, 12, 19, 28, 38, 48, 59, 72, 1], [0] * 9])
+        patterns = [get_pattern(name) for name in PATTERN_NAMES]
+        patterns.append(get_pattern("diagonal", PatternSpecTests.DIAGONAL))
+
+        orders = [rng.sample(range(1, 91), 90) for _ in range(2)]
+        numbers, filled, compact = ticket_arrays(tickets)
+        batch = Batch(draw_positions(orders), numbers, compact)
+        for pattern in patterns:
+            steps = completion_steps(pattern, batch, filled, possible_tickets(pattern, filled))
+            for s, order in enumerate(orders):
+                for i, ticket in enumerate(tickets):
+                    expected = next(
+                        (k for k in range(1, 91) if checker.check_patterns(ticket, order[:k], [pattern])[pattern.name]),
+                        255,
+                    )
+                    self.assertEqual(int(steps[s, i]), expected, (pattern.name, s, i))
+
+    def test_simulation_is_reproducible_from_its_seed(self):
+        first = simulate_round(20, ["early-five", "full-housie"], simulations=500, workers=1, seed=3)
+        second = simulate_round(20, ["early-five", "full-housie"], simulations=500, workers=1, seed=3)
+        self.assertEqual(first["patterns"], second["patterns"])
+        early, full = first["patterns"]["early-five"], first["patterns"]["full-housie"]
+        self.assertEqual(sum(early["step"]["histogram"]), 500)
+        self.assertLess(early["step"]["p50"], full["step"]["p50"])
+        self.assertGreaterEqual(early["co_winners"]["mean"], 1)
+
+    def test_a_budget_scales_large_requests_down(self):
+        started = time.perf_counter()
+        result = simulate_round(2000, ["full-housie", "early-five"], simulations=200_000, workers=1, seed=3, budget=0.5)
+        self.assertLess(time.perf_counter() - started, 1.5)
+        self.assertEqual(result["requested_simulations"], 200_000)
+        self.assertLess(result["simulations"], 200_000)
+        self.assertEqual(sum(result["patterns"]["full-housie"]["step"]["histogram"]), result["simulations"])
+
+
+class RoundTicketCacheTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(live, "_store", live.MemoryStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        creator = User.objects.create_user("creator@example.com", "pw", full_name="C", mobile_number="1", role="creator")
+        self.game = Game.objects.create(
+            creator=creator, title="G", number_of_users=10, total_prize_pool=100,
+            date_time=timezone.now(), prize_rounds=[],
+        )
+        rng = random.Random(3)
+        for i in range(3):
+            player = User.objects.create_user(f"p{i}@example.com", "pw", full_name=f"P{i}", mobile_number="1")
+            for round_id in (1, 2):
+                PlayerTicket.objects.create(player=player, game=self.game, round_id=round_id, ticket_data=make_ticket(rng))
+
+    def test_rounds_load_once_and_evict_least_recently_used(self):
+        cache = RoundTicketCache(max_rounds=1)
+        tickets = cache.get(self.game.id, 1)
+        self.assertEqual(len(tickets), 3)
+        with self.assertNumQueries(0):
+            self.assertIs(cache.get(self.game.id, 1), tickets)
+
+        cache.get(self.game.id, 2)
+        self.assertNotIn((self.game.id, 1), cache)
+        self.assertIn((self.game.id, 2), cache)
+
+        cache.invalidate(self.game.id)
+        self.assertEqual(len(cache), 0)
+
+    def test_a_new_tickets_version_reloads_in_every_process(self):
+        cache = RoundTicketCache(max_rounds=4)
+        tickets = cache.get(self.game.id, 1)
+        live.tickets_changed(self.game.id, 1)  # as invalidate_round_tickets does from another process
+        reloaded = cache.get(self.game.id, 1)
+        self.assertIsNot(reloaded, tickets)
+        with self.assertNumQueries(0):
+            self.assertIs(cache.get(self.game.id, 1), reloaded)
+
+    def test_a_load_racing_an_invalidation_is_not_served(self):
+        cache = RoundTicketCache(max_rounds=4)
+        player = User.objects.create_user("late@example.com", "pw", full_name="L", mobile_number="1")
+        load = cache_module.RoundTickets
+
+        def join_during_load(rows):
+            rows = list(rows)  # read before the join commits
+            PlayerTicket.objects.create(player=player, game=self.game, round_id=1, ticket_data=make_ticket(random.Random(5)))
+            cache_module.invalidate_round_tickets(self.game.id, [1])
+            return load(rows)
+
+        with mock.patch.object(cache_module, "RoundTickets", join_during_load):
+            self.assertEqual(len(cache.get(self.game.id, 1)), 3)
+        self.assertEqual(len(cache.get(self.game.id, 1)), 4)
+
+
+class DrawDeckTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(live, "_store", live.MemoryStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        creator = User.objects.create_user("creator@example.com", "pw", full_name="C", mobile_number="1", role="creator")
+        self.game = Game.objects.create(
+            creator=creator, title="G", number_of_users=10, total_prize_pool=100,
+            date_time=timezone.now(), prize_rounds=[{"id": "1", "called_numbers": [], "patterns": []}],
+        )
+
+    def test_deck_order_is_a_replayable_permutation(self):
+        self.assertEqual(deck_order("abc"), deck_order("abc"))
+        self.assertNotEqual(deck_order("abc"), deck_order("abd"))
+        self.assertEqual(sorted(deck_order("abc")), list(range(1, 91)))
+
+    def test_draws_follow_the_seed_until_the_deck_runs_out(self):
+        drawn = []
+        for _ in range(90):
+            number, called = live.draw(self.game.id, 1)
+            drawn.append(number)
+            self.assertEqual(called, drawn)
+        self.assertEqual(live.draw(self.game.id, 1), (None, drawn))
+
+        round_deck = RoundDeck.objects.get(game=self.game, round_id=1)
+        self.assertEqual(drawn, deck_order(round_deck.seed))
+        self.assertTrue(verify_deck(round_deck))
+        self.assertEqual(called_numbers(self.game.id, 1), drawn)
+
+    def test_numbers_called_before_the_deck_stay_first(self):
+        round_row = self.game.rounds.get(number=1)
+        Draw.objects.bulk_create([Draw(round=round_row, seq=1, number=7), Draw(round=round_row, seq=2, number=12)])
+        number, called = live.draw(self.game.id, 1)
+        self.assertEqual(called[:2], [7, 12])
+        self.assertNotIn(number, (7, 12))
+        self.assertTrue(verify_deck(RoundDeck.objects.get(game=self.game, round_id=1)))
+
+
+class LiveRoundStateTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(live, "_store", live.MemoryStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        creator = User.objects.create_user("creator@example.com", "pw", full_name="C", mobile_number="1", role="creator")
+        self.game = Game.objects.create(
+            creator=creator, title="G", number_of_users=10, total_prize_pool=100, date_time=timezone.now(),
+            state="ongoing",
+            prize_rounds=[{"id": "1", "called_numbers": [], "patterns": [
+                {"id": "1.1", "patternName": "early-five", "prizeAmount": "10", "won": False, "wonBy": None},
+                {"id": "1.2", "patternName": "full-housie", "prizeAmount": "50", "won": True, "wonBy": []},
+            ]}],
+        )
+
+    def test_draws_stay_off_the_database_until_flushed(self):
+        live.game_info(self.game.id)
+        live.draw(self.game.id, 1)  # loads the round and starts its deck
+        with self.assertNumQueries(0):
+            for _ in range(9):
+                number, called = live.draw(self.game.id, 1)
+            self.assertEqual(live.called_numbers(self.game.id, 1), called)
+            self.assertEqual(live.game_info(self.game.id)["state"], "ongoing")
+        round_deck = RoundDeck.objects.get(game=self.game, round_id=1)
+        self.assertEqual(called, deck_order(round_deck.seed)[:10])
+        self.assertEqual(round_deck.cursor, 0)
+
+        self.assertEqual(live.flush(), 1)
+        round_deck.refresh_from_db()
+        self.assertEqual(round_deck.cursor, 10)
+        self.assertEqual(list(Draw.objects.filter(round__game=self.game).order_by("seq").values_list("number", flat=True)), called)
+        self.assertEqual(live.flush(), 0)  # nothing drawn since
+
+    def test_a_failed_flush_leaves_the_rounds_dirty(self):
+        live.draw(self.game.id, 1)
+        with mock.patch.object(rounds, "record_draws", side_effect=ValueError), self.assertRaises(ValueError):
+            live.flush()
+        self.assertEqual(live.flush(), 1)
+        self.assertEqual(Draw.objects.filter(round__game=self.game).count(), 1)
+
+    def test_pausing_flushes_and_the_last_number_flushes(self):
+        live.draw(self.game.id, 1)
+        live.draw(self.game.id, 1)
+        live.set_game_state(self.game.id, "paused")
+        self.assertEqual(RoundDeck.objects.get(game=self.game, round_id=1).cursor, 2)
+
+        for _ in range(88):
+            live.draw(self.game.id, 1)
+        self.assertEqual(RoundDeck.objects.get(game=self.game, round_id=1).cursor, 90)
+        self.assertEqual(live.draw(self.game.id, 1)[0], None)
+
+    def test_patterns_are_claimed_once(self):
+        state = live.round_state(self.game.id, 1)
+        self.assertEqual([p["id"] for p in state.open_patterns()], ["1.1"])
+        self.assertEqual(live.claim_patterns(self.game.id, 1, ["1.1", "1.2"]), ["1.1"])
+        self.assertEqual(live.claim_patterns(self.game.id, 1, ["1.1"]), [])
+        live.release_patterns(self.game.id, 1, ["1.1"])
+        self.assertEqual(live.claim_patterns(self.game.id, 1, ["1.1"]), ["1.1"])
+        self.assertIsNone(live.round_state(self.game.id, 2))
+
+
+class BenchTests(TransactionTestCase):
+    # the draw benchmark goes through database_sync_to_async, which closes a TestCase's connection on file databases
+    def test_handler_samples_leave_the_game_untouched(self):
+        game = bench.build_game(bench.make_tickets(50, seed=1))
+        result = bench.bench_handler(game, depth=30, repeat=3, backend="engine")
+        self.assertEqual(result["samples"], 3)
+        self.assertLessEqual(result["p50_ms"], result["max_ms"])
+        game.refresh_from_db()
+        self.assertEqual(game.prize_rounds, [bench.fresh_round()])
+        self.assertFalse(PlayerGame.objects.filter(game=game, won_amount__gt=0).exists())
+
+    def test_every_bench_winners_target_runs(self):
+        out = io.StringIO()
+        # the command sets up a test database of its own; here it runs in the test's
+        with mock.patch.object(connection.creation, "create_test_db"), mock.patch.object(connection.creation, "destroy_test_db"):
+            call_command(
+                "bench_winners", targets=["checker", "handler", "draw", "broadcast"],
+                sizes=[20], connections=[3], depths=[5], repeat=1, stdout=out,
+            )
+        scenarios = [line.split()[0] for line in out.getvalue().splitlines()[1:]]
+        self.assertEqual(
+            [key.split("/")[0] for key in scenarios], ["checker", "handler", "draw", "draw"] + ["broadcast"] * 4
+        )
+
+    def test_compare_flags_only_real_regressions(self):
+        baseline = {"a": {"p50_ms": 10.0, "alloc_peak_kib": 100.0}, "b": {"p50_ms": 0.2, "alloc_peak_kib": 1.0}}
+        current = {"a": {"p50_ms": 13.0, "alloc_peak_kib": 110.0}, "b": {"p50_ms": 0.4, "alloc_peak_kib": 1.0},
+                   "c": {"p50_ms": 99.0}}
+        self.assertEqual(bench.compare(current, baseline, 0.2), [("a", "p50_ms", 10.0, 13.0)])
+        self.assertEqual(bench.compare(current, baseline, 0.5), [])
+
+
+class TicketGeneratorTests(TestCase):
+    def test_tickets_and_strips_follow_the_rules(self):
+        rng = random.Random(21)
+        for _ in range(500):
+            self.assertTrue(is_valid_ticket(random_ticket(rng)))
+        for _ in range(200):
+            self.assertTrue(is_valid_strip(random_strip(rng)))
+
+        ticket = [[1, 0, 21, 0, 41, 0, 61, 0, 81], [0, 12, 0, 32, 0, 52, 0, 72, 0], [3, 0, 23, 0, 43, 0, 63, 0, 83]]
+        self.assertFalse(is_valid_ticket(ticket))  # middle row holds 4 numbers
+        ticket[1][8] = 82
+        self.assertTrue(is_valid_ticket(ticket))
+        ticket[1][1] = 9  # 9 belongs in column 0
+        self.assertFalse(is_valid_ticket(ticket))
+
+    def test_command_fills_the_pool_without_duplicates(self):
+        call_command("generate_tickets", 40, seed=5, workers=1, chunk=15, batch_size=8, stdout=io.StringIO())
+        self.assertEqual(Tickets.objects.count(), 40)
+        hashes = set(Tickets.objects.values_list("content_hash", flat=True))
+        self.assertEqual(len(hashes), 40)
+        self.assertTrue(all(ticket_hash(t.ticket_data) == t.content_hash for t in Tickets.objects.all()))
+
+        call_command("generate_tickets", 40, seed=5, workers=1, chunk=15, batch_size=8, stdout=io.StringIO())
+        self.assertEqual(Tickets.objects.count(), 40)
+
+        call_command("generate_tickets", 12, strips=True, seed=6, workers=1, stdout=io.StringIO())
+        strips = list(Tickets.objects.order_by("id").values_list("ticket_data", flat=True))[40:]
+        self.assertTrue(is_valid_strip(strips[:6]) and is_valid_strip(strips[6:]))
+
+
+
+class SocketPrincipalTests(TransactionTestCase):
+    # database_sync_to_async closes the connection TestCase's transaction runs in, except in-memory SQLite's
+    def setUp(self):
+        patcher = mock.patch.object(live, "_store", live.MemoryStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        principals.clear()
+        self.addCleanup(principals.clear)
+        self.user = User.objects.create_user("player@example.com", "pw", full_name="Pat", mobile_number="1")
+
+    def resolve(self, token):
+        return async_to_sync(get_user)(UntypedToken(str(token)))
+
+    def test_token_claims_build_the_principal_without_queries(self):
+        token = GameRefreshToken.for_user(self.user).access_token
+        with self.assertNumQueries(0):
+            first = self.resolve(token)
+            second = self.resolve(token)
+        self.assertEqual((first.id, first.role, first.full_name), (self.user.id, "player", "Pat"))
+        self.assertIs(second, first)
+        self.assertEqual(principals.stats(), {"hits": 1, "misses": 1, "size": 1})
+
+    def test_tokens_without_claims_are_looked_up_once(self):
+        token = AccessToken.for_user(self.user)
+        with self.assertNumQueries(1):
+            self.resolve(token)
+            self.assertEqual(self.resolve(token).role, "player")
+
+    def test_deactivated_users_are_turned_away(self):
+        token = GameRefreshToken.for_user(self.user).access_token
+        self.assertTrue(self.resolve(token).is_authenticated)
+        self.user.is_active = False
+        self.user.save()
+        self.assertFalse(self.resolve(token).is_authenticated)
+        self.assertFalse(self.resolve(AccessToken.for_user(self.user)).is_authenticated)
+        self.user.is_active = True
+        self.user.save()
+        self.assertTrue(self.resolve(token).is_authenticated)
+
+    def test_cache_stats_are_logged_periodically(self):
+        cache = PrincipalCache(10, 60, log_interval=0)
+        with self.assertLogs("core.principals", "INFO") as logs:
+            cache.get(1)
+            cache.get(1)
+        self.assertIn("'misses': 1", logs.output[-1])
+        cache.log_interval = 3600
+        with self.assertNoLogs("core.principals", "INFO"):
+            cache.get(1)
+
+    def test_only_is_active_changes_touch_the_live_store(self):
+        with mock.patch.object(live, "set_user_revoked") as set_revoked:
+            self.user.last_login = timezone.now()
+            self.user.save(update_fields=["last_login"])
+            self.user.full_name = "Patricia"
+            self.user.save()
+            User.objects.get(id=self.user.id).save()
+            set_revoked.assert_not_called()
+            self.user.is_active = False
+            self.user.save()
+        set_revoked.assert_called_once()
+
+    def test_a_revocation_from_another_process_reaches_cached_principals(self):
+        token = GameRefreshToken.for_user(self.user).access_token
+        self.assertTrue(self.resolve(token).is_authenticated)
+        live.set_user_revoked(self.user.id, True, 60)  # what the receiver does in the process that saved the user
+        self.assertFalse(self.resolve(token).is_authenticated)
+        self.assertEqual(len(principals), 0)
+
+
+class WinnersSnapshotTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(live, "_store", live.MemoryStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        creator = User.objects.create_user("creator@example.com", "pw", full_name="C", mobile_number="1", role="creator")
+        self.player = User.objects.create_user("player@example.com", "pw", full_name="Pat", mobile_number="1")
+        patterns = [{"id": "1.1", "patternName": "early-five", "prizeAmount": "10", "won": False, "wonBy": None}]
+        self.game = Game.objects.create(
+            creator=creator, title="G", number_of_users=10, total_prize_pool=10, date_time=timezone.now(),
+            state="ongoing", prize_rounds=[{"id": "1", "called_numbers": [], "patterns": patterns}],
+        )
+        PlayerGame.objects.create(player=self.player, game=self.game)
+        ticket = make_ticket(random.Random(4))
+        PlayerTicket.objects.create(player=self.player, game=self.game, round_id=1, ticket_data=ticket)
+        numbers = [n for row in ticket for n in row if n]
+        order = numbers[:5] + [n for n in range(1, 91) if n not in numbers[:5]]
+        live.get_store().put_game(self.game.id, {"state": "ongoing", "rounds": 1})
+        live.get_store().put_round(self.game.id, 1, bytes(order), 5, patterns)
+
+    def test_snapshot_is_rebuilt_only_when_winners_are_paid(self):
+        version, frame = winners.snapshot(self.game.id)
+        self.assertEqual(json.loads(frame), {"message": "All winners fetched", "version": version, "all_winners": []})
+        with self.assertNumQueries(0):
+            self.assertEqual(winners.snapshot(self.game.id), (version, frame))
+
+        with self.captureOnCommitCallbacks(execute=True):
+            GameWinnerHandler().assign_winners(self.game.id, 1)
+        with self.assertNumQueries(0):
+            new_version, frame = winners.snapshot(self.game.id)
+        self.assertNotEqual(new_version, version)
+        self.assertEqual(json.loads(frame)["all_winners"], [{
+            "round_id": 1, "pattern_id": "1.1", "pattern_name": "early-five", "prize_amount": "10.00",
+            "winners": [{"player_id": self.player.id, "player_name": "Pat"}],
+        }])
+
+
+class WinnerSettlementTests(TestCase):
+    def setUp(self):
+        patcher = mock.patch.object(live, "_store", live.MemoryStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.creator = User.objects.create_user("creator@example.com", "pw", full_name="C", mobile_number="1", role="creator")
+
+    def make_round(self, players):
+        """A round where `players` players hold the same ticket, and the first five numbers called are on it."""
+        patterns = [
+            {"id": "1.1", "patternName": "early-five", "prizeAmount": "10", "won": False, "wonBy": None},
+            {"id": "1.2", "patternName": "full-housie", "prizeAmount": "90", "won": False, "wonBy": None},
+        ]
+        game = Game.objects.create(
+            creator=self.creator, title="G", number_of_users=players, total_prize_pool=100, date_time=timezone.now(),
+            state="ongoing", prize_rounds=[{"id": "1", "called_numbers": [], "patterns": patterns}],
+        )
+        self.addCleanup(round_tickets.invalidate, game.id)
+        users = User.objects.bulk_create([
+            User(email=f"g{game.id}p{i}@example.com", full_name=f"P{i}", mobile_number="1", password="!")
+            for i in range(players)
+        ])
+        users = list(User.objects.filter(email__startswith=f"g{game.id}p"))
+        ticket = make_ticket(random.Random(4))
+        PlayerGame.objects.bulk_create([PlayerGame(player=u, game=game) for u in users])
+        PlayerTicket.objects.bulk_create([PlayerTicket(player=u, game=game, round_id=1, ticket_data=ticket) for u in users])
+        numbers = [n for row in ticket for n in row if n]
+        order = numbers[:5] + [n for n in range(1, 91) if n not in numbers[:5]]
+        live.get_store().put_game(game.id, {"state": "ongoing", "rounds": 1})
+        live.get_store().put_round(game.id, 1, bytes(order), 5, patterns)
+        return game, users
+
+    def settle(self, game):
+        with CaptureQueriesContext(connection) as queries:
+            result = GameWinnerHandler().assign_winners(game.id, 1)
+        return result, len(queries)
+
+    def test_queries_stay_the_same_however_many_share_a_pattern(self):
+        small, _ = self.make_round(2)
+        large, users = self.make_round(30)
+        _, few = self.settle(small)
+        result, many = self.settle(large)
+        self.assertEqual(few, many)
+
+        user_ids = sorted(u.id for u in users)
+        self.assertEqual(
+            sorted(PlayerGame.objects.filter(game=large).values_list("won_amount", flat=True).distinct()), [Decimal("0.33")]
+        )
+        entry = RoundWise.objects.get(game=large, round_id=1, pattern_id="1.1")
+        self.assertEqual(sorted(entry.won_by.values_list("id", flat=True)), user_ids)
+        pattern = Pattern.objects.get(round__game=large, pattern_id="1.1")
+        self.assertEqual((pattern.won, sorted(pattern.won_by)), (True, user_ids))
+        game = Game.objects.get(id=large.id)
+        self.assertEqual((game.winners_count, game.prizes_distributed), (30, Decimal("9.90")))
+        self.assertEqual(
+            sorted(Payout.objects.filter(game=large).values_list("player_id", "pattern_id", "amount", "seq")),
+            [(user_id, "1.1", Decimal("0.33"), 5) for user_id in user_ids],
+        )
+        with self.assertNumQueries(0):
+            paid = result["winners"]["1.1"]
+            self.assertEqual(sorted(e["player"].player_id for e in paid), user_ids)
+            self.assertTrue(all(e["player"].player.full_name.startswith("P") for e in paid))
+            self.assertTrue(all(e["player"].won_amount == Decimal("0.33") for e in paid))
+
+    def test_totals_are_materialized_from_the_ledger(self):
+        game, users = self.make_round(3)
+        self.settle(game)
+        payouts.record(game.id, 1, 5, [("1.1", users[0].id, Decimal("5.00"))])  # already in the ledger: kept as it was
+        payouts.record(game.id, 1, 9, [("1.2", users[0].id, Decimal("30.00"))])
+        PlayerGame.objects.filter(game=game).update(won_amount=0)
+        payouts.refresh_totals(game.id)
+        self.assertEqual(
+            dict(PlayerGame.objects.filter(game=game).values_list("player_id", "won_amount")),
+            {users[0].id: Decimal("33.33"), users[1].id: Decimal("3.33"), users[2].id: Decimal("3.33")},
+        )
+
+
+class RoundTableTests(TestCase):
+    def setUp(self):
+        creator = User.objects.create_user("creator@example.com", "pw", full_name="C", mobile_number="1", role="creator")
+        self.game = Game.objects.create(
+            creator=creator, title="G", number_of_users=10, total_prize_pool=100, date_time=timezone.now(),
+            prize_rounds=[
+                {"id": "1", "called_numbers": [], "patterns": [
+                    {"id": "1.1", "patternName": "early-five", "prizeAmount": "10", "won": False, "wonBy": None},
+                    {"id": "1.2", "patternName": "full-housie", "prizeAmount": "50", "won": False, "wonBy": None},
+                ]},
+                {"id": "2", "called_numbers": [], "patterns": [
+                    {"id": "2.1", "patternName": "full-housie", "prizeAmount": "40", "won": False, "wonBy": None},
+                ]},
+            ],
+        )
+
+    def test_rows_follow_prize_rounds(self):
+        self.assertEqual(list(self.game.rounds.values_list("number", flat=True)), [1, 2])
+        self.assertEqual(Pattern.objects.get(round__game=self.game, pattern_id="1.2").prize_amount, Decimal("50.00"))
+        self.assertEqual(rounds.prize_rounds(self.game), self.game.prize_rounds)
+
+        self.game.prize_rounds = self.game.prize_rounds[1:]
+        rounds.sync_rounds(self.game)
+        self.assertEqual(list(Pattern.objects.filter(round__game=self.game).values_list("pattern_id", flat=True)), ["2.1"])
+
+    def test_edits_keep_draws_and_won_state(self):
+        round_row = self.game.rounds.get(number=1)
+        Draw.objects.create(round=round_row, seq=1, number=42)
+        Pattern.objects.filter(round=round_row, pattern_id="1.1").update(won=True, won_by=[5])
+
+        entries = copy.deepcopy(self.game.prize_rounds)
+        entries[0]["patterns"][0]["prizeAmount"] = "15"
+        entries[0]["patterns"].append({"id": "1.1", "patternName": "top-line", "prizeAmount": "5"})  # repeated id
+        self.game.prize_rounds = entries
+        rounds.sync_rounds(self.game)
+
+        self.assertEqual(self.game.rounds.get(number=1).pk, round_row.pk)
+        self.assertEqual(rounds.round_data(self.game.id, 1)["called_numbers"], [42])
+        kept = Pattern.objects.get(round=round_row, pattern_id="1.1")
+        self.assertEqual((kept.won, kept.prize_amount), (True, Decimal("15.00")))
+        self.assertEqual(
+            list(Pattern.objects.filter(round=round_row).values_list("pattern_id", flat=True)), ["1.1", "1.2", "1.3"]
+        )
+
+    def test_called_numbers_come_from_the_draws_and_the_live_store(self):
+        with mock.patch.object(live, "_store", live.MemoryStore()):
+            for _ in range(3):
+                live.draw(self.game.id, 1)
+            live.flush()
+            live.draw(self.game.id, 1)  # not flushed yet
+            entries = rounds.prize_rounds(self.game)
+            self.assertEqual(entries[0]["called_numbers"], live.called_numbers(self.game.id, 1))
+            self.assertEqual(len(entries[0]["called_numbers"]), 4)
+            self.assertEqual(entries[1]["called_numbers"], [])
+
+            live.evict_game(self.game.id)
+            self.assertEqual(rounds.prize_rounds(self.game)[0]["called_numbers"], entries[0]["called_numbers"])
+
+    def test_won_state_comes_from_the_pattern_rows(self):
+        Pattern.objects.filter(round__game=self.game, pattern_id="1.1").update(won=True, won_by=[5])
+        self.assertEqual(Round.objects.filter(game=self.game, patterns__won=True).count(), 1)
+        entry = rounds.prize_rounds(self.game)[0]["patterns"][0]
+        self.assertEqual((entry["won"], entry["wonBy"]), (True, [5]))
+        self.assertEqual(rounds.round_data(self.game.id, 1)["patterns"][0], entry)
+        self.assertFalse(Game.objects.get(id=self.game.id).prize_rounds[0]["patterns"][0]["won"])
+
+
+class GameVersioningTests(TransactionTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(live, "_store", live.MemoryStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.creator = User.objects.create_user("creator@example.com", "pw", full_name="C", mobile_number="1", role="creator")
+        patterns = [
+            {"id": f"1.{i}", "patternName": name, "prizeAmount": "10", "won": False, "wonBy": None}
+            for i, name in enumerate(PATTERN_NAMES, start=1)
+        ]
+        self.game = Game.objects.create(
+            creator=self.creator, title="G", number_of_users=40, total_prize_pool=100, date_time=timezone.now(),
+            state="ongoing", prize_rounds=[{"id": "1", "called_numbers": [], "patterns": patterns}],
+        )
+        self.addCleanup(round_tickets.invalidate, self.game.id)
+        User.objects.bulk_create([
+            User(email=f"p{i}@example.com", full_name=f"P{i}", mobile_number="1", password="!") for i in range(40)
+        ])
+        rng = random.Random(7)
+        for user in User.objects.filter(email__startswith="p"):
+            PlayerGame.objects.create(player=user, game=self.game)
+            PlayerTicket.objects.create(player=user, game=self.game, round_id=1, ticket_data=make_ticket(rng))
+
+    def test_fifty_concurrent_writers_lose_nothing(self):
+        if connection.vendor == "sqlite" and connection.is_in_memory_db():
+            self.skipTest("in-memory SQLite turns concurrent writers away; run with --settings=backserver.test_settings")
+        upcoming = Game.objects.create(
+            creator=self.creator, title="U", number_of_users=10, total_prize_pool=10, date_time=timezone.now(),
+            prize_rounds=[{"patterns": [{"patternName": "early-five", "prizeAmount": "10"}]}],
+        )
+        handler = GameWinnerHandler()
+        live.draw(self.game.id, 1)  # start the round before the writers race
+        versions = {game.id: game.version for game in Game.objects.all()}
+
+        def draw_and_pay():
+            _, called = live.draw(self.game.id, 1)
+            handler.assign_winners(self.game.id, 1, len(called))
+
+        def post(game_id, state):
+            client = APIClient()
+            client.force_authenticate(self.creator)
+            return client.post(f"/api/creator/game/{game_id}/status/", {"status": state}, format="json").status_code
+
+        def edit(n):
+            client = APIClient()
+            client.force_authenticate(self.creator)
+            entry = {"patterns": [{"patternName": "early-five", "prizeAmount": "10"}]}
+            data = {
+                "title": "U", "description": f"edit {n}", "number_of_users": 10, "total_prize_pool": 10,
+                "date_time": "2025-01-01T00:00:00Z", "prize_rounds": [entry] * n,
+            }
+            return client.put(f"/api/creator/game/{upcoming.id}/update/", data, format="json").status_code
+
+        writers = (
+            [("draw", draw_and_pay) for _ in range(30)]
+            + [("status", lambda n=n: post(self.game.id, ("paused", "ongoing")[n % 2])) for n in range(10)]
+            + [("start", lambda: post(upcoming.id, "ongoing"))]
+            + [("edit", lambda n=n: edit(n)) for n in range(1, 10)]
+        )
+        random.Random(7).shuffle(writers)
+        with ThreadPoolExecutor(50) as pool:
+            results = list(pool.map(lambda writer: (writer[0], writer[1]()), writers))
+        statuses = [status for kind, status in results if kind in ("status", "start")]
+        edits = [status for kind, status in results if kind == "edit"]
+        self.assertEqual(statuses, [200] * 11)
+        self.assertTrue(set(edits) <= {200, 403, 409})
+
+        # The winner writes: every number drawn once, no pattern missed or paid twice
+        game = Game.objects.get(id=self.game.id)
+        called = live.called_numbers(self.game.id, 1)
+        self.assertEqual((len(called), len(set(called))), (31, 31))
+        self.assertEqual(handler.assign_winners(self.game.id, 1).get("winners", {}), {})
+        won = set(Pattern.objects.filter(round__game=game, won=True).values_list("pattern_id", flat=True))
+        self.assertEqual(set(RoundWise.objects.filter(game=game).values_list("pattern_id", flat=True)), won)
+        self.assertEqual(Payout.objects.filter(game=game).values("pattern_id").distinct().count(), len(won))
+        self.assertEqual(
+            sum(PlayerGame.objects.filter(game=game).values_list("won_amount", flat=True)),
+            sum(Payout.objects.filter(game=game).values_list("amount", flat=True)),
+        )
+        drift = counters.reconcile(Game.objects.filter(id=game.id), fix=False).get(game.id, {})
+        self.assertNotIn("winners_count", drift)
+        self.assertNotIn("prizes_distributed", drift)
+        self.assertEqual(game.version, versions[game.id] + 10)  # one bump per status change, none lost
+
+        # The edits and the start: the start is kept, and the rows match the last edit that went in
+        upcoming = Game.objects.get(id=upcoming.id)
+        self.assertEqual(upcoming.state, "ongoing")
+        self.assertEqual(upcoming.version, versions[upcoming.id] + 1 + edits.count(200))
+        self.assertEqual(upcoming.rounds.count(), len(upcoming.prize_rounds))
+        self.assertEqual(Pattern.objects.filter(round__game=upcoming).count(), len(upcoming.prize_rounds))
+        self.assertEqual(counters.reconcile(Game.objects.filter(id=upcoming.id), fix=False), {})
+
+    def test_a_stale_save_is_refused(self):
+        first = Game.objects.get(id=self.game.id)
+        second = Game.objects.get(id=self.game.id)
+        first.title = "first"
+        self.assertTrue(versioning.save_versioned(first, ["title"]))
+        second.title = "second"
+        self.assertFalse(versioning.save_versioned(second, ["title"]))
+        self.assertEqual(Game.objects.get(id=self.game.id).title, "first")
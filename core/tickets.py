@@ -0,0 +1,131 @@
+"""
+Housie ticket generation.
+
+A ticket is 3 rows x 9 columns with 5 numbers per row. Column 0 holds 1-9,
+columns 1-7 hold 10c-10c+9 and column 8 holds 80-90; every column has 1-3
+numbers, sorted downwards. A strip is 6 tickets that together hold each
+number 1-90 exactly once.
+
+Kept free of Django imports so it can run in worker processes.
+"""
+import hashlib
+import random
+
+COLUMNS = [range(1, 10)] + [range(10 * c, 10 * c + 10) for c in range(1, 8)] + [range(80, 91)]
+STRIP_SIZE = 6
+
+
+def _layout(counts, rng):
+    """
+    Which cells hold a number: 5 per row and counts[c] (1-3) in column c.
+    Columns are placed largest first into the rows with the most room left,
+    which always fits when the counts add up to 15.
+    """
+    grid = [[False] * 9 for _ in range(3)]
+    room = [5, 5, 5]
+    for c in sorted(range(9), key=lambda c: (-counts[c], rng.random())):
+        for r in sorted(range(3), key=lambda r: (-room[r], rng.random()))[:counts[c]]:
+            grid[r][c] = True
+            room[r] -= 1
+    return grid
+
+
+def _fill(grid, columns):
+    """Put each column's numbers into the grid's cells, ascending downwards."""
+    ticket = [[0] * 9 for _ in range(3)]
+    for c, numbers in enumerate(columns):
+        numbers = iter(sorted(numbers))
+        for r in range(3):
+            if grid[r][c]:
+                ticket[r][c] = next(numbers)
+    return ticket
+
+
+def random_ticket(rng=random):
+    """A single valid ticket."""
+    counts = [1] * 9
+    extra = 6
+    while extra:
+        c = rng.randrange(9)
+        if counts[c] < 3:
+            counts[c] += 1
+            extra -= 1
+    return _fill(_layout(counts, rng), [rng.sample(COLUMNS[c], counts[c]) for c in range(9)])
+
+
+def _strip_counts(rng):
+    """
+    Numbers per column for each ticket of a strip: every ticket gets one per
+    column, then each column's remaining numbers go to the tickets that
+    still need the most (at most 3 per column). Retries on a dead end.
+    """
+    while True:
+        counts = [[1] * 9 for _ in range(STRIP_SIZE)]
+        need = [15 - 9] * STRIP_SIZE
+        for c in sorted(range(9), key=lambda c: (-len(COLUMNS[c]), rng.random())):
+            for _ in range(len(COLUMNS[c]) - STRIP_SIZE):
+                options = [t for t in range(STRIP_SIZE) if need[t] and counts[t][c] < 3]
+                if not options:
+                    break
+                most = max(need[t] for t in options)
+                t = rng.choice([t for t in options if need[t] == most])
+                counts[t][c] += 1
+                need[t] -= 1
+            else:
+                continue
+            break
+        else:
+            return counts
+
+
+def random_strip(rng=random):
+    """Six valid tickets holding every number 1-90 exactly once."""
+    counts = _strip_counts(rng)
+    columns = [rng.sample(COLUMNS[c], len(COLUMNS[c])) for c in range(9)]
+    offsets = [0] * 9
+    strip = []
+    for t in range(STRIP_SIZE):
+        numbers = []
+        for c in range(9):
+            numbers.append(columns[c][offsets[c]:offsets[c] + counts[t][c]])
+            offsets[c] += counts[t][c]
+        strip.append(_fill(_layout(counts[t], rng), numbers))
+    return strip
+
+
+def is_valid_ticket(ticket):
+    if len(ticket) != 3 or any(len(row) != 9 for row in ticket):
+        return False
+    if any(sum(1 for n in row if n) != 5 for row in ticket):
+        return False
+    for c in range(9):
+        numbers = [ticket[r][c] for r in range(3) if ticket[r][c]]
+        if not numbers or any(n not in COLUMNS[c] for n in numbers) or numbers != sorted(set(numbers)):
+            return False
+    return True
+
+
+def is_valid_strip(strip):
+    return (
+        len(strip) == STRIP_SIZE
+        and all(is_valid_ticket(t) for t in strip)
+        and sorted(n for t in strip for row in t for n in row if n) == list(range(1, 91))
+    )
+
+
+def ticket_hash(ticket):
+    """Content hash of a ticket's cells, used to keep the pool free of duplicates."""
+    return hashlib.blake2b(bytes(n for row in ticket for n in row), digest_size=16).hexdigest()
+
+
+def generate_chunk(seed, count, strips=False):
+    """
+    `count` tickets (or `count` strips, 6 tickets each) from `seed`, as
+    [(hash, ticket)]. Runs in the generator's worker processes.
+    """
+    rng = random.Random(seed)
+    if strips:
+        tickets = [t for _ in range(count) for t in random_strip(rng)]
+    else:
+        tickets = [random_ticket(rng) for _ in range(count)]
+    return [(ticket_hash(t), t) for t in tickets]
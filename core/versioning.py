@@ -0,0 +1,54 @@
+"""
+Optimistic concurrency for Game rows.
+
+Winner settlement, creator edits and status changes all read a game, change
+some of its fields (prize_rounds above all) and write it back. Saving the
+whole row let the last writer silently undo the others; locking the row
+would serialize them all. Instead every Game carries a version:
+
+    - save_versioned() writes only the given fields, and only if the row is
+      still at the version that was read (compare-and-swap), bumping it.
+    - update_game() reads, applies a change and saves that way, re-reading
+      and re-applying the change on conflict, at most GAME_VERSION_ATTEMPTS
+      times, with a short random backoff in between.
+
+A change may run more than once, so it must be computed from the game it is
+given and nothing else it has changed before.
+"""
+import random
+import time
+
+from django.conf import settings
+from django.db.models import F
+
+from core.models import Game
+
+
+class VersionConflict(Exception):
+    """The game was changed by someone else since it was read."""
+
+
+def save_versioned(game, fields):
+    """Write `fields` of `game` if its row is still at game.version; returns False if it isn't."""
+    values = {field: getattr(game, field) for field in fields}
+    updated = Game.objects.filter(pk=game.pk, version=game.version).update(version=F("version") + 1, **values)
+    if updated:
+        game.version += 1
+    return bool(updated)
+
+
+def update_game(game_id, change, fields, attempts=None):
+    """
+    Apply `change(game)` to a fresh copy of the game and save `fields`,
+    retrying on conflict. Returns (game, change's result); raises
+    Game.DoesNotExist, or VersionConflict when every attempt lost a race.
+    """
+    attempts = attempts or settings.GAME_VERSION_ATTEMPTS
+    for attempt in range(attempts):
+        game = Game.objects.only("id", "version", *fields).get(pk=game_id)
+        result = change(game)
+        if save_versioned(game, fields):
+            return game, result
+        if attempt + 1 < attempts:
+            time.sleep(random.uniform(0, 0.002 * 2 ** attempt))
+    raise VersionConflict(f"Game {game_id} kept changing; gave up after {attempts} attempts")
@@ -0,0 +1,54 @@
+"""
+Materialized winners snapshot of a game.
+
+The check_winners socket action used to query RoundWise and each winner's
+name on every request. Instead, the whole reply is built once, serialized,
+and kept in the live store (core.live). It is rebuilt when
+GameWinnerHandler pays new winners, and otherwise served without touching
+the database.
+
+Every snapshot carries a version: a hash of its winners. A client that
+sends the version it already has gets a short "unchanged" reply instead of
+the full payload.
+"""
+import hashlib
+import json
+
+from core import live
+from core.models import RoundWise
+
+
+def build(game_id):
+    """(version, frame) for the game's winners, read from the database."""
+    all_winners = []
+    for round_entry in RoundWise.objects.filter(game_id=game_id).order_by("round_id", "id").prefetch_related("won_by"):
+        all_winners.append({
+            "round_id": round_entry.round_id,
+            "pattern_id": round_entry.pattern_id,
+            "pattern_name": round_entry.patternName,
+            "prize_amount": str(round_entry.prize_amount),
+            "winners": [{"player_id": user.id, "player_name": user.full_name} for user in round_entry.won_by.all()],
+        })
+    body = json.dumps(all_winners)
+    version = hashlib.blake2b(body.encode(), digest_size=8).hexdigest()
+    frame = '{"message": "All winners fetched", "version": "%s", "all_winners": %s}' % (version, body)
+    return version, frame.encode()
+
+
+def rebuild(game_id):
+    """Refresh the stored snapshot; call after new winners are committed."""
+    version, frame = build(game_id)
+    live.get_store().put_winners(int(game_id), version, frame)
+    return version, frame
+
+
+def snapshot(game_id):
+    """(version, frame bytes) of the game's winners, built from the database only when none is stored."""
+    stored = live.get_store().get_winners(int(game_id))
+    if stored is not None:
+        return stored
+    return rebuild(game_id)
+
+
+def unchanged_frame(version):
+    return json.dumps({"message": "Winners unchanged", "version": version})
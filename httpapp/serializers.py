@@ -1,6 +1,12 @@
+import logging
+
+from django.conf import settings
 from django.contrib.auth import authenticate
 from rest_framework import serializers
 from core.models import User,Game,PlayerGame
+from core.patterns import BUILTIN_SPECS, PATTERN_NAMES, PatternSpecError, get_pattern
+
+logger = logging.getLogger(__name__)
 #   creator
 class CreatorRegistrationSerializer(serializers.ModelSerializer):
     password = serializers.CharField(write_only=True, min_length=6)
@@ -105,6 +111,8 @@ class GameSerializer(serializers.ModelSerializer):
         - Add won=False and wonBy=None for each pattern
         - Add called_numbers=[] for each round
         - Validate no duplicate pattern names within a round
+        - Validate and compile each pattern (built-in name or custom 'spec');
+          unknown names are only logged unless STRICT_PATTERN_NAMES is on
         """
         processed_rounds = []
 
@@ -123,6 +131,29 @@ class GameSerializer(serializers.ModelSerializer):
                     )
                 seen_patterns.add(pattern_name)
 
+                # Built-in patterns go by name; anything else needs a declarative spec.
+                # Names without one are accepted as before (they never match) unless
+                # STRICT_PATTERN_NAMES is set
+                spec = pattern.get("spec")
+                if spec is None and pattern_name not in BUILTIN_SPECS:
+                    message = (
+                        f"Unknown pattern '{pattern_name}' in round {round_index}. "
+                        f"Use one of {', '.join(PATTERN_NAMES)} or provide a 'spec'."
+                    )
+                    if settings.STRICT_PATTERN_NAMES:
+                        raise serializers.ValidationError(message)
+                    logger.warning("%s It can never be won.", message)
+                if spec is not None and pattern_name in BUILTIN_SPECS:
+                    raise serializers.ValidationError(
+                        f"Pattern '{pattern_name}' in round {round_index} is built in and can't take a 'spec'."
+                    )
+                try:
+                    get_pattern(pattern_name, spec)
+                except PatternSpecError as e:
+                    raise serializers.ValidationError(
+                        f"Invalid spec for pattern '{pattern_name}' in round {round_index}: {e}"
+                    )
+
                 pattern["id"] = f"{round_index}.{pattern_index}"
                 pattern["won"] = pattern.get("won", False)
                 pattern["wonBy"] = pattern.get("wonBy", None)
@@ -147,3 +178,31 @@ class PlayerGameSerializer(serializers.ModelSerializer):
         model = PlayerGame
         fields = ['id', 'game', 'player', 'won_amount']
         read_only_fields = ['player', 'won_amount']
+
+
+class PrizeRoundSimulationSerializer(serializers.Serializer):
+    """Input for simulating one prize round before publishing a game."""
+    players = serializers.IntegerField(min_value=1, max_value=5000)
+    patterns = serializers.ListField(min_length=1)
+    simulations = serializers.IntegerField(min_value=100, max_value=200_000, default=100_000)
+    seed = serializers.IntegerField(min_value=0, required=False)
+
+    def validate_patterns(self, value):
+        """Same entries as a round's 'patterns' in prize_rounds (or bare built-in names)."""
+        patterns = []
+        for pattern in value:
+            if isinstance(pattern, str):
+                pattern = {"patternName": pattern}
+            if not isinstance(pattern, dict):
+                raise serializers.ValidationError("Each pattern must be a name or a {'patternName', 'spec'} object.")
+            name, spec = pattern.get("patternName"), pattern.get("spec")
+            if spec is None and name not in BUILTIN_SPECS:
+                raise serializers.ValidationError(
+                    f"Unknown pattern '{name}'. Use one of {', '.join(PATTERN_NAMES)} or provide a 'spec'."
+                )
+            try:
+                get_pattern(name, spec)
+            except PatternSpecError as e:
+                raise serializers.ValidationError(f"Invalid spec for pattern '{name}': {e}")
+            patterns.append({"patternName": name, "spec": spec})
+        return patterns
@@ -1,3 +1,246 @@
-from django.test import TestCase
+import io
+import threading
+import time
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+from unittest import mock
 
-# Create your tests here.
+from django.core.management import call_command
+from django.db import connection, connections
+from django.test import TestCase, TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
+from rest_framework.test import APIClient
+
+from core import live, rounds
+from core.models import Game, PlayerGame, PlayerTicket, RoundWise, Tickets, User
+from core.tickets import random_ticket
+from httpapp.serializers import GameSerializer
+
+
+def make_game(rounds=3):
+    creator = User.objects.create_user(
+        email="creator@example.com", password="secret1", full_name="Creator", mobile_number="0", role="creator"
+    )
+    return Game.objects.create(
+        creator=creator, title="Join test", number_of_users=1000, total_prize_pool=1000,
+        date_time="2025-01-01T00:00:00Z",
+        prize_rounds=[{"id": str(r), "called_numbers": [], "patterns": []} for r in range(1, rounds + 1)],
+    )
+
+
+def fill_pool(count):
+    Tickets.objects.bulk_create([Tickets(ticket_data=random_ticket()) for _ in range(count)])
+
+
+def make_players(count):
+    User.objects.bulk_create([
+        User(email=f"player{i}@example.com", full_name=f"Player {i}", mobile_number="0", password="!")
+        for i in range(count)
+    ])
+    return list(User.objects.filter(role="player").order_by("id"))
+
+
+def join(player, game):
+    client = APIClient()
+    client.force_authenticate(player)
+    return client.post("/api/player/games/assign/", {"game": game.id}, format="json")
+
+
+class PlayerGameAssignTests(TestCase):
+    def test_join_claims_one_ticket_per_round(self):
+        game = make_game(rounds=3)
+        fill_pool(5)
+        player = make_players(1)[0]
+
+        response = join(player, game)
+        self.assertEqual(response.status_code, 201)
+        self.assertEqual([t["round_id"] for t in response.data["assigned_tickets"]], [1, 2, 3])
+        self.assertEqual(Tickets.objects.filter(used=True).count(), 3)
+        self.assertEqual(Game.objects.get(id=game.id).players_count, 1)
+        claimed = list(Tickets.objects.filter(used=True).order_by("id").values_list("ticket_data", flat=True))
+        self.assertEqual(
+            list(PlayerTicket.objects.filter(game=game, player=player).order_by("round_id").values_list("ticket_data", flat=True)),
+            claimed,
+        )
+
+    def test_short_pool_rolls_the_join_back(self):
+        game = make_game(rounds=3)
+        fill_pool(2)
+        player = make_players(1)[0]
+
+        response = join(player, game)
+        self.assertEqual(response.status_code, 400)
+        self.assertFalse(Tickets.objects.filter(used=True).exists())
+        self.assertFalse(PlayerGame.objects.filter(game=game).exists())
+        self.assertFalse(PlayerTicket.objects.exists())
+        self.assertEqual(Game.objects.get(id=game.id).players_count, 0)
+
+
+def supports_concurrent_writes():
+    """SQLite only takes concurrent writers on a file database with IMMEDIATE transactions."""
+    if connection.vendor != "sqlite":
+        return True
+    settings = connection.settings_dict
+    return not connection.is_in_memory_db() and settings["OPTIONS"].get("transaction_mode") == "IMMEDIATE"
+
+
+class ConcurrentJoinTests(TransactionTestCase):
+    JOINS = 500
+    ROUNDS = 3
+    THREADS = 32
+
+    def test_concurrent_joins_get_unique_tickets(self):
+        if not supports_concurrent_writes():
+            raise unittest.SkipTest("needs PostgreSQL, or SQLite on a file with transaction_mode IMMEDIATE (backserver.test_settings)")
+        game = make_game(rounds=self.ROUNDS)
+        fill_pool(self.JOINS * self.ROUNDS + 10)
+        players = make_players(self.JOINS)
+        start = threading.Barrier(self.THREADS)
+
+        def run(chunk):
+            start.wait()
+            results = []
+            try:
+                for player in chunk:
+                    began = time.perf_counter()
+                    response = join(player, game)
+                    results.append((response.status_code, time.perf_counter() - began))
+            finally:
+                connections.close_all()
+            return results
+
+        chunks = [players[i::self.THREADS] for i in range(self.THREADS)]
+        with ThreadPoolExecutor(self.THREADS) as executor:
+            results = [r for chunk in executor.map(run, chunks) for r in chunk]
+
+        self.assertEqual([code for code, _ in results], [201] * self.JOINS)
+        tickets = list(PlayerTicket.objects.values_list("ticket_data", flat=True))
+        self.assertEqual(len(tickets), self.JOINS * self.ROUNDS)
+        self.assertEqual(len({str(t) for t in tickets}), len(tickets))
+        self.assertEqual(Tickets.objects.filter(used=True).count(), self.JOINS * self.ROUNDS)
+        self.assertEqual(Game.objects.get(id=game.id).players_count, self.JOINS)
+
+        # No join queues behind the others for long (SQLite serialises writers, so its tail is the widest)
+        latencies = sorted(elapsed for _, elapsed in results)
+        self.assertLess(latencies[len(latencies) // 2], 0.5)
+        self.assertLess(latencies[-1], 10.0)
+
+
+class GameCountersTests(TestCase):
+    def setUp(self):
+        self.game = make_game(rounds=2)
+        self.players = make_players(3)
+        fill_pool(10)
+
+    def list_games(self):
+        with CaptureQueriesContext(connection) as queries:
+            response = APIClient().get("/api/user/games/list/")
+        return response.data["games"], len(queries)
+
+    def test_lists_read_the_counters(self):
+        for player in self.players:
+            join(player, self.game)
+        games, one_game = self.list_games()
+        self.assertEqual((games[0]["players"], games[0]["rounds"]), (3, 2))
+
+        for title in ("b", "c", "d"):
+            Game.objects.create(
+                creator=self.game.creator, title=title, number_of_users=10, total_prize_pool=10,
+                date_time="2025-01-01T00:00:00Z", prize_rounds=[{"id": "1", "called_numbers": [], "patterns": []}],
+            )
+        games, four_games = self.list_games()
+        self.assertEqual(len(games), 4)
+        self.assertEqual(one_game, four_games)  # the page, and the paginator's count
+
+    def test_creator_stats_keep_prizes_distributed(self):
+        Game.objects.filter(id=self.game.id).update(state="completed", prizes_distributed=250)
+        client = APIClient()
+        client.force_authenticate(self.game.creator)
+        stats = client.get("/api/creator/games/").data["stats"]
+        # the pools of completed games, as before; what was paid out has a key of its own
+        self.assertEqual((stats["prizesDistributed"], stats["prizesPaidOut"]), ("1000.0", "250.0"))
+
+    def test_reconcile_fixes_drift(self):
+        PlayerGame.objects.bulk_create([PlayerGame(game=self.game, player=p) for p in self.players])  # no counters
+        with self.assertRaises(SystemExit):
+            call_command("reconcile_counters", "--check", stdout=io.StringIO())
+        self.assertEqual(Game.objects.get(id=self.game.id).players_count, 0)
+
+        out = io.StringIO()
+        call_command("reconcile_counters", stdout=out)
+        self.assertIn("players_count 0 -> 3", out.getvalue())
+        self.assertEqual(Game.objects.get(id=self.game.id).players_count, 3)
+        call_command("reconcile_counters", "--check", stdout=io.StringIO())  # nothing left to fix
+
+
+class PrizeRoundValidationTests(TestCase):
+    def game_data(self, pattern_name):
+        return {
+            "title": "G", "number_of_users": 10, "total_prize_pool": 10, "date_time": "2025-01-01T00:00:00Z",
+            "prize_rounds": [{"patterns": [{"patternName": pattern_name, "prizeAmount": "10"}]}],
+        }
+
+    def test_unknown_pattern_names_are_accepted_unless_strict(self):
+        with self.assertLogs("httpapp.serializers", "WARNING"):
+            self.assertTrue(GameSerializer(data=self.game_data("lucky-seven")).is_valid())
+        with override_settings(STRICT_PATTERN_NAMES=True):
+            serializer = GameSerializer(data=self.game_data("lucky-seven"))
+            self.assertFalse(serializer.is_valid())
+            self.assertIn("Unknown pattern 'lucky-seven'", str(serializer.errors))
+            self.assertTrue(GameSerializer(data=self.game_data("full-housie")).is_valid())
+
+
+class GameUpdateTests(TestCase):
+    @mock.patch.object(live, "_store", live.MemoryStore())
+    def test_a_game_set_back_to_upcoming_after_a_draw_cant_be_edited(self):
+        game = make_game(rounds=1)
+        client = APIClient()
+        client.force_authenticate(game.creator)
+        edit = {
+            "title": "Renamed", "number_of_users": 10, "total_prize_pool": 10, "date_time": "2025-01-01T00:00:00Z",
+            "prize_rounds": game.prize_rounds,
+        }
+        self.assertEqual(client.put(f"/api/creator/game/{game.id}/update/", edit, format="json").status_code, 200)
+
+        live.draw(game.id, 1)
+        response = client.put(f"/api/creator/game/{game.id}/update/", dict(edit, prize_rounds=[]), format="json")
+        self.assertEqual(response.status_code, 403)
+        self.assertEqual(game.rounds.count(), 1)
+
+
+class RoundViewTests(TestCase):
+    def setUp(self):
+        self.game = make_game(rounds=1)
+        patterns = [{"id": f"1.{i}", "patternName": "early-five", "prizeAmount": "10"} for i in range(1, 5)]
+        self.game.prize_rounds = [{"id": "1", "called_numbers": [], "patterns": patterns}]
+        self.game.save()
+        rounds.sync_rounds(self.game)
+        self.me, self.other = make_players(2)
+        PlayerTicket.objects.create(player=self.me, game=self.game, round_id=1, ticket_data=random_ticket())
+
+    def win(self, pattern_id, *players):
+        RoundWise.objects.create(game=self.game, round_id=1, pattern_id=pattern_id, patternName="early-five").won_by.set(players)
+
+    def get(self, user, url):
+        client = APIClient()
+        client.force_authenticate(user)
+        with CaptureQueriesContext(connection) as queries:
+            response = client.get(url)
+        return response.data, len(queries)
+
+    def test_winners_are_read_once_per_round(self):
+        player_url, creator_url = "/api/game/%d/round/1/" % self.game.id, "/api/creator/game/%d/round/1/" % self.game.id
+        self.win("1.1", self.other)
+        _, player_queries = self.get(self.me, player_url)
+        _, creator_queries = self.get(self.game.creator, creator_url)
+
+        self.win("1.2", self.me, self.other)
+        self.win("1.3", self.other, self.me)
+        data, queries = self.get(self.me, player_url)
+        self.assertEqual(queries, player_queries)
+        self.assertEqual([p["status"] for p in data["patterns"]], ["won_by_other", "won_by_you", "won_by_you", "pending"])
+        self.assertEqual(data["patterns"][0]["winner"], self.other.full_name)
+
+        data, queries = self.get(self.game.creator, creator_url)
+        self.assertEqual(queries, creator_queries)
+        self.assertEqual([len(p["winners"]) for p in data["patterns"]], [1, 2, 2, 0])
@@ -21,6 +21,7 @@ from .views import (
     GamesListView,
     CreatorGamesListView,
     PlayerHistoryView,
+    PrizeRoundSimulationView,
 )
 
 urlpatterns = [
@@ -29,6 +30,7 @@ urlpatterns = [
     path('player/register/', PlayerRegisterView.as_view(), name='player-register'),
     path('player/login/', PlayerLoginView.as_view(), name='player-login'),
     path('creator/games/create/', GameCreateView.as_view(), name='create-games'),  
+    path('creator/games/simulate/', PrizeRoundSimulationView.as_view(), name='simulate-prize-round'),
     path('player/games/assign/', PlayerGameAssignView.as_view(), name='assign-games'),
     path('games/listlatest/', LatestGamesView.as_view(), name='list-latest-games'),
     path("game/<int:game_id>/round/<int:round_id>/", PlayerRoundView.as_view(), name="player-round-view"),
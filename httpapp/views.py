@@ -1,7 +1,7 @@
 
 
 # Create your views here.
-from django.db.models import Sum
+from django.db.models import Q, Sum
 from django.utils.timezone import now
 # Create your views here.
 from django.db import transaction,models
@@ -9,9 +9,14 @@ from rest_framework.views import APIView
 from rest_framework.response import Response
 from rest_framework import status, generics, permissions
 from rest_framework.permissions import IsAuthenticated, AllowAny
-from .serializers import CreatorRegistrationSerializer, CreatorLoginSerializer, PlayerRegistrationSerializer, PlayerLoginSerializer,GameSerializer, PlayerGameSerializer
-from rest_framework_simplejwt.tokens import RefreshToken
-from core.models import PlayerGame, Game, Tickets, PlayerTicket,RoundWise
+from .serializers import CreatorRegistrationSerializer, CreatorLoginSerializer, PlayerRegistrationSerializer, PlayerLoginSerializer,GameSerializer, PlayerGameSerializer, PrizeRoundSimulationSerializer
+from core.models import PlayerGame, Game, Tickets, PlayerTicket,RoundWise, RoundDeck
+from core.cache import invalidate_round_tickets
+from core import counters, live, rounds, versioning
+from core.pool import claim_tickets
+from core.principals import GameRefreshToken
+from core.simulate import simulate_round
+from django.conf import settings
 
 
 #  creator
@@ -21,7 +26,7 @@ class CreatorRegisterView(APIView):
         serializer = CreatorRegistrationSerializer(data=request.data)
         if serializer.is_valid():
             creator = serializer.save()
-            refresh = RefreshToken.for_user(creator)
+            refresh = GameRefreshToken.for_user(creator)
             return Response({
                 "message": "Creator registered successfully",
                 "email": creator.email,
@@ -37,7 +42,7 @@ class CreatorLoginView(APIView):
         serializer = CreatorLoginSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.validated_data["user"]
-            refresh = RefreshToken.for_user(user)
+            refresh = GameRefreshToken.for_user(user)
             return Response({
                 "message": "Login successful",
                 "email": user.email,
@@ -56,7 +61,7 @@ class PlayerRegisterView(APIView):
         serializer = PlayerRegistrationSerializer(data=request.data)
         if serializer.is_valid():
             player = serializer.save()
-            refresh = RefreshToken.for_user(player)
+            refresh = GameRefreshToken.for_user(player)
             return Response({
                 "message": "Player registered successfully",
                 "email": player.email,
@@ -72,7 +77,7 @@ class PlayerLoginView(APIView):
         serializer = PlayerLoginSerializer(data=request.data)
         if serializer.is_valid():
             user = serializer.validated_data["user"]
-            refresh = RefreshToken.for_user(user)
+            refresh = GameRefreshToken.for_user(user)
             return Response({
                 "message": "Login successful",
                 "email": user.email,
@@ -109,6 +114,36 @@ class GameCreateView(APIView):
         
         return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
 
+class PrizeRoundSimulationView(APIView):
+    """
+    Simulates a prize round for the creator before the game is published:
+    for each pattern, the draw step it's typically won at and how many
+    players end up splitting its prize. Runs in the request, so the number of
+    simulations is cut down to what fits in SIMULATION_TIME_BUDGET seconds.
+    """
+    permission_classes = [IsAuthenticated]
+
+    def post(self, request):
+        if getattr(request.user, 'role', None) != 'creator':
+            return Response(
+                {'error': 'Only creators can access this endpoint'},
+                status=status.HTTP_403_FORBIDDEN
+            )
+        serializer = PrizeRoundSimulationSerializer(data=request.data)
+        if not serializer.is_valid():
+            return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
+
+        data = serializer.validated_data
+        result = simulate_round(
+            data["players"],
+            data["patterns"],
+            simulations=data["simulations"],
+            workers=settings.SIMULATION_WORKERS or None,
+            seed=data.get("seed"),
+            budget=settings.SIMULATION_TIME_BUDGET or None,
+        )
+        return Response(result, status=status.HTTP_200_OK)
+
 # player assignment 
 class PlayerGameAssignView(generics.CreateAPIView):
     serializer_class = PlayerGameSerializer
@@ -137,33 +172,30 @@ class PlayerGameAssignView(generics.CreateAPIView):
 
         # Create PlayerGame entry
         player_game = PlayerGame.objects.create(game=game, player=user)
+        counters.players_joined(game.id)
 
         # Get number of rounds from game
-        num_rounds = len(game.prize_rounds)
-
-        assigned_tickets = []
-
-        for round_number in range(1, num_rounds + 1):
-            # Pick one unused ticket
-            ticket = Tickets.objects.filter(used=False).first()
-            if not ticket:
-                return Response({'error': 'Not enough tickets available for all rounds'}, status=status.HTTP_400_BAD_REQUEST)
-
-            # Mark ticket as used
-            ticket.used = True
-            ticket.save()
-
-            # Create PlayerTicket for this round
-            player_ticket = PlayerTicket.objects.create(
-                player=user,
-                game=game,
-                round_id=round_number,
-                ticket_data=ticket.ticket_data
-            )
-            assigned_tickets.append({
-                'round_id': round_number,
-                'ticket_data': player_ticket.ticket_data
-            })
+        num_rounds = game.rounds_count
+
+        # Claim one unused ticket per round in a single statement
+        tickets = claim_tickets(num_rounds)
+        if len(tickets) < num_rounds:
+            transaction.set_rollback(True)  # give back the claimed tickets and the join
+            return Response({'error': 'Not enough tickets available for all rounds'}, status=status.HTTP_400_BAD_REQUEST)
+
+        PlayerTicket.objects.bulk_create([
+            PlayerTicket(player=user, game=game, round_id=round_number, ticket_data=ticket_data)
+            for round_number, ticket_data in enumerate(tickets, start=1)
+        ])
+        assigned_tickets = [
+            {'round_id': round_number, 'ticket_data': ticket_data}
+            for round_number, ticket_data in enumerate(tickets, start=1)
+        ]
+
+        # New tickets: cached rounds of this game must reload them
+        transaction.on_commit(
+            lambda: invalidate_round_tickets(game.id, range(1, num_rounds + 1))
+        )
 
         # Serialize player game
         serializer = self.get_serializer(player_game)
@@ -181,7 +213,7 @@ class LatestGamesView(APIView):
     """
     def get(self, request):
         # Get games ordered by creation date
-        games = Game.objects.order_by('-created_at')[:10]  # latest 10 games
+        games = Game.objects.select_related('creator').defer('prize_rounds').order_by('-created_at')[:10]  # latest 10 games
 
         data = []
         for g in games:
@@ -196,10 +228,10 @@ class LatestGamesView(APIView):
                     status_label = "completed"
 
             # Count rounds
-            rounds_count = len(g.prize_rounds or [])
+            rounds_count = g.rounds_count
 
-            # Get actual player count from PlayerGame relation
-            players_count = PlayerGame.objects.filter(game=g).count()
+            # Player count (kept on the game, see core.counters)
+            players_count = g.players_count
 
             data.append({
                 "id": g.id,
@@ -232,7 +264,7 @@ class CreatorGamesView(APIView):
             )
         
         # Get all games created by this user
-        games = Game.objects.filter(creator=user).order_by('-created_at')
+        games = Game.objects.filter(creator=user).defer('prize_rounds').order_by('-created_at')
 
         data = []
         for g in games:
@@ -240,10 +272,10 @@ class CreatorGamesView(APIView):
             status_label = g.state if hasattr(g, 'state') else 'upcoming'
 
             # Count rounds
-            rounds_count = len(g.prize_rounds or [])
+            rounds_count = g.rounds_count
 
-            # Get actual player count
-            players_count = PlayerGame.objects.filter(game=g).count()
+            # Player count (kept on the game, see core.counters)
+            players_count = g.players_count
 
             data.append({
                 "id": g.id,
@@ -265,6 +297,8 @@ class CreatorGamesView(APIView):
         
         # Calculate total prizes distributed (you might want to track this separately)
         total_prizes = sum(float(game['totalPrize']) for game in data if game['status'] == 'completed')
+        # What has actually been paid out to winners (kept on the game, see core.counters)
+        prizes_paid = sum(float(g.prizes_distributed) for g in games)
 
         return Response({
             "games": data,
@@ -272,6 +306,7 @@ class CreatorGamesView(APIView):
                 "totalGames": total_games,
                 "totalPlayers": total_players,
                 "prizesDistributed": str(total_prizes),
+                "prizesPaidOut": str(prizes_paid),
                 "upcomingGames": upcoming_games,
             }
         }, status=status.HTTP_200_OK)
@@ -298,33 +333,38 @@ class PlayerRoundView(APIView):
         except Game.DoesNotExist:
             return Response({"error": "Game not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        prize_rounds = game.prize_rounds
-        round_data = next((r for r in prize_rounds if str(r.get("id")) == str(round_id)), None)
+        round_row = rounds.get_round(game.id, round_id)
 
-        if not round_data:
+        if not round_row:
             return Response({"error": "Round not found."}, status=status.HTTP_404_NOT_FOUND)
 
         # ✅ 3. Process pattern details
+        # The round's winners in one go: RoundWise rows with their users prefetched
+        round_wise = {
+            rw.pattern_id: rw
+            for rw in RoundWise.objects.filter(game_id=game_id, round_id=round_id).prefetch_related("won_by")
+        }
         patterns_response = []
-        for pattern in round_data.get("patterns", []):
+        for pattern in (p.definition for p in round_row.patterns.all()):
             pattern_id = pattern.get("id")
             pattern_name = pattern.get("patternName")
             prize_amount = pattern.get("prizeAmount")
             prize_description = pattern.get("prizeDescription", "")
 
             # Find winner info in RoundWise
-            rw = RoundWise.objects.filter(game_id=game_id, round_id=round_id, pattern_id=pattern_id).first()
+            rw = round_wise.get(pattern_id)
+            winners = sorted(rw.won_by.all(), key=lambda winner: winner.pk) if rw else []
 
-            if not rw or rw.won_by.count() == 0:
+            if not winners:
                 status_text = "pending"
                 winner_name = None
             else:
-                if user in rw.won_by.all():
+                if any(winner.pk == user.pk for winner in winners):
                     status_text = "won_by_you"
                     winner_name = None
                 else:
                     status_text = "won_by_other"
-                    winner_name = rw.won_by.first().full_name
+                    winner_name = winners[0].full_name
 
             pattern_entry = {
                 "id": pattern_id,
@@ -438,6 +478,8 @@ class GameLobbyView(APIView):
                 status=status.HTTP_403_FORBIDDEN
             )
         
+        game_rounds = rounds.game_rounds(game.id, with_draw_counts=True)
+
         # Game basic info
         game_data = {
             "id": game.id,
@@ -446,39 +488,42 @@ class GameLobbyView(APIView):
             "dateTime": game.date_time.isoformat(),
             "organizer": game.creator.full_name,
             "totalPrizePool": str(game.total_prize_pool),
-            "totalRounds": len(game.prize_rounds or []),
+            "totalRounds": len(game_rounds),
             "status": game.state if hasattr(game, 'state') else 'upcoming',
             "maxPlayers": game.number_of_users,
-            "registeredPlayers": PlayerGame.objects.filter(game=game).count(),
+            "registeredPlayers": game.players_count,
             "isCreator": is_creator,
         }
         
-        # Build rounds data from prize_rounds JSON (round summary only)
+        # Build rounds data from the Round and Pattern rows (round summary only)
         rounds_data = []
-        prize_rounds = game.prize_rounds or []
-        
-        for round_data in prize_rounds:
-            round_id = round_data.get('id')
-            patterns = round_data.get('patterns', [])
-            called_numbers = round_data.get('called_numbers', [])
+        drawn = live.deck_cursors(game.id)
+        # Winners of every round in one query
+        winners_counts = dict(
+            RoundWise.objects.filter(game=game).order_by().values('round_id').annotate(
+                total_winners=models.Count('won_by', distinct=True)
+            ).values_list('round_id', 'total_winners')
+        )
+        
+        for round_row in game_rounds:
+            round_id = str(round_row.number)
+            patterns = [p.definition for p in round_row.patterns.all()]
+            called_count = drawn.get(round_row.number)
+            if called_count is None:
+                called_count = round_row.draw_count
             
             # Calculate total prize for this round
             total_prize = sum(float(p.get('prizeAmount', 0)) for p in patterns)
             
             # Count winners for this round
-            winners_count = RoundWise.objects.filter(
-                game=game,
-                round_id=round_id
-            ).aggregate(
-                total_winners=models.Count('won_by', distinct=True)
-            )['total_winners'] or 0
+            winners_count = winners_counts.get(round_row.number) or 0
             
             rounds_data.append({
                 "id": round_id,
                 "number": round_id,
                 "totalPatterns": len(patterns),
                 "totalPrize": str(total_prize),
-                "calledNumbers": len(called_numbers),
+                "calledNumbers": called_count,
                 "winnersCount": winners_count,
             })
         
@@ -541,7 +586,8 @@ class GameDetailView(APIView):
             'numberOfUsers': game.number_of_users,
             'dateTime': game.date_time.strftime('%Y-%m-%dT%H:%M'),  # Format for datetime-local input
             'totalPrizePool': str(game.total_prize_pool),
-            'prizeRounds': game.prize_rounds or [],
+            'prizeRounds': rounds.prize_rounds(game),
+            'version': game.version,  # send it back with the update to catch concurrent edits
         }, status=status.HTTP_200_OK)
 
 
@@ -570,7 +616,8 @@ class GameUpdateView(APIView):
                 {'error': 'Game not found or you do not have permission'},
                 status=status.HTTP_404_NOT_FOUND
             )
-        if game.state != "upcoming":
+        # A game set back to upcoming has been started if any round has a deck (core.deck)
+        if game.state != "upcoming" or RoundDeck.objects.filter(game=game).exists():
             return Response(
                 {'error':"Game can not be edited after it is started..."},
                 status=status.HTTP_403_FORBIDDEN
@@ -598,12 +645,30 @@ class GameUpdateView(APIView):
         game.total_prize_pool = float(total_prize_pool)
         game.date_time = date_time
         game.prize_rounds = prize_rounds
-        game.save()
+        if request.data.get('version') is not None:
+            try:
+                game.version = int(request.data['version'])  # the version the creator edited
+            except (TypeError, ValueError):
+                return Response({'error': 'Invalid version'}, status=status.HTTP_400_BAD_REQUEST)
+        # Only written if nobody changed the game since (e.g. started it); see core.versioning
+        with transaction.atomic():
+            saved = versioning.save_versioned(
+                game, ['title', 'description', 'number_of_users', 'total_prize_pool', 'date_time', 'prize_rounds']
+            )
+            if saved:
+                rounds.sync_rounds(game)
+        if not saved:
+            return Response(
+                {'error': 'Game was changed meanwhile, reload it and try again'},
+                status=status.HTTP_409_CONFLICT
+            )
+        live.evict_game(game.id)
         
         return Response({
             'message': 'Game updated successfully',
             'game_id': game.id,
             'title': game.title,
+            'version': game.version,
         }, status=status.HTTP_200_OK)
 
 class GameStatusUpdateView(APIView):
@@ -642,10 +707,17 @@ class GameStatusUpdateView(APIView):
                 status=status.HTTP_400_BAD_REQUEST
             )
         
-        # Update game status
-        old_status = game.state
-        game.state = new_status
-        game.save()
+        # Update game status; only the state is written, so concurrent winner writes are kept
+        def set_state(current):
+            old_status = current.state
+            current.state = new_status
+            return old_status
+        _, old_status = versioning.update_game(game.id, set_state, ['state'])
+        # Live draws pick up the new state; pausing or completing flushes their draw state first
+        live.set_game_state(game.id, new_status)
+
+        if new_status == 'completed':
+            invalidate_round_tickets(game.id, range(1, game.rounds_count + 1))
         
         return Response({
             'message': 'Game status updated successfully',
@@ -679,18 +751,23 @@ class CreatorRoundView(APIView):
                 status=status.HTTP_404_NOT_FOUND
             )
         
-        prize_rounds = game.prize_rounds or []
-        round_data = next((r for r in prize_rounds if str(r.get("id")) == str(round_id)), None)
+        round_row = rounds.get_round(game.id, round_id)
 
-        if not round_data:
+        if not round_row:
             return Response({"error": "Round not found."}, status=status.HTTP_404_NOT_FOUND)
 
-        # Get called numbers from round data
-        called_numbers = round_data.get("called_numbers", [])
+        # Get called numbers from the live round, or its Draw rows
+        called_numbers = live.called_numbers(game.id, round_id)
         
         # Get patterns for this round
-        patterns = round_data.get("patterns", [])
+        patterns = [p.definition for p in round_row.patterns.all()]
         
+        # Winners of the round's patterns, fetched once with their users
+        round_wise = {
+            rw.pattern_id: rw
+            for rw in RoundWise.objects.filter(game=game, round_id=round_id).prefetch_related('won_by')
+        }
+
         # Build patterns with winners
         patterns_response = []
         for pattern in patterns:
@@ -700,15 +777,9 @@ class CreatorRoundView(APIView):
             prize_description = pattern.get('prizeDescription', '')
             
             # Find winners for this pattern
-            round_wise = RoundWise.objects.filter(
-                game=game,
-                round_id=round_id,
-                pattern_id=pattern_id
-            ).prefetch_related('won_by').first()
-            
             winners = []
-            if round_wise and round_wise.won_by.exists():
-                for winner in round_wise.won_by.all():
+            if pattern_id in round_wise:
+                for winner in round_wise[pattern_id].won_by.all():
                     winners.append({
                         'id': winner.id,
                         'name': winner.full_name,
@@ -762,18 +833,18 @@ class PlayerGameDetailView(APIView):
         has_joined = PlayerGame.objects.filter(game=game, player=user).exists()
         
         # Get registered players count
-        registered_players = PlayerGame.objects.filter(game=game).count()
+        registered_players = game.players_count
         
         # Build rounds info
         rounds_info = []
-        prize_rounds = game.prize_rounds or []
-        for round_data in prize_rounds:
-            patterns = round_data.get('patterns', [])
+        game_rounds = rounds.game_rounds(game.id)
+        for round_row in game_rounds:
+            patterns = [p.definition for p in round_row.patterns.all()]
             total_prize = sum(float(p.get('prizeAmount', 0)) for p in patterns)
             
             rounds_info.append({
-                'id': round_data.get('id'),
-                'number': round_data.get('id'),
+                'id': str(round_row.number),
+                'number': str(round_row.number),
                 'totalPatterns': len(patterns),
                 'totalPrize': str(total_prize),
                 'patterns': [
@@ -796,7 +867,7 @@ class PlayerGameDetailView(APIView):
             'totalPrizePool': str(game.total_prize_pool),
             'maxPlayers': game.number_of_users,
             'registeredPlayers': registered_players,
-            'totalRounds': len(prize_rounds),
+            'totalRounds': len(game_rounds),
             'rounds': rounds_info,
             'hasJoined': has_joined,
             'canJoin': not has_joined and registered_players < game.number_of_users,
@@ -821,14 +892,15 @@ class PlayerDashboardView(APIView):
         # Get all games player has joined
         player_games = PlayerGame.objects.filter(player=user).select_related('game')
         
-        # Calculate stats
-        total_games_played = player_games.count()
-        total_winnings = player_games.aggregate(
-            total=Sum('won_amount')
-        )['total'] or 0
-        
-        # Get games won (where won_amount > 0)
-        games_won = player_games.filter(won_amount__gt=0).count()
+        # Calculate stats in one query over the won_amount totals (materialized from the payout ledger, see core.payouts)
+        stats = player_games.aggregate(
+            played=models.Count('id'),
+            total=Sum('won_amount'),
+            won=models.Count('id', filter=Q(won_amount__gt=0)),  # games won (where won_amount > 0)
+        )
+        total_games_played = stats['played']
+        total_winnings = stats['total'] or 0
+        games_won = stats['won']
         win_rate = (games_won / total_games_played * 100) if total_games_played > 0 else 0
         
         # Get upcoming games (games joined but not completed)
@@ -842,21 +914,21 @@ class PlayerDashboardView(APIView):
             player_games__player=user,
             state='upcoming',
             date_time__gt=now()
-        ).order_by('date_time').first()
+        ).defer('prize_rounds').order_by('date_time').first()
         
         # Get player's games list
         games_list = []
-        for pg in player_games.select_related('game').order_by('-joined_at')[:10]:
+        for pg in player_games.select_related('game__creator').defer('game__prize_rounds').order_by('-joined_at')[:10]:
             game = pg.game
             games_list.append({
                 'id': game.id,
                 'title': game.title,
                 'dateTime': game.date_time.isoformat(),
                 'status': game.state if hasattr(game, 'state') else 'upcoming',
-                'players': PlayerGame.objects.filter(game=game).count(),
+                'players': game.players_count,
                 'maxPlayers': game.number_of_users,
                 'totalPrize': str(game.total_prize_pool),
-                'rounds': len(game.prize_rounds or []),
+                'rounds': game.rounds_count,
                 'organizer': game.creator.full_name,
                 'wonAmount': str(pg.won_amount),
                 'hasJoined': True,
@@ -895,7 +967,7 @@ class GamesListView(APIView):
         status_filter = request.GET.get('status', '')  # Filter by status
         
         # Base queryset
-        games = Game.objects.all().select_related('creator').order_by('-created_at')
+        games = Game.objects.all().select_related('creator').defer('prize_rounds').order_by('-created_at')
         
         # Apply search filter
         if search:
@@ -920,11 +992,11 @@ class GamesListView(APIView):
         # Build response data
         games_data = []
         for game in paginated_games:
-            # Get player count
-            players_count = PlayerGame.objects.filter(game=game).count()
+            # Player count (kept on the game, see core.counters)
+            players_count = game.players_count
             
             # Count rounds
-            rounds_count = len(game.prize_rounds or [])
+            rounds_count = game.rounds_count
             
             games_data.append({
                 'id': game.id,
@@ -973,7 +1045,7 @@ class CreatorGamesListView(APIView):
         status_filter = request.GET.get('status', '')  # Filter by status
         
         # Base queryset
-        games = Game.objects.filter(creator=request.user).select_related('creator').order_by('-created_at')
+        games = Game.objects.filter(creator=request.user).select_related('creator').defer('prize_rounds').order_by('-created_at')
         
         # Apply search filter
         if search:
@@ -998,11 +1070,11 @@ class CreatorGamesListView(APIView):
         # Build response data
         games_data = []
         for game in paginated_games:
-            # Get player count
-            players_count = PlayerGame.objects.filter(game=game).count()
+            # Player count (kept on the game, see core.counters)
+            players_count = game.players_count
             
             # Count rounds
-            rounds_count = len(game.prize_rounds or [])
+            rounds_count = game.rounds_count
             
             games_data.append({
                 'id': game.id,
@@ -1057,7 +1129,7 @@ class PlayerHistoryView(APIView):
         # Get all games player has joined
         player_games = PlayerGame.objects.filter(
             player=user
-        ).select_related('game', 'game__creator').order_by('-joined_at')
+        ).select_related('game', 'game__creator').defer('game__prize_rounds').order_by('-joined_at')
         
         # Apply search filter
         if search:
@@ -1089,10 +1161,10 @@ class PlayerHistoryView(APIView):
                 'organizer': game.creator.full_name,
                 'dateTime': game.date_time.isoformat(),
                 'status': game.state if hasattr(game, 'state') else 'upcoming',
-                'prizeWon': str(pg.won_amount),
+                'prizeWon': str(pg.won_amount),  # materialized total of the player's payouts
                 'totalPrize': str(game.total_prize_pool),
                 'joinedAt': pg.joined_at.isoformat(),
-                'rounds': len(game.prize_rounds or []),
+                'rounds': game.rounds_count,
             })
         
         return Response({
@@ -0,0 +1,192 @@
+"""
+Server-side auto-caller.
+
+A creator can hand a round over to the server ({"action": "auto_call"} on
+the round's socket): from then on a number is drawn every `interval`
+seconds, whether or not the creator stays connected. The rounds being
+auto-called are registered in the live store (core.live), so every server
+process sees them.
+
+Each process runs one AutoCaller, as a task on the server's event loop, so
+its draws go through the same winner pipeline (wsapp.pipeline) as the
+creator's socket: a round's checks stay on one queue, in order, whoever
+draws. Every few seconds it takes (or renews) a lease on the registered
+rounds. A lease lasts AUTO_CALL_LEASE seconds, so
+exactly one process drives a round, and a round whose process died is
+picked up by another once the lease runs out.
+
+Draw times are kept on a hashed timer wheel advanced by a single task, so
+thousands of rounds cost one sleeping task, not one each. A draw only
+happens while the game is ongoing: pausing the game (GameStatusUpdateView)
+pauses its rounds, and they carry on when it is set back to ongoing. A
+round stops being called once all its patterns are won, its deck runs out
+or the game is completed. Winner checks run behind the draws (wsapp.pipeline),
+so the last winning number may be followed by one more draw before the
+caller sees the round is over.
+"""
+import asyncio
+import logging
+import math
+import os
+import socket
+import uuid
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from core import live
+from wsapp.consumers import announce_draw
+
+logger = logging.getLogger(__name__)
+
+
+class TimerWheel:
+    """
+    Hashed timer wheel. A timer due in n ticks goes into slot
+    (now + n) % len(slots) with n // len(slots) laps still to wait;
+    advance() moves one tick on and returns the keys that are due.
+    """
+
+    def __init__(self, slots=512):
+        self.slots = [{} for _ in range(slots)]
+        self.ticks = 0
+        self._where = {}  # key -> slot index
+
+    def __len__(self):
+        return len(self._where)
+
+    def __contains__(self, key):
+        return key in self._where
+
+    def schedule(self, key, ticks):
+        """(Re)schedule key to fire `ticks` ticks from now (at least one)."""
+        self.cancel(key)
+        ticks = max(1, int(ticks))
+        index = (self.ticks + ticks) % len(self.slots)
+        self.slots[index][key] = (ticks - 1) // len(self.slots)
+        self._where[key] = index
+
+    def cancel(self, key):
+        index = self._where.pop(key, None)
+        if index is not None:
+            del self.slots[index][key]
+
+    def advance(self):
+        self.ticks += 1
+        slot = self.slots[self.ticks % len(self.slots)]
+        due = [key for key, laps in slot.items() if laps == 0]
+        for key in due:
+            del slot[key]
+            del self._where[key]
+        for key in slot:
+            slot[key] -= 1
+        return due
+
+
+class AutoCaller:
+    def __init__(self, channel_layer=None, tick=None, lease=None, owner=None):
+        self.channel_layer = channel_layer or get_channel_layer()
+        self.tick = tick or settings.AUTO_CALL_TICK
+        self.lease = lease or settings.AUTO_CALL_LEASE
+        self.owner = owner or f"{socket.gethostname()}:{os.getpid()}:{uuid.uuid4().hex[:8]}"
+        self.wheel = TimerWheel()
+        self.rounds = {}  # (game_id, round_id) -> interval, for rounds this process holds
+        self.running = set()  # draws in flight
+
+    def ticks(self, seconds):
+        return math.ceil(seconds / self.tick)
+
+    # -----------------------
+    # Leases
+    # -----------------------
+
+    async def sync(self):
+        """Pick up newly registered rounds, renew leases and drop rounds that were stopped or lost."""
+        wanted = await database_sync_to_async(live.autocall_rounds)()
+        held = set(await database_sync_to_async(live.take_leases)(wanted, self.owner, self.lease))
+        for key in list(self.rounds):
+            if key not in held:
+                self.drop(key)
+        for key in held:
+            if key not in self.rounds:
+                self.wheel.schedule(key, self.ticks(wanted[key]))
+            self.rounds[key] = wanted[key]
+
+    def drop(self, key):
+        self.rounds.pop(key, None)
+        self.wheel.cancel(key)
+
+    async def stop_round(self, key):
+        """The round is over: stop calling it and let go of its lease."""
+        self.drop(key)
+        await database_sync_to_async(live.set_autocall)(*key, None)
+        await database_sync_to_async(live.release_lease)(key, self.owner)
+
+    # -----------------------
+    # Draws
+    # -----------------------
+
+    async def all_won(self, key):
+        """Whether the round has patterns and every one of them has been won (claimed in the live store)."""
+        state = await database_sync_to_async(live.round_state)(*key)
+        return state is not None and bool(state.patterns) and not state.open_patterns()
+
+    async def fire(self, key):
+        game_id, round_id = key
+        try:
+            info = await database_sync_to_async(live.game_info)(game_id)
+            if info is None or info["state"] == "completed":
+                await self.stop_round(key)
+                return
+            if info["state"] == "ongoing":
+                if await self.all_won(key):
+                    await self.stop_round(key)
+                    return
+                result = await announce_draw(self.channel_layer, game_id, round_id)
+                if not result["r"] and result["number"] in (-2, -3):
+                    await self.stop_round(key)  # deck ran out / no such round
+                    return
+                if await self.all_won(key):  # winners checked inline (no pipeline) are in already
+                    await self.stop_round(key)
+                    return
+        except Exception:
+            logger.exception("Auto-calling game %s round %s failed; will retry", game_id, round_id)
+        finally:
+            self.running.discard(key)
+        if key in self.rounds:
+            self.wheel.schedule(key, self.ticks(self.rounds[key]))
+
+    def advance(self):
+        for key in self.wheel.advance():
+            if key in self.rounds and key not in self.running:
+                self.running.add(key)
+                asyncio.ensure_future(self.fire(key))
+
+    async def run(self):
+        loop = asyncio.get_running_loop()
+        started = loop.time()
+        next_sync = started
+        while True:
+            now = loop.time()
+            if now >= next_sync:
+                try:
+                    await self.sync()
+                except Exception:
+                    logger.exception("Auto-caller lease sync failed; will retry")
+                next_sync = now + self.lease / 3
+            # catch up on ticks missed while the loop was busy
+            for _ in range(int((loop.time() - started) / self.tick) - self.wheel.ticks):
+                self.advance()
+            await asyncio.sleep(self.tick - (loop.time() - started) % self.tick)
+
+
+_caller_task = None
+
+
+def start_auto_caller():
+    """Run this process's AutoCaller as a task on the running event loop, the server's (once)."""
+    global _caller_task
+    if _caller_task is None:
+        _caller_task = asyncio.ensure_future(AutoCaller().run())
+    return _caller_task
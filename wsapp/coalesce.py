@@ -0,0 +1,104 @@
+"""
+Coalescing a room's broadcasts.
+
+With WS_COALESCE_WINDOW_MS set, the client-facing group messages of a room
+(number_generated, winner_announced) are held back for up to that many
+milliseconds after the first of them. Whatever piled up meanwhile goes out
+as one events_batch group message, so each socket gets one channel-layer
+message and one {"type": "batch", "events": [...]} frame instead of one
+per event (?protocol=full clients still get their frames one by one).
+
+    - Order: a room's events keep the order they were sent in, within a
+      batch and across batches.
+    - Latency: no event waits longer than the window; a room with
+      WS_COALESCE_MAX_EVENTS pending is sent right away.
+
+One coalescer per event loop. WS_COALESCE_WINDOW_MS = 0 (the default)
+sends every event as it comes.
+"""
+import asyncio
+import weakref
+
+from django.conf import settings
+
+_coalescers = weakref.WeakKeyDictionary()  # event loop -> RoomCoalescer
+
+
+def batch_event(events):
+    """One group message for `events`, which are already encoded (see wsapp.consumers.number_event)."""
+    if len(events) == 1:
+        return events[0]
+    return {
+        "type": "events_batch",
+        "frame": '{"type": "batch", "events": [' + ", ".join(e["frame"] for e in events) + "]}",
+        "full_frames": [e.get("full_frame", e["frame"]) for e in events],
+        # only draws: a lagging client may skip the batch for a snapshot (wsapp.outbox)
+        "draws_only": all(e["type"] == "number_generated" for e in events),
+    }
+
+
+class RoomCoalescer:
+    def __init__(self, channel_layer, window, max_events):
+        self.channel_layer = channel_layer
+        self.window = window
+        self.max_events = max_events
+        self.pending = {}  # group -> [event]
+        self.timers = {}  # group -> TimerHandle of its pending batch
+        self.locks = {}  # group -> (asyncio.Lock, batches waiting on it)
+
+    async def send(self, group, event):
+        pending = self.pending.setdefault(group, [])
+        pending.append(event)
+        if len(pending) == 1:
+            self.timers[group] = asyncio.get_running_loop().call_later(self.window, self._expire, group)
+        elif len(pending) >= self.max_events:
+            await self.flush(group)
+
+    def _expire(self, group):
+        self.timers.pop(group, None)
+        asyncio.ensure_future(self.flush(group))
+
+    async def flush(self, group):
+        """Send the room's pending events now."""
+        timer = self.timers.pop(group, None)
+        if timer is not None:
+            timer.cancel()
+        events = self.pending.pop(group, None)
+        if not events:
+            return
+        # batches of a room are sent one at a time, in the order they were cut
+        lock, waiting = self.locks.get(group) or (asyncio.Lock(), 0)
+        self.locks[group] = (lock, waiting + 1)
+        try:
+            async with lock:
+                await self.channel_layer.group_send(group, batch_event(events))
+        finally:
+            lock, waiting = self.locks[group]
+            if waiting == 1:
+                del self.locks[group]
+            else:
+                self.locks[group] = (lock, waiting - 1)
+
+    async def flush_all(self):
+        for group in list(self.pending):
+            await self.flush(group)
+
+
+async def broadcast(channel_layer, group, event):
+    """group_send a client-facing event, through the running loop's coalescer when a window is set."""
+    window = settings.WS_COALESCE_WINDOW_MS
+    if window <= 0:
+        await channel_layer.group_send(group, event)
+        return
+    loop = asyncio.get_running_loop()
+    coalescer = _coalescers.get(loop)
+    if coalescer is None:
+        coalescer = _coalescers[loop] = RoomCoalescer(channel_layer, window / 1000, settings.WS_COALESCE_MAX_EVENTS)
+    await coalescer.send(group, event)
+
+
+async def flush_all():
+    """Send everything the running loop's coalescer holds (tests, shutdown)."""
+    coalescer = _coalescers.get(asyncio.get_running_loop())
+    if coalescer is not None:
+        await coalescer.flush_all()
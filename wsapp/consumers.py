@@ -1,16 +1,132 @@
 import json
-import random
+from urllib.parse import parse_qs
+from django.conf import settings
 from channels.generic.websocket import AsyncWebsocketConsumer
 from channels.db import database_sync_to_async
-from core.models import Game, RoundWise
 from core.ops import GameWinnerHandler
+from core import live
+from core import winners as winners_snapshot
+from wsapp.coalesce import broadcast
+from wsapp.outbox import SLOW_CLIENT_CLOSE_CODE, Outbox, server_backlog
+
+# Clients that still expect the full called_numbers list with every draw
+# connect with ?protocol=full; everyone else gets {seq, number} deltas.
+FULL_LIST_PROTOCOL = "full"
+
+
+def room_group_name(game_id, round_id):
+    return f'game_{game_id}_round_{round_id}'
+
+
+def number_event(number, called_numbers):
+    """
+    The group message for a draw. Both text frames are encoded here, once
+    per draw, and consumers forward the one their client speaks unchanged.
+    """
+    return {
+        "type": "number_generated",
+        "frame": json.dumps({"type": "number", "seq": len(called_numbers), "number": number}),
+        "full_frame": json.dumps({"number": number, "called_numbers": called_numbers}),
+    }
+
+
+def winner_event(winners_payload):
+    """The group message announcing winners, with its text frame encoded once."""
+    return {"type": "winner_announced", "frame": json.dumps({"winners": winners_payload})}
+
+
+async def generate_number(game_id, round_id):
+    """Draw the next number from the round's live state (core.live); no database round-trip once loaded"""
+    info = await database_sync_to_async(live.game_info)(game_id)
+    if not info or info["state"] != 'ongoing':
+        return {'r':False,"number": -1 }  # Game not found / not ongoing
+
+    round_index = int(round_id) - 1
+    if round_index < 0 or round_index >= info["rounds"]:
+        return {'r':False,"number": -3 }  # Invalid round
+
+    number, called_numbers = await database_sync_to_async(live.draw)(game_id, round_id)
+    if number is None:
+        return {'r':False,"number": -2 }  # All numbers already called
+
+    return {'r':True,"number": number, "called_numbers": called_numbers}
+
+
+async def announce_draw(channel_layer, game_id, round_id):
+    """
+    Draw the next number, broadcast it to the round's room and have its
+    winners checked (see wsapp.pipeline). Used by the creator's socket and
+    by the auto-caller. Returns generate_number's result.
+    """
+    from wsapp.pipeline import winner_pipeline
+
+    result = await generate_number(game_id, round_id)
+    if not result['r']:
+        return result
+
+    seq = len(result["called_numbers"])
+    group = room_group_name(game_id, round_id)
+    # Broadcast new number to all players in the same room
+    await broadcast(channel_layer, group, number_event(result["number"], result["called_numbers"]))
+
+    # ✅ Check winners in the background; the draw returns without waiting for them
+    pipeline = winner_pipeline(channel_layer)
+    if pipeline is not None:
+        await pipeline.submit(game_id, round_id, seq)
+        return result
+
+    handler = GameWinnerHandler()
+    winner_result = await handler.check_and_assign_winners(game_id, round_id, seq)
+
+    # ✅ If someone won, broadcast to all players
+    if "winners" in winner_result and winner_result["winners"]:
+        broadcast_payload = await _prepare_winner_payload(winner_result)
+        await broadcast(channel_layer, group, winner_event(broadcast_payload))
+    return result
+
+
+async def _prepare_winner_payload(winner_result):
+    """
+    Convert backend winner data into clean frontend payload.
+    Fully async-safe.
+    """
+    winners_payload = []
+
+    for pattern_id, winlist in winner_result["winners"].items():
+        if not winlist:
+            continue
+
+        pattern_name = winlist[0]["pattern"]["patternName"]
+
+        winners_data = []
+        for entry in winlist:
+            player_game = entry["player"]  # PlayerGame, loaded with its user
+            winners_data.append({
+                "player_id": player_game.player_id,
+                "player_name": player_game.player.full_name,
+                "amount": str(entry["amount"])
+            })
+
+        winners_payload.append({
+            "pattern_id": pattern_id,
+            "pattern_name": pattern_name,
+            "winners": winners_data
+        })
+
+    return winners_payload
+
 
 class GameConsumer(AsyncWebsocketConsumer):
+    # Frames to the client are queued here once it is accepted (see wsapp.outbox)
+    outbox = None
+
     async def connect(self):
         """Join game+round specific room"""
         self.game_id = self.scope['url_route']['kwargs']['game_id']
         self.round_id = self.scope['url_route']['kwargs']['round_id']
-        self.room_group_name = f'game_{self.game_id}_round_{self.round_id}'
+        self.room_group_name = room_group_name(self.game_id, self.round_id)
+        query = parse_qs(self.scope.get("query_string", b"").decode())
+        self.full_list = query.get("protocol", [None])[0] == FULL_LIST_PROTOCOL
 
         # Only accept if user is authenticated
         user = self.scope.get("user")
@@ -24,6 +140,12 @@ class GameConsumer(AsyncWebsocketConsumer):
         )
 
         await self.accept()
+        if settings.WS_OUTBOX_SIZE > 0:
+            self.outbox = Outbox(
+                self.send_now, self.resync_frame, lambda: self.close(code=SLOW_CLIENT_CLOSE_CODE),
+                settings.WS_OUTBOX_SIZE, settings.WS_SLOW_CLIENT_MAX_RESYNCS, settings.WS_SLOW_CLIENT_WINDOW,
+                server_backlog(self.base_send), settings.WS_OUTBOX_MAX_BACKLOG,
+            )
 
         # Optional: send welcome
         await self.send(text_data=json.dumps({
@@ -31,8 +153,14 @@ class GameConsumer(AsyncWebsocketConsumer):
             "role": getattr(user, "role", "unknown")
         }))
 
+        # Delta clients start from a snapshot; every draw after it is seq + 1
+        if not self.full_list:
+            await self.send_snapshot()
+
     async def disconnect(self, close_code):
         """Leave the game+round group"""
+        if self.outbox is not None:
+            self.outbox.close()
         await self.channel_layer.group_discard(
             self.room_group_name,
             self.channel_name
@@ -52,34 +180,8 @@ class GameConsumer(AsyncWebsocketConsumer):
                     await self.send(json.dumps({"error": "Only creator can generate numbers"}))
                     return
 
-                result = await self.generate_number()
-                if result['r']:
-                    # Broadcast new number to all players in the same room
-                    await self.channel_layer.group_send(
-                        self.room_group_name,
-                        {
-                            "type": "number_generated",
-                            "number": result["number"],
-                            "called_numbers": result["called_numbers"],
-                        },
-                    )
-                    
-                    # ✅ Check winners right after number generation
-                    handler = GameWinnerHandler()
-                    winner_result = await handler.check_and_assign_winners(self.game_id, self.round_id)
-                    
-                    # ✅ If someone won, broadcast to all players
-                    if "winners" in winner_result and winner_result["winners"]:
-                        # 🔥 AWAIT the coroutine here!
-                        broadcast_payload = await self._prepare_winner_payload(winner_result)
-                        await self.channel_layer.group_send(
-                            self.room_group_name,
-                            {
-                                "type": "winner_announced",
-                                "winners": broadcast_payload
-                            }
-                        )
-                else:
+                result = await announce_draw(self.channel_layer, self.game_id, self.round_id)
+                if not result['r']:
                     if result['number'] == -1:
                         await self.send(json.dumps({"error": "Game is not ongoing"}))
                     elif result['number'] == -2:
@@ -87,6 +189,21 @@ class GameConsumer(AsyncWebsocketConsumer):
                     elif result['number'] == -3:
                         await self.send(json.dumps({"error": "Invalid round"}))
 
+            elif action in ("auto_call", "stop_auto_call"):
+                # 🔒 Only creator can start or stop the server-side caller
+                if getattr(user, "role", None) != "creator":
+                    await self.send(json.dumps({"error": "Only creator can control auto-calling"}))
+                    return
+
+                interval = None
+                if action == "auto_call":
+                    interval = max(
+                        float(text_data_json.get("interval") or settings.AUTO_CALL_INTERVAL),
+                        settings.AUTO_CALL_MIN_INTERVAL,
+                    )
+                await database_sync_to_async(live.set_autocall)(self.game_id, self.round_id, interval)
+                await self.send(json.dumps({"auto_call": interval}))
+
             elif action == "get_called_numbers":
                 # Player or creator can request current state
                 called_numbers = await self.get_called_numbers()
@@ -94,145 +211,79 @@ class GameConsumer(AsyncWebsocketConsumer):
                     "called_numbers": called_numbers
                 }))
 
+            elif action == "resync":
+                # Delta client saw a gap in seq: send the whole round again
+                await self.send_snapshot()
+
             elif action == "check_winners":
                 """
-                Return all winners of the current game across all rounds.
+                Return all winners of the current game across all rounds,
+                from the game's winners snapshot (core.winners). A client
+                that sends the version it has gets a short reply when
+                nothing changed.
                 """
-                # Fetch all RoundWise entries for this game
-                all_rounds = await database_sync_to_async(
-                    lambda: list(RoundWise.objects.filter(game_id=self.game_id).prefetch_related('won_by'))
-                )()
-
-                all_winners_payload = []
-
-                for round_entry in all_rounds:
-                    winners_list = []
-                    for user in round_entry.won_by.all():
-                        user_name = await database_sync_to_async(lambda: getattr(user, "full_name", str(user)))()
-                        winners_list.append({
-                            "player_id": user.id,
-                            "player_name": user_name
-                        })
-
-                    all_winners_payload.append({
-                        "round_id": round_entry.round_id,
-                        "pattern_id": round_entry.pattern_id,
-                        "pattern_name": getattr(round_entry, "patternName", ""),
-                        "prize_amount": str(getattr(round_entry, "prize_amount", "0.00")),
-                        "winners": winners_list
-                    })
-
-                # Send all winners to requesting client
-                await self.send(text_data=json.dumps({
-                    "message": "All winners fetched",
-                    "all_winners": all_winners_payload
-                }))
+                version, frame = await database_sync_to_async(winners_snapshot.snapshot)(self.game_id)
+                if text_data_json.get("version") == version:
+                    await self.send(text_data=winners_snapshot.unchanged_frame(version))
+                else:
+                    await self.send(text_data=frame.decode())
 
         except json.JSONDecodeError:
             await self.send(json.dumps({"error": "Invalid JSON"}))
         except Exception as e:
             await self.send(json.dumps({"error": str(e)}))
 
+    async def send(self, text_data=None, bytes_data=None, close=False):
+        """Text frames wait their turn in the outbox, when there is one"""
+        if self.outbox is not None and text_data is not None and not close:
+            self.outbox.put((text_data,))
+            return
+        await super().send(text_data=text_data, bytes_data=bytes_data, close=close)
+
+    async def send_now(self, text):
+        """What the outbox sends with; everything else goes through send()"""
+        await super().send(text_data=text)
+
+    async def send_room(self, frames, draws_only):
+        """Room frames; a lagging client's draws may be skipped for one resync frame (wsapp.outbox)"""
+        if self.outbox is not None:
+            self.outbox.put(frames, droppable=draws_only)
+            return
+        for frame in frames:
+            await self.send(text_data=frame)
+
     async def number_generated(self, event):
-        """Send updated number and list to all group members"""
-        await self.send(text_data=json.dumps({
-            "number": event["number"],
-            "called_numbers": event["called_numbers"],
-        }))
+        """Forward the new number: {seq, number}, or the full list to ?protocol=full clients (see number_event)"""
+        await self.send_room((event["full_frame"] if self.full_list else event["frame"],), True)
 
     async def winner_announced(self, event):
-        """Broadcast winner announcement to all players"""
-        await self.send(text_data=json.dumps({
-            "winners": event["winners"]
-        }))
+        """Forward the winner announcement, encoded once by the sender"""
+        await self.send_room((event["frame"],), False)
+
+    async def events_batch(self, event):
+        """Several coalesced room events (wsapp.coalesce): one batch frame, or each frame in turn for ?protocol=full clients"""
+        frames = event["full_frames"] if self.full_list else (event["frame"],)
+        await self.send_room(tuple(frames), event.get("draws_only", False))
 
     # -----------------------
     # Utility functions
     # -----------------------
 
-    @database_sync_to_async
-    def get_game(self):
-        try:
-            return Game.objects.get(id=self.game_id)
-        except Game.DoesNotExist:
-            return None
-
-    async def generate_number(self):
-        """Generate a random number 1–90 that is not already called"""
-        game = await self.get_game()
-        if not game:
-            return {'r':False,"number": -1 }  # Game not found
-        if game.state != 'ongoing':
-            return {'r':False,"number": -2 }  # Game not ongoing
-
-        prize_rounds = game.prize_rounds
-        round_index = int(self.round_id) - 1
-        if round_index < 0 or round_index >= len(prize_rounds):
-            return {'r':False,"number": -3 }  # Invalid round
-
-        round_data = prize_rounds[round_index]
-        called_numbers = round_data.get("called_numbers", [])
-
-        available_numbers = [n for n in range(1, 91) if n not in called_numbers]
-        if not available_numbers:
-            return None
-
-        number = random.choice(available_numbers)
-        called_numbers.append(number)
-        round_data["called_numbers"] = called_numbers
-        prize_rounds[round_index] = round_data
-
-        # Save to DB
-        game.prize_rounds = prize_rounds
-        await database_sync_to_async(game.save)()
-
-        return {'r':True,"number": number, "called_numbers": called_numbers}
+    async def send_snapshot(self):
+        """Full state for a delta client; seq is the number of draws so far"""
+        await self.send(text_data=await self.resync_frame())
+
+    async def resync_frame(self):
+        """The round so far: a snapshot, or the get_called_numbers reply for ?protocol=full clients"""
+        called_numbers = await self.get_called_numbers()
+        if self.full_list:
+            return json.dumps({"called_numbers": called_numbers})
+        return json.dumps({
+            "type": "snapshot",
+            "seq": len(called_numbers),
+            "called_numbers": called_numbers,
+        })
 
     async def get_called_numbers(self):
         """Fetch existing called numbers without generating new one"""
-        game = await self.get_game()
-        if not game:
-            return []
-
-        prize_rounds = game.prize_rounds
-        round_index = int(self.round_id) - 1
-        if round_index < 0 or round_index >= len(prize_rounds):
-            return []
-
-        return prize_rounds[round_index].get("called_numbers", [])
-
-    async def _prepare_winner_payload(self, winner_result):
-        """
-        Convert backend winner data into clean frontend payload.
-        Fully async-safe.
-        """
-        winners_payload = []
-
-        for pattern_id, winlist in winner_result["winners"].items():
-            if not winlist:
-                continue
-
-            pattern_name = winlist[0]["pattern"]["patternName"]
-
-            winners_data = []
-            for entry in winlist:
-                player_obj = entry["player"]
-
-                # Async-safe access to player name
-                player_name = await database_sync_to_async(
-                    lambda: getattr(player_obj, "full_name", str(player_obj))
-                )()
-
-                winners_data.append({
-                    "player_id": player_obj.id,
-                    "player_name": player_name,
-                    "amount": str(entry["amount"])
-                })
-
-            winners_payload.append({
-                "pattern_id": pattern_id,
-                "pattern_name": pattern_name,
-                "winners": winners_data
-            })
-
-        return winners_payload
\ No newline at end of file
+        return await database_sync_to_async(live.called_numbers)(self.game_id, self.round_id)
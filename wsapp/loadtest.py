@@ -0,0 +1,251 @@
+"""
+WebSocket load generator for GameConsumer.
+
+Simulates a creator and N players in one process, talking straight to the
+websocket ASGI app (JWTAuthMiddleware + the wsapp routes, as in
+backserver.asgi) through the configured channel layer: InMemoryChannelLayer
+with backserver.bench_settings, or the Redis layer of the normal settings.
+Each simulated socket runs the app as a task of its own fed from an
+asyncio.Queue (its receive), and its send is a plain callback that
+timestamps frames as they come out, with no websocket server or framing in
+between.
+
+The creator draws `draws` numbers, one every `interval` seconds, over its
+own socket, exactly as a browser would. Reported:
+    - connect: from the websocket.connect message until the player holds
+      its first frame after the welcome (the snapshot, or for ?protocol=full
+      clients the welcome itself);
+    - latency: from the creator sending generate_number until a player
+      receives that draw, over every player and draw;
+    - messages/sec: frames delivered to players while the draws ran;
+    - RSS per connection: growth of the process's resident memory while the
+      players connected, divided by their number.
+
+InMemoryChannelLayer scans all its channels on every receive, so past a few
+thousand players it, not the consumer, sets the numbers; point
+BENCH_REDIS_URL at a local Redis for those runs. Client and server share the
+process, so the figures include the clients'
+own (small) cost; they are for comparing builds and settings on one
+machine, not absolute capacity.
+"""
+import asyncio
+import json
+import os
+import random
+import resource
+import time
+
+from channels.routing import URLRouter
+
+from core import counters
+from core.bench import percentiles
+from core.middleware.jwt_auth_middleware import JWTAuthMiddleware
+from core.models import Game, PlayerGame, PlayerTicket, User
+from core.principals import GameRefreshToken, principals
+from core.tickets import random_ticket
+from wsapp.routing import websocket_urlpatterns
+
+ROUND_ID = 1
+
+
+def rss_bytes():
+    """Current resident set size (peak size where /proc isn't available)."""
+    try:
+        with open("/proc/self/statm") as f:
+            return int(f.read().split()[1]) * os.sysconf("SC_PAGE_SIZE")
+    except OSError:
+        return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def websocket_app():
+    return JWTAuthMiddleware(URLRouter(websocket_urlpatterns))
+
+
+def build_game(players, seed=0, title="loadtest"):
+    """A single-round ongoing game with `players` joined players; returns (game, creator token, player tokens)."""
+    rng = random.Random(seed)
+    creator = User.objects.create_user(
+        "loadtest-creator@example.com", "!", full_name="Load Creator", mobile_number="0", role="creator"
+    )
+    User.objects.bulk_create(
+        [
+            User(email=f"loadtest-{i}@example.com", full_name=f"Player {i}", mobile_number="0", password="!")
+            for i in range(players)
+        ],
+        batch_size=2000,
+    )
+    users = list(User.objects.filter(email__startswith="loadtest-", role="player").order_by("id"))
+    game = Game.objects.create(
+        creator=creator, title=title, number_of_users=players, total_prize_pool=1000,
+        date_time="2025-01-01T00:00:00Z", state="ongoing",
+        prize_rounds=[{"id": str(ROUND_ID), "called_numbers": [], "patterns": [
+            {"id": "1.1", "patternName": "early-five", "prizeAmount": "100", "won": False, "wonBy": None},
+            {"id": "1.2", "patternName": "full-housie", "prizeAmount": "900", "won": False, "wonBy": None},
+        ]}],
+    )
+    PlayerGame.objects.bulk_create([PlayerGame(game=game, player=u) for u in users], batch_size=2000)
+    counters.players_joined(game.id, len(users))
+    PlayerTicket.objects.bulk_create(
+        [PlayerTicket(game=game, player=u, round_id=ROUND_ID, ticket_data=random_ticket(rng)) for u in users],
+        batch_size=2000,
+    )
+    tokens = [str(GameRefreshToken.for_user(u).access_token) for u in users]
+    return game, str(GameRefreshToken.for_user(creator).access_token), tokens
+
+
+class Client:
+    """One simulated socket: feeds the app its messages and timestamps what it sends back."""
+
+    def __init__(self, run, token, full_list=False):
+        self.run = run
+        self.token = token
+        self.full_list = full_list
+        self.incoming = asyncio.Queue()
+        self.ready = asyncio.get_running_loop().create_future()
+        self.welcomed = False
+        self.frames = 0
+        self.closed = False
+
+    async def connect(self, app, path):
+        query = f"token={self.token}" + ("&protocol=full" if self.full_list else "")
+        scope = {
+            "type": "websocket", "path": path, "raw_path": path.encode(), "query_string": query.encode(),
+            "headers": [], "subprotocols": [], "client": ("127.0.0.1", 0), "server": ("testserver", 80),
+        }
+        self.task = asyncio.ensure_future(app(scope, self.incoming.get, self.send))
+        started = time.perf_counter()
+        await self.incoming.put({"type": "websocket.connect"})
+        await self.ready
+        return time.perf_counter() - started
+
+    def receive(self, text):
+        self.incoming.put_nowait({"type": "websocket.receive", "text": text})
+
+    async def close(self):
+        if not self.closed:
+            await self.incoming.put({"type": "websocket.disconnect", "code": 1000})
+        await self.task
+
+    async def send(self, message):
+        kind = message["type"]
+        if kind == "websocket.send":
+            now = time.perf_counter()
+            if not self.welcomed:
+                self.welcomed = True  # the welcome; delta clients are ready once the snapshot follows
+                if self.full_list and not self.ready.done():
+                    self.ready.set_result(None)
+                return
+            if not self.ready.done():
+                self.ready.set_result(None)
+                return
+            self.frames += 1
+            self.run.frame(self, message["text"], now)
+        elif kind == "websocket.close":
+            self.closed = True
+            if not self.ready.done():
+                self.ready.set_exception(ConnectionError(f"socket closed with code {message.get('code')}"))
+
+
+class LoadRun:
+    def __init__(self, game, creator_token, tokens, draws=90, interval=0.1, full_list=False, connect_concurrency=500):
+        self.game = game
+        self.creator_token = creator_token
+        self.tokens = tokens
+        self.draws = draws
+        self.interval = interval
+        self.full_list = full_list
+        self.connect_concurrency = connect_concurrency
+        self.sent = {}  # seq -> time the creator asked for it
+        self.latencies = []
+        self.first_frame = self.last_frame = None
+        self.errors = []
+
+    def frame(self, client, text, now):
+        """A player got a frame: match its draws to the time they were asked for."""
+        if self.first_frame is None:
+            self.first_frame = now
+        self.last_frame = now
+        if client.full_list:
+            data = json.loads(text)
+            if "called_numbers" in data and "number" in data:
+                self.record(len(data["called_numbers"]), now)
+            return
+        data = json.loads(text)
+        for event in data["events"] if data.get("type") == "batch" else [data]:
+            if event.get("type") == "number":
+                self.record(event["seq"], now)
+
+    def record(self, seq, now):
+        sent = self.sent.get(seq)
+        if sent is not None:
+            self.latencies.append(now - sent)
+
+    def creator_frame(self, client, text, now):
+        if '"error"' in text:
+            self.errors.append(json.loads(text)["error"])
+
+    async def run(self):
+        app = websocket_app()
+        path = f"/ws/game/{self.game.id}/round/{ROUND_ID}/"
+
+        creator = Client(self, self.creator_token, full_list=True)
+        creator.run = _CreatorSink(self)
+        await creator.connect(app, path)
+
+        rss_before = rss_bytes()
+        limit = asyncio.Semaphore(self.connect_concurrency)
+        players = [Client(self, token, self.full_list) for token in self.tokens]
+
+        async def connect(client):
+            async with limit:
+                return await client.connect(app, path)
+
+        started = time.perf_counter()
+        connect_times = await asyncio.gather(*(connect(c) for c in players))
+        connect_wall = time.perf_counter() - started
+        rss_after = rss_bytes()
+
+        for seq in range(1, self.draws + 1):
+            self.sent[seq] = time.perf_counter()
+            creator.receive('{"action": "generate_number"}')
+            await asyncio.sleep(self.interval)
+
+        expected = len(players) * self.draws
+        deadline = time.perf_counter() + max(5.0, self.interval * 10)
+        while len(self.latencies) < expected and time.perf_counter() < deadline:
+            await asyncio.sleep(0.05)
+
+        from wsapp import coalesce, outbox, pipeline
+        await coalesce.flush_all()
+        await pipeline.drain()
+        outboxes = outbox.stats()
+        for client in players + [creator]:
+            await client.close()
+
+        elapsed = (self.last_frame - self.first_frame) if self.first_frame else 0
+        return {
+            "clients": len(players),
+            "draws": self.draws,
+            "connect": percentiles(connect_times),
+            "connect_wall_s": round(connect_wall, 3),
+            "latency": percentiles(self.latencies) if self.latencies else None,
+            "received": len(self.latencies),
+            "expected": expected,
+            "frames": sum(c.frames for c in players),
+            "messages_per_s": round(sum(c.frames for c in players) / elapsed, 1) if elapsed else None,
+            "rss_per_connection_kib": round((rss_after - rss_before) / max(1, len(players)) / 1024, 2),
+            "rss_mib": round(rss_bytes() / 2 ** 20, 1),
+            "outbox": outboxes,
+            "principals": principals.stats(),
+            "errors": self.errors,
+        }
+
+
+class _CreatorSink:
+    """Routes the creator's frames to LoadRun.creator_frame (its draws aren't timed)."""
+
+    def __init__(self, run):
+        self.run = run
+
+    def frame(self, client, text, now):
+        self.run.creator_frame(client, text, now)
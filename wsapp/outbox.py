@@ -0,0 +1,181 @@
+"""
+Bounded outbound queue of a socket.
+
+GameConsumer used to await every send from its handlers, so a client on a
+slow link held up its consumer: the consumer stopped reading its channel,
+room messages piled up in the channel layer, and once the layer's capacity
+was reached new draws were dropped without a trace. Now the handlers only
+queue frames in the socket's Outbox, and a task of its own sends them.
+
+    - Bounded: an Outbox holds at most WS_OUTBOX_SIZE frames.
+    - Drop to resync: when it is full, the queued draws are dropped and one
+      resync is queued in their place. The resync frame (a snapshot for
+      delta clients) is built when it is sent, so it covers every draw that
+      was dropped. Other frames (winners, replies to the client) are kept.
+    - Slow clients: with WS_SLOW_CLIENT_MAX_RESYNCS set, a socket that needs
+      more resyncs than that within WS_SLOW_CLIENT_WINDOW seconds is closed
+      (code 4008), as is one whose queue is full of frames it can't drop.
+    - Server buffers: a server whose websocket send waits for the client
+      (uvicorn, the load test's transport) leaves the backlog here. Daphne
+      returns at once and buffers without limit, so the Outbox also waits
+      while the server holds more than WS_OUTBOX_MAX_BACKLOG bytes for the
+      socket (server_backlog() reads it from daphne's transport). On servers
+      it can't read, a slow client's frames pile up in the server instead,
+      and nothing here is dropped or closed.
+
+stats() counts the open outboxes, the ones lagging right now and, since the
+process started, the resyncs, dropped frames and sockets closed for being
+slow. They are logged (at most once every STATS_LOG_INTERVAL seconds) when a
+socket falls behind or is closed.
+"""
+import asyncio
+import collections
+import logging
+import time
+import weakref
+
+logger = logging.getLogger(__name__)
+
+SLOW_CLIENT_CLOSE_CODE = 4008
+
+_outboxes = weakref.WeakSet()
+_counters = {"resyncs": 0, "dropped_frames": 0, "slow_closes": 0}
+
+RESYNC = None  # queued in place of dropped draws
+
+DRAIN_INTERVAL = 0.05  # seconds between looks at a full server buffer
+STATS_LOG_INTERVAL = 60
+_last_logged = 0.0
+
+
+def server_backlog(send):
+    """
+    A callable returning the bytes the server still holds for a socket, given
+    the ASGI `send` it was handed, or None for servers it can't read. Daphne's
+    send is functools.partial(server.handle_reply, protocol); the protocol's
+    Twisted transport keeps what it hasn't written in dataBuffer (from offset
+    on) and _tempDataBuffer (_tempDataLen bytes).
+    """
+    args = getattr(send, "args", ())
+    transport = getattr(args[0], "transport", None) if args else None
+    while transport is not None and not hasattr(transport, "dataBuffer"):
+        transport = getattr(transport, "transport", None)  # TLS wraps the TCP transport
+    if transport is None:
+        return None
+    return lambda: len(transport.dataBuffer) - transport.offset + transport._tempDataLen
+
+
+class Outbox:
+    def __init__(self, send, resync_frame, close, size, max_resyncs=0, window=60, backlog=None, max_backlog=0):
+        """
+        `send(text)` sends one frame, `resync_frame()` returns the frame that
+        replaces dropped draws, `close()` closes the socket; all coroutines.
+        With `backlog` (see server_backlog) and `max_backlog`, frames wait
+        while the server holds more than `max_backlog` bytes for the socket.
+        """
+        self._send = send
+        self._resync_frame = resync_frame
+        self._close = close
+        self.size = size
+        self.max_resyncs = max_resyncs
+        self.window = window
+        self._backlog = backlog if max_backlog > 0 else None
+        self.max_backlog = max_backlog
+        self.items = collections.deque()  # (frames, droppable), or (RESYNC, False)
+        self.resync_pending = False
+        self.resync_times = collections.deque()
+        self.closed = False
+        self._ready = asyncio.Event()
+        self._task = asyncio.ensure_future(self._run())
+        _outboxes.add(self)
+
+    @property
+    def lagging(self):
+        return self.resync_pending or len(self.items) * 2 >= self.size
+
+    def put(self, frames, droppable=False):
+        """
+        Queue `frames` (sent together, in order). Droppable frames are draws,
+        which a resync replaces when the client falls behind.
+        """
+        if self.closed:
+            return
+        if droppable and self.resync_pending:
+            _counters["dropped_frames"] += len(frames)  # the queued resync will cover them
+            return
+        if len(self.items) >= self.size:
+            self._fall_behind()
+            if self.closed or droppable:
+                return  # the queued resync covers these draws
+            if len(self.items) >= self.size:
+                logger.warning("Closing a socket whose %s queued frames can't be dropped", len(self.items))
+                self._give_up()
+                return
+        self.items.append((frames, droppable))
+        self._ready.set()
+
+    def _fall_behind(self):
+        kept = collections.deque(item for item in self.items if not item[1])
+        _counters["dropped_frames"] += sum(len(frames) for frames, droppable in self.items if droppable)
+        self.items = kept
+        if self.resync_pending:
+            return  # the resync already queued is built later than any of the dropped draws
+        self.items.append((RESYNC, False))
+        self.resync_pending = True
+        _counters["resyncs"] += 1
+
+        now = time.monotonic()
+        self.resync_times.append(now)
+        while self.resync_times[0] < now - self.window:
+            self.resync_times.popleft()
+        if self.max_resyncs and len(self.resync_times) > self.max_resyncs:
+            logger.warning("Closing a socket that needed %s resyncs in %ss", len(self.resync_times), self.window)
+            self._give_up()
+        else:
+            _log_stats()
+
+    def _give_up(self):
+        _counters["slow_closes"] += 1
+        self.close()
+        asyncio.ensure_future(self._close())
+        _log_stats()
+
+    def close(self):
+        """Stop sending and drop whatever is queued."""
+        self.closed = True
+        self.items.clear()
+        self._task.cancel()
+
+    async def _run(self):
+        while True:
+            await self._ready.wait()
+            while self.items:
+                # frames stay queued (and droppable) while the server sits on a backlog
+                while self._backlog is not None and self._backlog() > self.max_backlog:
+                    await asyncio.sleep(DRAIN_INTERVAL)
+                if not self.items:
+                    break
+                frames, _ = self.items.popleft()
+                if frames is RESYNC:
+                    self.resync_pending = False
+                    frames = (await self._resync_frame(),)
+                for frame in frames:
+                    await self._send(frame)
+            self._ready.clear()
+
+
+def stats():
+    outboxes = [outbox for outbox in list(_outboxes) if not outbox.closed]
+    return {
+        "sockets": len(outboxes),
+        "lagging": sum(1 for outbox in outboxes if outbox.lagging),
+        **_counters,
+    }
+
+
+def _log_stats():
+    global _last_logged
+    now = time.monotonic()
+    if now - _last_logged >= STATS_LOG_INTERVAL:
+        _last_logged = now
+        logger.info("Outboxes: %s", stats())
@@ -0,0 +1,107 @@
+"""
+Background winner checks.
+
+A draw doesn't wait for its winner check: announce_draw broadcasts the
+number and queues a check of the round as of that draw (its seq). A small
+pipeline of workers per event loop takes the checks off the queues, pays
+the winners (GameWinnerHandler.assign_winners) and broadcasts
+winner_announced.
+
+    - Ordering: a round always goes to the same queue, and each queue has
+      one worker, so a round's draws are checked one at a time and in order.
+    - Bounded: each queue holds at most WINNER_PIPELINE_DEPTH checks. When
+      one is full, submit() waits, which slows the draws feeding it instead
+      of letting checks pile up.
+
+The checks run in a thread pool shared by all pipelines of the process, not
+in processes: they use this process's ticket cache (core.cache) and
+database connection. WINNER_PIPELINE_WORKERS = 0 turns the pipeline off
+and checks winners inline, before announce_draw returns.
+"""
+import asyncio
+import logging
+import weakref
+from concurrent.futures import ThreadPoolExecutor
+
+from django.conf import settings
+from django.db import close_old_connections
+
+from core.ops import GameWinnerHandler
+from wsapp.coalesce import broadcast
+from wsapp.consumers import _prepare_winner_payload, room_group_name, winner_event
+
+logger = logging.getLogger(__name__)
+
+_executor = None
+_pipelines = weakref.WeakKeyDictionary()  # event loop -> WinnerPipeline
+
+
+def check_executor():
+    global _executor
+    if _executor is None:
+        _executor = ThreadPoolExecutor(settings.WINNER_PIPELINE_WORKERS, thread_name_prefix="winner-check")
+    return _executor
+
+
+class WinnerPipeline:
+    def __init__(self, channel_layer, workers, depth, backend=None):
+        self.channel_layer = channel_layer
+        self.handler = GameWinnerHandler(backend)
+        self.queues = [asyncio.Queue(depth) for _ in range(workers)]
+        self.workers = [asyncio.ensure_future(self._work(queue)) for queue in self.queues]
+
+    def queue_for(self, game_id, round_id):
+        return self.queues[hash((int(game_id), int(round_id))) % len(self.queues)]
+
+    async def submit(self, game_id, round_id, seq):
+        """Queue a winner check of the round as of its `seq`-th number; waits while the round's queue is full."""
+        await self.queue_for(game_id, round_id).put((game_id, round_id, seq))
+
+    async def drain(self):
+        """Wait until every queued check has been done."""
+        for queue in self.queues:
+            await queue.join()
+
+    async def _work(self, queue):
+        loop = asyncio.get_running_loop()
+        while True:
+            game_id, round_id, seq = await queue.get()
+            try:
+                winner_result = await loop.run_in_executor(check_executor(), self._check, game_id, round_id, seq)
+                if winner_result.get("winners"):
+                    await broadcast(
+                        self.channel_layer,
+                        room_group_name(game_id, round_id),
+                        winner_event(await _prepare_winner_payload(winner_result)),
+                    )
+            except Exception:
+                logger.exception("Winner check of game %s round %s (draw %s) failed", game_id, round_id, seq)
+            finally:
+                queue.task_done()
+
+    def _check(self, game_id, round_id, seq):
+        close_old_connections()
+        try:
+            return self.handler.assign_winners(game_id, round_id, seq)
+        finally:
+            close_old_connections()
+
+
+def winner_pipeline(channel_layer):
+    """The running event loop's pipeline, started on first use. None when the pipeline is turned off."""
+    if settings.WINNER_PIPELINE_WORKERS <= 0:
+        return None
+    loop = asyncio.get_running_loop()
+    pipeline = _pipelines.get(loop)
+    if pipeline is None:
+        pipeline = _pipelines[loop] = WinnerPipeline(
+            channel_layer, settings.WINNER_PIPELINE_WORKERS, settings.WINNER_PIPELINE_DEPTH
+        )
+    return pipeline
+
+
+async def drain():
+    """Wait for the running loop's pipeline to finish its queued checks (tests, benchmarks)."""
+    pipeline = _pipelines.get(asyncio.get_running_loop())
+    if pipeline is not None:
+        await pipeline.drain()
@@ -10,4 +10,5 @@ websocket_urlpatterns = [
 
 # Example URL: ws://<host>/ws/game/1/2/ for game_id=1 and round_id=2
 
-# new ws://localhost:8000/ws/game/1/round/1/?token=<JWT>
\ No newline at end of file
+# new ws://localhost:8000/ws/game/1/round/1/?token=<JWT>
+# legacy clients that want the full called_numbers list on every draw: ...&protocol=full
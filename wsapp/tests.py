@@ -1,3 +1,373 @@
-from django.test import TestCase
+import asyncio
+import functools
+import json
+import random
+from unittest import mock
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
+from channels.layers import InMemoryChannelLayer, get_channel_layer
+from channels.routing import URLRouter
+from channels.testing import WebsocketCommunicator
+from django.test import SimpleTestCase, TransactionTestCase, override_settings
+from django.utils import timezone
+
+from core import live, rounds
+from core.models import Game, Pattern, PlayerGame, PlayerTicket, User
+from core.ops import Checker
+from core.tickets import random_ticket
+from wsapp import caller, outbox, pipeline
+from wsapp.caller import AutoCaller, TimerWheel
+from wsapp.consumers import announce_draw
+from wsapp.routing import websocket_urlpatterns
+
+application = URLRouter(websocket_urlpatterns)
+
+
+class NumberProtocolTests(TransactionTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(live, "_store", live.MemoryStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.creator = User.objects.create_user("creator@example.com", "pw", full_name="C", mobile_number="1", role="creator")
+        self.player = User.objects.create_user("player@example.com", "pw", full_name="P", mobile_number="1")
+        self.game = Game.objects.create(
+            creator=self.creator, title="G", number_of_users=10, total_prize_pool=100, date_time=timezone.now(),
+            state="ongoing", prize_rounds=[{"id": "1", "called_numbers": [], "patterns": []}],
+        )
+
+    async def connect(self, user, query=""):
+        communicator = WebsocketCommunicator(application, f"/ws/game/{self.game.id}/round/1/{query}")
+        communicator.scope["user"] = user
+        connected, _ = await communicator.connect()
+        self.assertTrue(connected)
+        await communicator.receive_json_from()  # welcome
+        return communicator
+
+    def test_draws_are_sent_as_deltas_with_a_snapshot_to_resync(self):
+        async def run():
+            creator = await self.connect(self.creator, "?protocol=full")
+            player = await self.connect(self.player)
+            self.assertEqual(await player.receive_json_from(), {"type": "snapshot", "seq": 0, "called_numbers": []})
+
+            numbers = []
+            for seq in (1, 2, 3):
+                await creator.send_json_to({"action": "generate_number"})
+                full = await creator.receive_json_from()
+                delta = await player.receive_json_from()
+                numbers.append(delta["number"])
+                self.assertEqual(delta, {"type": "number", "seq": seq, "number": full["number"]})
+                self.assertEqual(full["called_numbers"], numbers)
+
+            await player.send_json_to({"action": "resync"})
+            self.assertEqual(await player.receive_json_from(), {"type": "snapshot", "seq": 3, "called_numbers": numbers})
+            await pipeline.drain()
+            await creator.disconnect()
+            await player.disconnect()
+
+        async_to_sync(run)()
+
+
+    def test_check_winners_skips_an_unchanged_snapshot(self):
+        async def run():
+            player = await self.connect(self.player, "?protocol=full")
+            await player.send_json_to({"action": "check_winners"})
+            reply = await player.receive_json_from()
+            self.assertEqual(reply["all_winners"], [])
+            await player.send_json_to({"action": "check_winners", "version": reply["version"]})
+            self.assertEqual(await player.receive_json_from(), {"message": "Winners unchanged", "version": reply["version"]})
+            await player.disconnect()
+
+        async_to_sync(run)()
+
+    @override_settings(WS_COALESCE_WINDOW_MS=40)
+    def test_coalesced_draws_arrive_as_one_batch_frame_in_order(self):
+        async def run():
+            legacy = await self.connect(self.player, "?protocol=full")
+            player = await self.connect(self.player)
+            await player.receive_json_from()  # snapshot
+
+            loop = asyncio.get_running_loop()
+            started = loop.time()
+            numbers = [(await announce_draw(get_channel_layer(), self.game.id, 1))["number"] for _ in range(3)]
+            batch = await player.receive_json_from()
+            waited = loop.time() - started
+            self.assertEqual(batch, {"type": "batch", "events": [
+                {"type": "number", "seq": seq, "number": number} for seq, number in enumerate(numbers, start=1)
+            ]})
+            self.assertLess(waited, 0.5)
+            self.assertEqual([(await legacy.receive_json_from())["number"] for _ in range(3)], numbers)
+            self.assertTrue(await player.receive_nothing(0.1))
+            await pipeline.drain()
+            await legacy.disconnect()
+            await player.disconnect()
+
+        async_to_sync(run)()
+
+
+class OutboxTests(SimpleTestCase):
+    def test_a_lagging_client_skips_draws_for_one_resync_and_keeps_winners(self):
+        async def run():
+            sent, closed = [], []
+            link = asyncio.Event()  # the client's link: sends wait on it
+
+            async def send(frame):
+                await link.wait()
+                sent.append(frame)
+
+            async def resync_frame():
+                return "snapshot"
+
+            async def close():
+                closed.append(True)
+
+            box = outbox.Outbox(send, resync_frame, close, size=3, max_resyncs=1)
+            before = outbox.stats()
+            for seq in range(1, 6):
+                box.put((f"draw {seq}",), droppable=True)
+                await asyncio.sleep(0)
+                if seq == 3:
+                    box.put(("winners",))
+            self.assertTrue(box.lagging)
+            link.set()
+            while box.items:
+                await asyncio.sleep(0)
+            await asyncio.sleep(0)
+            # draw 1 was already on its way; 2 to 5 went for the snapshot
+            self.assertEqual(sent, ["draw 1", "winners", "snapshot"])
+            self.assertFalse(box.lagging)
+
+            link.clear()
+            for seq in range(6, 12):
+                box.put((f"draw {seq}",), droppable=True)
+            # a second resync within the window closes the slow socket
+            await asyncio.sleep(0)
+            self.assertEqual(closed, [True])
+            after = outbox.stats()
+            self.assertEqual(after["resyncs"] - before["resyncs"], 2)
+            self.assertEqual(after["slow_closes"] - before["slow_closes"], 1)
+
+        async_to_sync(run)()
+
+
+    def test_draws_wait_for_a_server_buffer_and_fall_behind_there(self):
+        async def run():
+            sent, buffered = [], [0]
+
+            async def send(frame):
+                sent.append(frame)
+                buffered[0] += 100  # a server that buffers instead of waiting (daphne)
+
+            async def resync_frame():
+                return "snapshot"
+
+            async def close():
+                pass
+
+            box = outbox.Outbox(send, resync_frame, close, size=3, backlog=lambda: buffered[0], max_backlog=150)
+            for seq in range(1, 8):
+                box.put((f"draw {seq}",), droppable=True)
+                await asyncio.sleep(0)
+            # two frames fill the server's buffer; the rest wait here until it drains, then fall behind
+            self.assertEqual(sent, ["draw 1", "draw 2"])
+            self.assertTrue(box.lagging)
+            buffered[0] = 0
+            await asyncio.sleep(outbox.DRAIN_INTERVAL * 2)
+            self.assertEqual(sent, ["draw 1", "draw 2", "snapshot"])
+            box.close()
+
+        async_to_sync(run)()
+
+    def test_server_backlog_reads_daphnes_transport(self):
+        transport = mock.Mock(dataBuffer=b"x" * 10, offset=4, _tempDataLen=7)
+        protocol = mock.Mock(transport=mock.Mock(spec=["transport"], transport=transport))  # behind TLS
+
+        async def handle_reply(protocol, message):
+            pass
+
+        self.assertEqual(outbox.server_backlog(functools.partial(handle_reply, protocol))(), 13)
+        self.assertIsNone(outbox.server_backlog(handle_reply))
+
+
+class StartupTests(SimpleTestCase):
+    def test_background_work_starts_once_on_the_servers_loop(self):
+        from backserver import asgi
+
+        inner = mock.AsyncMock()
+        app = asgi.Startup(inner)
+
+        async def run():
+            messages = iter([{"type": "lifespan.startup"}, {"type": "lifespan.shutdown"}])
+            sent = []
+
+            async def receive():
+                return next(messages)
+
+            async def send(message):
+                sent.append(message["type"])
+
+            await app({"type": "lifespan"}, receive, send)
+            await app({"type": "websocket"}, receive, send)
+            self.assertEqual(sent, ["lifespan.startup.complete", "lifespan.shutdown.complete"])
+            inner.assert_awaited_once()
+            # the caller's draws share this loop's winner pipeline with the creator's sockets
+            self.assertIs(caller._caller_task.get_loop(), asyncio.get_running_loop())
+            await caller._caller_task
+
+        with mock.patch.object(asgi.live, "start_flusher") as start_flusher, mock.patch.object(caller, "_caller_task", None):
+            with mock.patch.object(caller, "AutoCaller") as auto_caller:
+                auto_caller.return_value.run = mock.AsyncMock()
+                async_to_sync(run)()
+        start_flusher.assert_called_once()
+        auto_caller.assert_called_once()
+
+
+class TimerWheelTests(SimpleTestCase):
+    def test_timers_fire_after_their_ticks_including_extra_laps(self):
+        wheel = TimerWheel(slots=8)
+        wheel.schedule("a", 3)
+        wheel.schedule("b", 20)
+        wheel.schedule("c", 5)
+        wheel.cancel("c")
+        fired = {}
+        for tick in range(1, 25):
+            for key in wheel.advance():
+                fired[key] = tick
+        self.assertEqual(fired, {"a": 3, "b": 20})
+        self.assertEqual(len(wheel), 0)
+
+
+class AutoCallerTests(TransactionTestCase):
+    def setUp(self):
+        patcher = mock.patch.object(live, "_store", live.MemoryStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        creator = User.objects.create_user("creator@example.com", "pw", full_name="C", mobile_number="1", role="creator")
+        self.game = Game.objects.create(
+            creator=creator, title="G", number_of_users=10, total_prize_pool=100, date_time=timezone.now(),
+            state="ongoing", prize_rounds=[{"id": "1", "called_numbers": [], "patterns": []}],
+        )
+        self.key = (self.game.id, 1)
+
+    def test_one_caller_holds_the_round_and_pausing_stops_draws(self):
+        async def run():
+            layer = InMemoryChannelLayer()
+            first = AutoCaller(layer, tick=0.1, lease=30, owner="first")
+            second = AutoCaller(layer, tick=0.1, lease=30, owner="second")
+            await database_sync_to_async(live.set_autocall)(self.game.id, 1, 0.3)
+            await first.sync()
+            await second.sync()
+            self.assertEqual(first.rounds, {self.key: 0.3})
+            self.assertEqual(second.rounds, {})
+
+            async def tick(caller, count):
+                for _ in range(count):
+                    caller.advance()
+                    await asyncio.sleep(0)
+                    while caller.running:
+                        await asyncio.sleep(0.01)
+
+            await tick(first, 9)
+            self.assertEqual(len(await database_sync_to_async(live.called_numbers)(*self.key)), 3)
+
+            await database_sync_to_async(Game.objects.filter(id=self.game.id).update)(state="paused")
+            await database_sync_to_async(live.set_game_state)(self.game.id, "paused")
+            await tick(first, 6)
+            self.assertEqual(len(await database_sync_to_async(live.called_numbers)(*self.key)), 3)
+
+            await database_sync_to_async(Game.objects.filter(id=self.game.id).update)(state="completed")
+            await database_sync_to_async(live.set_game_state)(self.game.id, "completed")
+            await tick(first, 3)
+            self.assertEqual(first.rounds, {})
+            self.assertEqual(await database_sync_to_async(live.autocall_rounds)(), {})
+            await pipeline.drain()
+
+        async_to_sync(run)()
+
+
+    def test_the_caller_stops_once_every_pattern_is_won(self):
+        pattern = {"id": "1.1", "patternName": "early-five", "prizeAmount": "10", "won": False, "wonBy": None}
+        Game.objects.filter(id=self.game.id).update(prize_rounds=[{"id": "1", "called_numbers": [], "patterns": [pattern]}])
+        self.game.refresh_from_db()
+        rounds.sync_rounds(self.game)
+
+        async def run():
+            caller = AutoCaller(InMemoryChannelLayer(), tick=0.1, lease=30, owner="first")
+            await database_sync_to_async(live.set_autocall)(self.game.id, 1, 0.1)
+            await caller.sync()
+            await caller.fire(self.key)
+            self.assertIn(self.key, caller.rounds)
+            await database_sync_to_async(live.claim_patterns)(self.game.id, 1, ["1.1"])
+            await caller.fire(self.key)
+            self.assertEqual(caller.rounds, {})
+            self.assertEqual(await database_sync_to_async(live.autocall_rounds)(), {})
+            self.assertEqual(len(await database_sync_to_async(live.called_numbers)(*self.key)), 1)
+            await pipeline.drain()
+
+        async_to_sync(run)()
+
+
+class WinnerPipelineTests(TransactionTestCase):
+    PATTERNS = ["early-five", "any-one-line", "full-housie"]
+
+    def setUp(self):
+        patcher = mock.patch.object(live, "_store", live.MemoryStore())
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        creator = User.objects.create_user("creator@example.com", "pw", full_name="C", mobile_number="1", role="creator")
+        self.game = Game.objects.create(
+            creator=creator, title="G", number_of_users=30, total_prize_pool=300, date_time=timezone.now(),
+            state="ongoing", prize_rounds=[{"id": "1", "called_numbers": [], "patterns": [
+                {"id": f"1.{i}", "patternName": name, "prizeAmount": "100", "won": False, "wonBy": None}
+                for i, name in enumerate(self.PATTERNS, start=1)
+            ]}],
+        )
+        rng = random.Random(3)
+        self.tickets = {}
+        User.objects.bulk_create([
+            User(email=f"p{i}@example.com", full_name=f"P{i}", mobile_number="1", password="!") for i in range(30)
+        ])
+        for player in User.objects.filter(role="player"):
+            PlayerGame.objects.create(player=player, game=self.game)
+            self.tickets[player.id] = random_ticket(rng)
+            PlayerTicket.objects.create(player=player, game=self.game, round_id=1, ticket_data=self.tickets[player.id])
+
+    def test_queued_checks_pay_the_winners_of_the_draw_that_made_them(self):
+        layer = InMemoryChannelLayer()
+
+        async def run():
+            channel = await layer.new_channel()
+            await layer.group_add(f"game_{self.game.id}_round_1", channel)
+            for _ in range(89):
+                await announce_draw(layer, self.game.id, 1)  # no waiting on the checks in between
+            # the last draw writes the deck back; in-memory SQLite can't take that alongside the checks' writes
+            await pipeline.drain()
+            await announce_draw(layer, self.game.id, 1)
+            await pipeline.drain()
+            announced = []
+            while True:
+                try:
+                    message = await asyncio.wait_for(layer.receive(channel), 0.05)
+                except asyncio.TimeoutError:
+                    return announced
+                if message["type"] == "winner_announced":
+                    announced.extend(json.loads(message["frame"])["winners"])
+
+        announced = async_to_sync(run)()
+        called = live.called_numbers(self.game.id, 1)
+        checker = Checker()
+        expected = {}
+        for i, name in enumerate(self.PATTERNS, start=1):
+            for seq in range(1, 91):
+                won = sorted(
+                    pid for pid, ticket in self.tickets.items()
+                    if checker.check_patterns(ticket, called[:seq], [name])[name]
+                )
+                if won:
+                    expected[f"1.{i}"] = won
+                    break
+        self.assertEqual({w["pattern_id"]: sorted(p["player_id"] for p in w["winners"]) for w in announced}, expected)
+        names = dict(User.objects.values_list("id", "full_name"))
+        self.assertTrue(all(p["player_name"] == names[p["player_id"]] for w in announced for p in w["winners"]))
+        patterns = Pattern.objects.filter(round__game=self.game, won=True)
+        self.assertEqual({p.pattern_id: sorted(p.won_by) for p in patterns}, expected)